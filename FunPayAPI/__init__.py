@@ -1,5 +1,5 @@
 from .account import Account
-from .updater.runner import Runner
+from .updater.runner import Runner, PollController
 from .updater import events
 from .common import exceptions, utils, enums
 from . import types
@@ -9,6 +9,9 @@ if TYPE_CHECKING:
     from .updater.runner import Runner
 
 from requests_toolbelt import MultipartEncoder
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http.cookiejar import DefaultCookiePolicy
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 import requests
@@ -18,12 +21,19 @@ import string
 import json
 import time
 import re
+import threading
 
 from . import types
-from .common import exceptions, utils, enums
+from .common import exceptions, utils, enums, parsing
 
 logger = logging.getLogger("FunPayAPI.account")
 PRIVATE_CHAT_ID_RE = re.compile(r"users-\d+-\d+$")
+CHAT_NAME_MISS_TTL = 30
+"""Сколько секунд get_chat_by_name(make_request=True) не запрашивает чаты повторно для ненайденного имени."""
+FLOOD_ERROR_MESSAGES = ("Нельзя отправлять сообщения слишком часто.",
+                        "You cannot send messages too frequently.",
+                        "Не можна надсилати повідомлення занадто часто.")
+"""Тексты ошибки runner/, которыми FunPay (с HTTP 200) отклоняет слишком частую отправку сообщений."""
 
 
 class Account:
@@ -44,11 +54,21 @@ class Account:
 
     :param locale: текущий язык аккаунта, опционально.
     :type locale: :obj:`Literal["ru", "en", "uk"]` or :obj:`None`
+
+    :param pool_maxsize: максимальное кол-во keep-alive соединений с одним хостом (по одному на поток).
+    :type pool_maxsize: :obj:`int`, опционально
+
+    :param max_retries: кол-во повторных попыток при ошибках соединения и 5xx ответах на идемпотентные запросы.
+    :type max_retries: :obj:`int`, опционально
+
+    :param retry_backoff: множитель экспоненциальной задержки между повторными попытками (в секундах).
+    :type retry_backoff: :obj:`float`, опционально
     """
 
     def __init__(self, golden_key: str, user_agent: str | None = None,
                  requests_timeout: int | float = 10, proxy: Optional[dict] = None,
-                 locale: Literal["ru", "en", "uk"] | None = None):
+                 locale: Literal["ru", "en", "uk"] | None = None, pool_maxsize: int = 16,
+                 max_retries: int = 3, retry_backoff: float = 0.5):
         self.golden_key: str = golden_key
         """Токен (golden_key) аккаунта."""
         self.user_agent: str | None = user_agent
@@ -57,6 +77,8 @@ class Account:
         """Тайм-аут ожидания ответа на запросы."""
         self.proxy = proxy
         """Прокси"""
+        self.session: requests.Session = self.create_session(pool_maxsize, max_retries, retry_backoff)
+        """HTTP-сессия с пулом keep-alive соединений. Общая для Runner'а и всех потоков, использующих аккаунт."""
         self.html: str | None = None
         """HTML основной страницы FunPay."""
         self.app_data: dict | None = None
@@ -71,6 +93,8 @@ class Account:
         """Активные покупки."""
         self.last_429_err_time: float = 0
         """Время последнего возникновения 429 ошибки"""
+        self.last_403_err_time: float = 0
+        """Время последнего возникновения 403 ошибки (сессия устарела)"""
         self.last_flood_err_time: float = 0
         """Время последнего возникновения ошибки \"Нельзя отправлять сообщения слишком часто.\""""
         self.__locale: Literal["ru", "en", "uk"] | None = None
@@ -108,6 +132,12 @@ class Account:
         self.__initiated: bool = False
 
         self.__saved_chats: dict[int, types.ChatShortcut] = {}
+        self.__chat_ids_by_name: dict[str, int] = {}
+        """{название чата: id чата} для сохраненных чатов."""
+        self.__chat_name_misses: dict[str, float] = {}
+        """{название чата: время последнего безуспешного запроса чатов}"""
+        self.__chat_index_lock = threading.Lock()
+        """Защищает индекс чатов по названию: его читают потоки отправки сообщений, пока Runner сохраняет чаты."""
         self.runner: Runner | None = None
         """Объект Runner'а."""
         self._logout_link: str | None = None
@@ -186,26 +216,67 @@ class Account:
         if request_method == "get" and locale and locale != self.locale:
             link += f'{"&" if "?" in link else "?"}setlocale={locale}'
         for i in range(10):
-            response = getattr(requests, request_method)(link, headers=headers, data=payload,
-                                                         timeout=self.requests_timeout,
-                                                         proxies=self.proxy or {}, allow_redirects=False)
+            response = self.session.request(request_method, link, headers=headers, data=payload,
+                                            timeout=self.requests_timeout,
+                                            proxies=self.proxy or {}, allow_redirects=False)
             if not (300 <= response.status_code < 400) or 'Location' not in response.headers:
                 break
             link = response.headers['Location']
             update_locale(link)
         else:
-            response = getattr(requests, request_method)(link, headers=headers, data=payload,
-                                                         timeout=self.requests_timeout,
-                                                         proxies=self.proxy or {})
+            response = self.session.request(request_method, link, headers=headers, data=payload,
+                                            timeout=self.requests_timeout,
+                                            proxies=self.proxy or {})
         if response.status_code == 429:
             self.last_429_err_time = time.time()
 
         if response.status_code == 403:
+            self.last_403_err_time = time.time()
             raise exceptions.UnauthorizedError(response)
         elif response.status_code != 200 and raise_not_200:
             raise exceptions.RequestFailedError(response)
         return response
 
+    @staticmethod
+    def create_session(pool_maxsize: int = 16, max_retries: int = 3,
+                       retry_backoff: float = 0.5) -> requests.Session:
+        """
+        Создает HTTP-сессию с пулом keep-alive соединений для запросов к FunPay.
+
+        Куки сессией не сохраняются: golden_key и PHPSESSID передаются в заголовках
+        :meth:`FunPayAPI.account.Account.method`, иначе куки из ответов перезаписывали бы их.
+        POST-запросы повторяются только при ошибках соединения (до отправки тела),
+        чтобы не продублировать сообщение.
+
+        :param pool_maxsize: максимальное кол-во keep-alive соединений с одним хостом.
+        :type pool_maxsize: :obj:`int`
+
+        :param max_retries: кол-во повторных попыток.
+        :type max_retries: :obj:`int`
+
+        :param retry_backoff: множитель экспоненциальной задержки между попытками (в секундах).
+        :type retry_backoff: :obj:`float`
+
+        :return: HTTP-сессия.
+        :rtype: :class:`requests.Session`
+        """
+        retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=max_retries,
+                      backoff_factor=retry_backoff, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+                      raise_on_status=False, respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return session
+
+    def close(self) -> None:
+        """
+        Закрывает все keep-alive соединения HTTP-сессии аккаунта.
+        """
+        self.session.close()
+
     def get(self, update_phpsessid: bool = True) -> Account:
         """
         Получает / обновляет данные об аккаунте. Необходимо вызывать каждые 40-60 минут, дабы обновить
@@ -716,9 +787,7 @@ class Account:
             raise exceptions.MessageNotDeliveredError(response, None, chat_id)
 
         if (error_text := resp.get("error")) is not None:
-            if error_text in ("Нельзя отправлять сообщения слишком часто.",
-                              "You cannot send messages too frequently.",
-                              "Не можна надсилати повідомлення занадто часто."):
+            if error_text in FLOOD_ERROR_MESSAGES:
                 self.last_flood_err_time = time.time()
             raise exceptions.MessageNotDeliveredError(response, error_text, chat_id)
         if leave_as_unread:
@@ -1177,7 +1246,10 @@ class Account:
         :rtype: :class:`FunPayAPI.types.OrderShortcut`
         """
         # todo взаимодействие с покупками
-        return self.runner.saved_orders.get(order_id, self.get_sales(id=order_id)[1][0])
+        # get_sales вызывается, только если заказа нет среди сохраненных Runner'ом
+        if self.runner and (order := self.runner.saved_orders.get(order_id)) is not None:
+            return order
+        return self.get_sales(id=order_id)[1][0]
 
     def get_order(self, order_id: str, locale: Literal["ru", "en", "uk"] | None = None) -> types.Order:
         """
@@ -1315,7 +1387,7 @@ class Account:
         return order
 
     def get_sales(self, start_from: str | None = None, include_paid: bool = True, include_closed: bool = True,
-                  include_refunded: bool = True, exclude_ids: list[str] | None = None,
+                  include_refunded: bool = True, exclude_ids: list[str] | set[str] | None = None,
                   id: Optional[str] = None, buyer: Optional[str] = None,
                   state: Optional[Literal["closed", "paid", "refunded"]] = None, game: Optional[int] = None,
                   section: Optional[str] = None, server: Optional[int] = None,
@@ -1338,8 +1410,9 @@ class Account:
         :param include_refunded: включить ли в список заказы, за которые запрошен возврат средств?
         :type include_refunded: :obj:`bool`, опционально
 
-        :param exclude_ids: исключить заказы с ID из списка (ID заказа должен быть без '#'!).
-        :type exclude_ids: :obj:`list` of :obj:`str`, опционально
+        :param exclude_ids: исключить заказы с ID из списка (ID заказа должен быть без '#'!). Такие заказы
+            не разбираются дальше ID, поэтому передавайте :obj:`set`, если ID много.
+        :type exclude_ids: :obj:`list` or :obj:`set` of :obj:`str`, опционально
 
         :param id: ID заказа.
         :type id: :obj:`str`, опционально
@@ -1393,26 +1466,20 @@ class Account:
             self.locale = self.__default_locale
         html_response = response.content.decode()
 
-        parser = BeautifulSoup(html_response, "lxml")
-        check_user = parser.find("div", {"class": "content-account content-account-login"})
-        if check_user:
+        page = parsing.parse_sales_page(html_response)
+        if page.logged_out:
             raise exceptions.UnauthorizedError(response)
 
-        next_order_id = parser.find("input", {"type": "hidden", "name": "continue"})
-        next_order_id = next_order_id.get("value") if next_order_id else None
-
-        order_divs = parser.find_all("a", {"class": "tc-item"})
+        next_order_id = page.next_order_id
+        order_divs = page.orders
         if not start_from:
             sudcategories = dict()
-            app_data = json.loads(parser.find("body").get("data-app-data"))
+            app_data = json.loads(page.app_data)
             locale = app_data.get("locale")
             self.csrf_token = app_data.get("csrf-token") or self.csrf_token
-            games_options = parser.find("select", attrs={"name": "game"})
-            if games_options:
-                games_options = games_options.find_all(lambda x: x.name == "option" and x.get("value"))
-                for game_option in games_options:
-                    game_name = game_option.text
-                    sections_list = json.loads(game_option.get("data-data"))
+            if page.game_options:
+                for game_name, sections_data in page.game_options:
+                    sections_list = json.loads(sections_data)
                     for key, section_name in sections_list:
                         section_type, section_id = key.split("-")
                         section_type = types.SubCategoryTypes.COMMON if section_type == "lot" else types.SubCategoryTypes.CURRENCY
@@ -1425,7 +1492,7 @@ class Account:
 
         sales = []
         for div in order_divs:
-            classname = div.get("class")
+            classname = div.classes
             if "warning" in classname:
                 if not include_refunded:
                     continue
@@ -1439,26 +1506,24 @@ class Account:
                     continue
                 order_status = types.OrderStatuses.CLOSED
 
-            order_id = div.find("div", {"class": "tc-order"}).text[1:]
+            order_id = div.order_id[1:]
             if order_id in exclude_ids:
                 continue
 
-            description = div.find("div", {"class": "order-desc"}).find("div").text
-            tc_price = div.find("div", {"class": "tc-price"}).text
-            price, currency = tc_price.rsplit(maxsplit=1)
+            description = div.description
+            price, currency = div.price.rsplit(maxsplit=1)
             price = float(price.replace(" ", ""))
             currency = parse_currency(currency)
 
-            buyer_div = div.find("div", {"class": "media-user-name"}).find("span")
-            buyer_username = buyer_div.text
-            buyer_id = int(buyer_div.get("data-href")[:-1].split("/users/")[1])
-            subcategory_name = div.find("div", {"class": "text-muted"}).text
+            buyer_username = div.buyer_username
+            buyer_id = int(div.buyer_href[:-1].split("/users/")[1])
+            subcategory_name = div.subcategory_name
             subcategory = None
             if sudcategories:
                 subcategory = sudcategories.get(subcategory_name)
 
             now = datetime.now()
-            order_date_text = div.find("div", {"class": "tc-date-time"}).text
+            order_date_text = div.date
             if any(today in order_date_text for today in ("сегодня", "сьогодні", "today")):  # сегодня, ЧЧ:ММ
                 h, m = order_date_text.split(", ")[1].split(":")
                 order_date = datetime(now.year, now.month, now.day, int(h), int(m))
@@ -1478,10 +1543,9 @@ class Account:
                 day, month, year = int(day), utils.MONTHS[month], int(year)
                 h, m = split[1].split(":")
                 order_date = datetime(year, month, day, int(h), int(m))
-            id1, id2 = sorted([buyer_id, self.id])
-            chat_id = f"users-{id1}-{id2}"
+            chat_id = self.get_private_chat_id(buyer_id)
             order_obj = types.OrderShortcut(order_id, description, price, currency, buyer_username, buyer_id, chat_id,
-                                            order_status, order_date, subcategory_name, subcategory, str(div))
+                                            order_status, order_date, subcategory_name, subcategory, div.html)
             sales.append(order_obj)
 
         return next_order_id, sales, locale, sudcategories
@@ -1505,8 +1569,12 @@ class Account:
         :param chats: объекты чатов.
         :type chats: :obj:`list` of :class:`FunPayAPI.types.ChatShortcut`
         """
-        for i in chats:
-            self.__saved_chats[i.id] = i
+        with self.__chat_index_lock:
+            for i in chats:
+                self.__saved_chats[i.id] = i
+                if i.name:
+                    self.__chat_ids_by_name[i.name] = i.id
+                    self.__chat_name_misses.pop(i.name, None)
 
     def request_chats(self) -> list[types.ChatShortcut]:
         """
@@ -1542,17 +1610,12 @@ class Account:
         if not msgs:
             return []
 
-        parser = BeautifulSoup(msgs, "lxml")
-        chats = parser.find_all("a", {"class": "contact-item"})
         chats_objs = []
 
-        for msg in chats:
-            chat_id = int(msg["data-id"])
-            last_msg_text = msg.find("div", {"class": "contact-item-message"}).text
-            unread = True if "unread" in msg.get("class") else False
-            chat_with = msg.find("div", {"class": "media-user-name"}).text
-            node_msg_id = int(msg.get('data-node-msg'))
-            user_msg_id = int(msg.get('data-user-msg'))
+        for msg in parsing.parse_chat_bookmarks(msgs):
+            # Если чат удален админами - скип.
+            if (last_msg_text := msg.last_message_text) is None:
+                continue
             by_bot = False
             by_vertex = False
             is_image = last_msg_text in ("Изображение", "Зображення", "Image")
@@ -1562,7 +1625,8 @@ class Account:
             elif last_msg_text.startswith(self.old_bot_character):
                 last_msg_text = last_msg_text[1:]
                 by_vertex = True
-            chat_obj = types.ChatShortcut(chat_id, chat_with, last_msg_text, node_msg_id, user_msg_id, unread, str(msg))
+            chat_obj = types.ChatShortcut(msg.id, msg.name, last_msg_text, msg.node_msg_id, msg.user_msg_id,
+                                          msg.unread, msg.html)
             if not is_image:
                 chat_obj.last_by_bot = by_bot
                 chat_obj.last_by_vertex = by_vertex
@@ -1603,16 +1667,32 @@ class Account:
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
 
-        for i in self.__saved_chats:
-            if self.__saved_chats[i].name == name:
-                return self.__saved_chats[i]
+        if (chat := self.__find_chat_by_name(name)) is not None or not make_request:
+            return chat
 
-        if make_request:
-            self.add_chats(self.request_chats())
-            return self.get_chat_by_name(name)
-        else:
+        # Имя недавно искали безуспешно - не запрашиваем список чатов повторно
+        with self.__chat_index_lock:
+            missed_at = self.__chat_name_misses.get(name)
+        if missed_at is not None and time.time() - missed_at < CHAT_NAME_MISS_TTL:
             return None
 
+        self.add_chats(self.request_chats())
+        if (chat := self.__find_chat_by_name(name)) is None:
+            now = time.time()
+            with self.__chat_index_lock:
+                for k in [k for k, v in self.__chat_name_misses.items() if now - v >= CHAT_NAME_MISS_TTL]:
+                    del self.__chat_name_misses[k]
+                self.__chat_name_misses[name] = now
+        return chat
+
+    def __find_chat_by_name(self, name: str) -> types.ChatShortcut | None:
+        with self.__chat_index_lock:
+            chat_id = self.__chat_ids_by_name.get(name)
+            if chat_id is None:
+                return None
+            chat = self.__saved_chats.get(chat_id)
+        return chat if chat is not None and chat.name == name else None
+
     def get_chat_by_id(self, chat_id: int, make_request: bool = False) -> types.ChatShortcut | None:
         """
         Возвращает личный чат по его ID (если он сохранен).
@@ -1931,20 +2011,19 @@ class Account:
         if interlocutor_id is not None:
             ids[interlocutor_id] = interlocutor_username
 
+        parsed = []
         for i in json_messages:
             if i["id"] < from_id:
                 continue
             author_id = i["author"]
-            parser = BeautifulSoup(i["html"].replace("<br>", "\n"), "lxml")
+            parser = parsing.parse_message_html(i["html"].replace("<br>", "\n"))
 
             # Если ник или бейдж написавшего неизвестен, но есть блок с данными об авторе сообщения
-            if None in [ids.get(author_id), badges.get(author_id)] and (
-                    author_div := parser.find("div", {"class": "media-user-name"})):
+            if None in [ids.get(author_id), badges.get(author_id)] and parser.has_author:
                 if badges.get(author_id) is None:
-                    badge = author_div.find("span", {"class": "chat-msg-author-label label label-success"})
-                    badges[author_id] = badge.text if badge else 0
+                    badges[author_id] = parser.badge if parser.badge else 0
                 if ids.get(author_id) is None:
-                    author = author_div.find("a").text.strip()
+                    author = parser.author
                     ids[author_id] = author
                     if self.chat_id_private(chat_id) and author_id == interlocutor_id and not interlocutor_username:
                         interlocutor_username = author
@@ -1952,10 +2031,9 @@ class Account:
             by_bot = False
             by_vertex = False
             image_name = None
-            if self.chat_id_private(chat_id) and (image_tag := parser.find("a", {"class": "chat-img-link"})):
-                image_name = image_tag.find("img")
-                image_name = image_name.get('alt') if image_name else None
-                image_link = image_tag.get("href")
+            if self.chat_id_private(chat_id) and parser.has_image:
+                image_name = parser.image_name
+                image_link = parser.image_link
                 message_text = None
                 # "Отправлено_с_помощью_бота_FunPay_Cardinal.png", "funpay_cardinal_image.png"
                 if isinstance(image_name, str) and "funpay_cardinal" in image_name.lower():
@@ -1966,9 +2044,9 @@ class Account:
             else:
                 image_link = None
                 if author_id == 0:
-                    message_text = parser.find("div", role="alert").text.strip()
+                    message_text = parser.alert_text
                 else:
-                    message_text = parser.find("div", {"class": "chat-msg-text"}).text
+                    message_text = parser.text
 
                 if message_text.startswith(self.__bot_character) or \
                         message_text.startswith(self.__old_bot_character) and author_id == self.id:
@@ -1985,12 +2063,12 @@ class Account:
             message_obj.type = types.MessageTypes.NON_SYSTEM if author_id != 0 else message_obj.get_message_type()
 
             messages.append(message_obj)
+            parsed.append(parser)
 
-        for i in messages:
+        for i, parser in zip(messages, parsed):
             i.author = ids.get(i.author_id)
             i.chat_name = interlocutor_username
             i.badge = badges.get(i.author_id) if badges.get(i.author_id) != 0 else None
-            parser = BeautifulSoup(i.html, "lxml")
             if i.badge:
                 i.is_employee = True
                 if i.badge in ("поддержка", "підтримка", "support"):
@@ -1999,18 +2077,16 @@ class Account:
                     i.is_moderation = True
                 elif i.badge in ("арбитраж", "арбітраж", "arbitration"):
                     i.is_arbitration = True
-            default_label = parser.find("div", {"class": "media-user-name"})
-            default_label = default_label.find("span", {
-                "class": "chat-msg-author-label label label-default"}) if default_label else None
+            default_label = parser.default_label
             if default_label:
-                if default_label.text in ("автовідповідь", "автоответ", "auto-reply"):
+                if default_label in ("автовідповідь", "автоответ", "auto-reply"):
                     i.is_autoreply = True
-            i.badge = default_label.text if (i.badge is None and default_label is not None) else i.badge
+            i.badge = default_label if (i.badge is None and default_label is not None) else i.badge
             if i.type != types.MessageTypes.NON_SYSTEM:
-                users = parser.find_all('a', href=lambda href: href and '/users/' in href)
+                users = parser.user_links
                 if users:
-                    i.initiator_username = users[0].text
-                    i.initiator_id = int(users[0]["href"].split("/")[-2])
+                    i.initiator_username = users[0][0]
+                    i.initiator_id = int(users[0][1].split("/")[-2])
                     if i.type in (types.MessageTypes.ORDER_PURCHASED, types.MessageTypes.ORDER_CONFIRMED,
                                   types.MessageTypes.NEW_FEEDBACK,
                                   types.MessageTypes.FEEDBACK_CHANGED,
@@ -2030,7 +2106,7 @@ class Account:
                             i.i_am_seller = False
                             i.i_am_buyer = True
                     elif len(users) > 1:
-                        last_user_id = int(users[-1]["href"].split("/")[-2])
+                        last_user_id = int(users[-1][1].split("/")[-2])
                         if i.type == types.MessageTypes.ORDER_CONFIRMED_BY_ADMIN:
                             if last_user_id == self.id:
                                 i.i_am_seller = True
@@ -2073,6 +2149,19 @@ class Account:
 
         return types.BuyerViewing(buyer_id, link, text, tag, html)
 
+    def get_private_chat_id(self, user_id: int) -> str:
+        """
+        Возвращает текстовый ID личного чата с пользователем (users-{id1}-{id2}), не делая запросов.
+
+        :param user_id: ID собеседника (например, OrderShortcut.buyer_id).
+        :type user_id: :obj:`int`
+
+        :return: ID чата, который можно передать в Account.send_message().
+        :rtype: :obj:`str`
+        """
+        id1, id2 = sorted([user_id, self.id])
+        return f"users-{id1}-{id2}"
+
     @staticmethod
     def chat_id_private(chat_id: int | str):
         return isinstance(chat_id, int) or PRIVATE_CHAT_ID_RE.fullmatch(chat_id)
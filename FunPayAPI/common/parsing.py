@@ -0,0 +1,392 @@
+"""
+В данном модуле написаны парсеры фрагментов FunPay, которые разбираются на каждом запросе:
+список чатов (chat_bookmarks из runner/), страница продаж (orders/trade) и HTML сообщений чата.
+
+Основной бэкенд - lxml: дерево строится один раз и обходится XPath-запросами, без объектной
+модели BeautifulSoup. BeautifulSoup используется, если lxml недоступен или быстрый парсер
+не справился с разметкой (тогда фрагмент разбирается повторно, как раньше).
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Callable
+
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:  # pragma: no cover
+    etree = lxml_html = None
+
+logger = logging.getLogger("FunPayAPI.parsing")
+
+BACKENDS = ("lxml", "bs4")
+_backend = "lxml" if lxml_html is not None else "bs4"
+
+
+def get_backend() -> str:
+    """
+    :return: название текущего бэкенда парсинга (`lxml` или `bs4`).
+    :rtype: :obj:`str`
+    """
+    return _backend
+
+
+def set_backend(name: str) -> None:
+    """
+    Переключает бэкенд парсинга.
+
+    :param name: `lxml` или `bs4`.
+    :type name: :obj:`str`
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд парсинга: {name}")
+    if name == "lxml" and lxml_html is None:
+        raise ValueError("lxml не установлен")
+    _backend = name
+
+
+class ChatBookmark:
+    """
+    Данные виджета чата из списка чатов.
+
+    Если чат удален администрацией, `last_message_text` равен :obj:`None`.
+    HTML виджета сериализуется только при обращении к `html`.
+    """
+    __slots__ = ("id", "name", "last_message_text", "node_msg_id", "user_msg_id", "unread", "_node", "_serialize")
+
+    def __init__(self, id_: int, name: str | None, last_message_text: str | None, node_msg_id: int,
+                 user_msg_id: int, unread: bool, node, serialize: Callable):
+        self.id: int = id_
+        self.name: str | None = name
+        self.last_message_text: str | None = last_message_text
+        self.node_msg_id: int = node_msg_id
+        self.user_msg_id: int = user_msg_id
+        self.unread: bool = unread
+        self._node = node
+        self._serialize = serialize
+
+    @property
+    def html(self) -> str:
+        return self._serialize(self._node)
+
+
+class SaleRow:
+    """
+    Данные виджета заказа со страницы https://funpay.com/orders/trade (значения - текст разметки).
+
+    Сразу разбираются только классы и ID заказа; остальные поля - при первом обращении,
+    поэтому заказы, пропущенные по `exclude_ids`, почти ничего не стоят.
+    """
+    __slots__ = ("classes", "order_id", "_node", "_extract", "_serialize", "_details")
+
+    def __init__(self, classes: list[str], order_id: str, node, extract: Callable, serialize: Callable):
+        self.classes: list[str] = classes
+        self.order_id: str = order_id
+        self._node = node
+        self._extract = extract
+        self._serialize = serialize
+        self._details: tuple | None = None
+
+    def _detail(self, index: int) -> str:
+        if self._details is None:
+            self._details = self._extract(self._node)
+        return self._details[index]
+
+    @property
+    def description(self) -> str:
+        return self._detail(0)
+
+    @property
+    def price(self) -> str:
+        return self._detail(1)
+
+    @property
+    def buyer_username(self) -> str:
+        return self._detail(2)
+
+    @property
+    def buyer_href(self) -> str:
+        return self._detail(3)
+
+    @property
+    def subcategory_name(self) -> str:
+        return self._detail(4)
+
+    @property
+    def date(self) -> str:
+        return self._detail(5)
+
+    @property
+    def html(self) -> str:
+        return self._serialize(self._node)
+
+
+class SalesPage:
+    """Разобранная страница https://funpay.com/orders/trade"""
+    __slots__ = ("logged_out", "next_order_id", "app_data", "game_options", "orders")
+
+    def __init__(self, logged_out: bool, next_order_id: str | None, app_data: str | None,
+                 game_options: list[tuple[str, str]], orders: list[SaleRow]):
+        self.logged_out: bool = logged_out
+        """Страница входа вместо списка заказов (golden_key недействителен)."""
+        self.next_order_id: str | None = next_order_id
+        """ID заказа для следующей страницы (continue)."""
+        self.app_data: str | None = app_data
+        """JSON из атрибута data-app-data тега body."""
+        self.game_options: list[tuple[str, str]] = game_options
+        """[(название игры, JSON разделов из data-data)] фильтра по играм."""
+        self.orders: list[SaleRow] = orders
+
+
+class MessageHtml:
+    """Данные, которые Account извлекает из HTML одного сообщения чата."""
+    __slots__ = ("has_author", "author", "badge", "default_label", "has_image", "image_link", "image_name",
+                 "text", "alert_text", "user_links")
+
+    def __init__(self):
+        self.has_author: bool = False
+        """Есть ли блок с данными об авторе (div.media-user-name)."""
+        self.author: str | None = None
+        self.badge: str | None = None
+        """Текст бейджа сотрудника FunPay (label-success)."""
+        self.default_label: str | None = None
+        """Текст обычной метки (label-default), например "автоответ"."""
+        self.has_image: bool = False
+        self.image_link: str | None = None
+        self.image_name: str | None = None
+        self.text: str | None = None
+        """Текст div.chat-msg-text."""
+        self.alert_text: str | None = None
+        """Текст системного сообщения (div[role=alert]) без пробелов по краям."""
+        self.user_links: list[tuple[str, str]] = []
+        """[(текст, href)] ссылок на профили пользователей."""
+
+
+def _with_fallback(fast: Callable, slow: Callable, html: str, *args):
+    if _backend == "lxml":
+        try:
+            return fast(html, *args)
+        except Exception:
+            logger.debug("Быстрый парсер не разобрал фрагмент, используется BeautifulSoup.", exc_info=True)
+    return slow(html, *args)
+
+
+def parse_chat_bookmarks(html: str) -> list[ChatBookmark]:
+    """
+    Парсит список чатов (HTML объекта chat_bookmarks из ответа runner/).
+
+    :param html: HTML списка чатов.
+    :type html: :obj:`str`
+
+    :rtype: :obj:`list` of :class:`FunPayAPI.common.parsing.ChatBookmark`
+    """
+    return _with_fallback(_lxml_chat_bookmarks, _bs4_chat_bookmarks, html)
+
+
+def parse_sales_page(html: str) -> SalesPage:
+    """
+    Парсит страницу https://funpay.com/orders/trade
+
+    :param html: HTML страницы.
+    :type html: :obj:`str`
+
+    :rtype: :class:`FunPayAPI.common.parsing.SalesPage`
+    """
+    return _with_fallback(_lxml_sales_page, _bs4_sales_page, html)
+
+
+def parse_message_html(html: str) -> MessageHtml:
+    """
+    Парсит HTML сообщения чата (поле html сообщений из runner/ и истории чата).
+
+    :param html: HTML сообщения (теги <br> уже заменены на переносы строк).
+    :type html: :obj:`str`
+
+    :rtype: :class:`FunPayAPI.common.parsing.MessageHtml`
+    """
+    return _with_fallback(_lxml_message_html, _bs4_message_html, html)
+
+
+# lxml
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# XPath-выражения компилируются один раз при импорте
+_xpath = etree.XPath if etree is not None else str
+
+_XP_CONTACT_ITEMS = _xpath(f"//a[{_has_class('contact-item')}]")
+_XP_CONTACT_MESSAGE = _xpath(f".//div[{_has_class('contact-item-message')}]")
+_XP_USER_NAME = _xpath(f".//div[{_has_class('media-user-name')}]")
+
+_XP_LOGIN_FORM = _xpath(f"//div[{_has_class('content-account')} and {_has_class('content-account-login')}]")
+_XP_CONTINUE = _xpath("//input[@type='hidden' and @name='continue']/@value")
+_XP_APP_DATA = _xpath("//body/@data-app-data")
+_XP_GAME_OPTIONS = _xpath("//select[@name='game']//option[@value and @value!='']")
+_XP_ORDERS = _xpath(f"//a[{_has_class('tc-item')}]")
+_XP_ORDER_ID = _xpath(f".//div[{_has_class('tc-order')}]")
+_XP_ORDER_DESC = _xpath(f".//div[{_has_class('order-desc')}]//div")
+_XP_ORDER_PRICE = _xpath(f".//div[{_has_class('tc-price')}]")
+_XP_ORDER_BUYER = _xpath(f".//div[{_has_class('media-user-name')}]//span")
+_XP_ORDER_SUBCATEGORY = _xpath(f".//div[{_has_class('text-muted')}]")
+_XP_ORDER_DATE = _xpath(f".//div[{_has_class('tc-date-time')}]")
+
+_XP_LINK = _xpath(".//a")
+_XP_IMAGE = _xpath(".//img")
+_XP_MESSAGE_AUTHOR = _xpath(f"//div[{_has_class('media-user-name')}]")
+_XP_BADGE = _xpath(".//span[@class='chat-msg-author-label label label-success']")
+_XP_DEFAULT_LABEL = _xpath(".//span[@class='chat-msg-author-label label label-default']")
+_XP_IMAGE_LINK = _xpath(f"//a[{_has_class('chat-img-link')}]")
+_XP_MESSAGE_TEXT = _xpath(f"//div[{_has_class('chat-msg-text')}]")
+_XP_ALERT = _xpath("//div[@role='alert']")
+_XP_USER_LINKS = _xpath("//a[contains(@href, '/users/')]")
+
+
+def _lxml_document(html: str):
+    return lxml_html.document_fromstring(html)
+
+
+def _lxml_serialize(node) -> str:
+    return etree.tostring(node, encoding="unicode", method="html", with_tail=False)
+
+
+def _first(node, xpath):
+    found = xpath(node)
+    return found[0] if found else None
+
+
+def _text(node) -> str:
+    # text_content() возвращает "умную" строку со ссылкой на дерево - отвязываем ее
+    return str(node.text_content())
+
+
+def _lxml_chat_bookmarks(html: str) -> list[ChatBookmark]:
+    if not html.strip():
+        return []
+    bookmarks = []
+    for chat in _XP_CONTACT_ITEMS(_lxml_document(html)):
+        message = _first(chat, _XP_CONTACT_MESSAGE)
+        name = _first(chat, _XP_USER_NAME)
+        bookmarks.append(ChatBookmark(int(chat.get("data-id")), _text(name) if name is not None else None,
+                                      _text(message) if message is not None else None,
+                                      int(chat.get("data-node-msg")), int(chat.get("data-user-msg")),
+                                      "unread" in chat.get("class", "").split(), chat, _lxml_serialize))
+    return bookmarks
+
+
+def _lxml_sales_page(html: str) -> SalesPage:
+    document = _lxml_document(html)
+    if _XP_LOGIN_FORM(document):
+        return SalesPage(True, None, None, [], [])
+
+    game_options = [(_text(option), option.get("data-data")) for option in _XP_GAME_OPTIONS(document)]
+    orders = [SaleRow(order.get("class", "").split(), _text(_first(order, _XP_ORDER_ID)), order,
+                      _lxml_order_details, _lxml_serialize)
+              for order in _XP_ORDERS(document)]
+    next_order_id, app_data = _first(document, _XP_CONTINUE), _first(document, _XP_APP_DATA)
+    return SalesPage(False, str(next_order_id) if next_order_id is not None else None,
+                     str(app_data) if app_data is not None else None, game_options, orders)
+
+
+def _lxml_order_details(order) -> tuple:
+    try:
+        buyer = _first(order, _XP_ORDER_BUYER)
+        return (_text(_first(order, _XP_ORDER_DESC)), _text(_first(order, _XP_ORDER_PRICE)), _text(buyer),
+                buyer.get("data-href"), _text(_first(order, _XP_ORDER_SUBCATEGORY)),
+                _text(_first(order, _XP_ORDER_DATE)))
+    except Exception:
+        logger.debug("Быстрый парсер не разобрал заказ, используется BeautifulSoup.", exc_info=True)
+        return _bs4_order_details(BeautifulSoup(_lxml_serialize(order), "lxml"))
+
+
+def _lxml_message_html(html: str) -> MessageHtml:
+    document = _lxml_document(html)
+    result = MessageHtml()
+    if (author_div := _first(document, _XP_MESSAGE_AUTHOR)) is not None:
+        result.has_author = True
+        if (author := _first(author_div, _XP_LINK)) is not None:
+            result.author = _text(author).strip()
+        if (badge := _first(author_div, _XP_BADGE)) is not None:
+            result.badge = _text(badge)
+        if (label := _first(author_div, _XP_DEFAULT_LABEL)) is not None:
+            result.default_label = _text(label)
+    if (image := _first(document, _XP_IMAGE_LINK)) is not None:
+        result.has_image = True
+        result.image_link = image.get("href")
+        if (img := _first(image, _XP_IMAGE)) is not None:
+            result.image_name = img.get("alt")
+    if (text := _first(document, _XP_MESSAGE_TEXT)) is not None:
+        result.text = _text(text)
+    if (alert := _first(document, _XP_ALERT)) is not None:
+        result.alert_text = _text(alert).strip()
+    result.user_links = [(_text(link), link.get("href")) for link in _XP_USER_LINKS(document)]
+    return result
+
+
+# BeautifulSoup
+
+def _bs4_chat_bookmarks(html: str) -> list[ChatBookmark]:
+    bookmarks = []
+    for chat in BeautifulSoup(html, "lxml").find_all("a", {"class": "contact-item"}):
+        message = chat.find("div", {"class": "contact-item-message"})
+        name = chat.find("div", {"class": "media-user-name"})
+        bookmarks.append(ChatBookmark(int(chat["data-id"]), name.text if name else None,
+                                      message.text if message else None,
+                                      int(chat.get("data-node-msg")), int(chat.get("data-user-msg")),
+                                      "unread" in chat.get("class"), chat, str))
+    return bookmarks
+
+
+def _bs4_sales_page(html: str) -> SalesPage:
+    parser = BeautifulSoup(html, "lxml")
+    if parser.find("div", {"class": "content-account content-account-login"}):
+        return SalesPage(True, None, None, [], [])
+
+    next_order_id = parser.find("input", {"type": "hidden", "name": "continue"})
+    body = parser.find("body")
+    game_options = []
+    if games := parser.find("select", attrs={"name": "game"}):
+        game_options = [(option.text, option.get("data-data"))
+                        for option in games.find_all(lambda x: x.name == "option" and x.get("value"))]
+    orders = [SaleRow(order.get("class"), order.find("div", {"class": "tc-order"}).text, order,
+                      _bs4_order_details, str)
+              for order in parser.find_all("a", {"class": "tc-item"})]
+    return SalesPage(False, next_order_id.get("value") if next_order_id else None,
+                     body.get("data-app-data") if body else None, game_options, orders)
+
+
+def _bs4_order_details(order) -> tuple:
+    buyer = order.find("div", {"class": "media-user-name"}).find("span")
+    return (order.find("div", {"class": "order-desc"}).find("div").text, order.find("div", {"class": "tc-price"}).text,
+            buyer.text, buyer.get("data-href"), order.find("div", {"class": "text-muted"}).text,
+            order.find("div", {"class": "tc-date-time"}).text)
+
+
+def _bs4_message_html(html: str) -> MessageHtml:
+    parser = BeautifulSoup(html, "lxml")
+    result = MessageHtml()
+    if author_div := parser.find("div", {"class": "media-user-name"}):
+        result.has_author = True
+        if author := author_div.find("a"):
+            result.author = author.text.strip()
+        if badge := author_div.find("span", {"class": "chat-msg-author-label label label-success"}):
+            result.badge = badge.text
+        if label := author_div.find("span", {"class": "chat-msg-author-label label label-default"}):
+            result.default_label = label.text
+    if image := parser.find("a", {"class": "chat-img-link"}):
+        result.has_image = True
+        result.image_link = image.get("href")
+        if img := image.find("img"):
+            result.image_name = img.get("alt")
+    if text := parser.find("div", {"class": "chat-msg-text"}):
+        result.text = text.text
+    if alert := parser.find("div", role="alert"):
+        result.alert_text = alert.text.strip()
+    result.user_links = [(link.text, link["href"])
+                         for link in parser.find_all("a", href=lambda href: href and "/users/" in href)]
+    return result
@@ -8,14 +8,93 @@ if TYPE_CHECKING:
 
 import json
 import logging
-from bs4 import BeautifulSoup
+from collections import deque, OrderedDict
 
-from ..common import exceptions
+from ..common import exceptions, parsing
 from .events import *
 
 logger = logging.getLogger("FunPayAPI.runner")
 
 
+class PollController:
+    """
+    Адаптивная задержка между запросами к funpay.com/runner/.
+
+    После запроса, вернувшего события, задержка сбрасывается до минимальной; пока событий нет,
+    она растет в `backoff` раз до `max_delay`. После ответа 429 задержка не меньше
+    `rate_limit_delay`. Число запросов за последние 60 секунд не превышает `requests_per_minute`:
+    после половины бюджета оставшиеся запросы распределяются по окну равномерно.
+
+    :param min_delay: задержка после запроса с событиями (в секундах).
+    :type min_delay: :obj:`int` or :obj:`float`, опционально
+
+    :param max_delay: максимальная задержка при отсутствии событий (в секундах).
+    :type max_delay: :obj:`int` or :obj:`float`, опционально
+
+    :param backoff: множитель задержки после каждого запроса без событий.
+    :type backoff: :obj:`float`, опционально
+
+    :param requests_per_minute: максимальное кол-во запросов за скользящую минуту.
+    :type requests_per_minute: :obj:`int`, опционально
+
+    :param rate_limit_delay: задержка после ответа 429 (в секундах).
+    :type rate_limit_delay: :obj:`int` or :obj:`float`, опционально
+    """
+
+    def __init__(self, min_delay: int | float = 1.0, max_delay: int | float = 20.0, backoff: float = 1.5,
+                 requests_per_minute: int = 30, rate_limit_delay: int | float = 60.0):
+        self.min_delay: float = min_delay
+        """Задержка после запроса с событиями."""
+        self.max_delay: float = max_delay
+        """Максимальная задержка при отсутствии событий."""
+        self.backoff: float = backoff
+        """Множитель задержки после запроса без событий."""
+        self.requests_per_minute: int = requests_per_minute
+        """Максимальное кол-во запросов за скользящую минуту."""
+        self.rate_limit_delay: float = rate_limit_delay
+        """Задержка после ответа 429."""
+        self.delay: float = min_delay
+        """Текущая задержка."""
+        self.__requests: deque[float] = deque()
+        self.__last_429_seen: float = 0
+
+    def next_delay(self, had_events: bool, last_429_err_time: float = 0, now: float | None = None) -> float:
+        """
+        Учитывает результат очередного запроса и возвращает задержку до следующего.
+
+        :param had_events: вернул ли запрос события?
+        :type had_events: :obj:`bool`
+
+        :param last_429_err_time: время последнего ответа 429 (:attr:`FunPayAPI.account.Account.last_429_err_time`).
+        :type last_429_err_time: :obj:`float`, опционально
+
+        :return: задержка до следующего запроса (в секундах).
+        :rtype: :obj:`float`
+        """
+        now = time.time() if now is None else now
+        self.__requests.append(now)
+        while self.__requests and self.__requests[0] <= now - 60:
+            self.__requests.popleft()
+
+        if last_429_err_time > self.__last_429_seen:
+            self.__last_429_seen = last_429_err_time
+            self.delay = max(self.delay * self.backoff, self.rate_limit_delay)
+        elif had_events:
+            self.delay = self.min_delay
+        else:
+            self.delay = min(max(self.delay * self.backoff, self.min_delay), self.max_delay)
+
+        delay = self.delay
+        used = len(self.__requests)
+        if used >= self.requests_per_minute:
+            # Бюджет исчерпан - ждем, пока самый старый запрос выйдет из окна
+            delay = max(delay, self.__requests[0] + 60 - now)
+        elif used * 2 >= self.requests_per_minute:
+            # Израсходована половина бюджета - распределяем остаток до конца окна равномерно
+            delay = max(delay, (self.__requests[0] + 60 - now) / (self.requests_per_minute - used))
+        return delay
+
+
 class Runner:
     """
     Класс для получения новых событий FunPay.
@@ -39,11 +118,21 @@ class Runner:
         Из событий, связанных с заказами, будет возвращаться только
         :class:`FunPayAPI.updater.events.OrdersListChangedEvent`.
     :type disabled_order_requests: :obj:`bool`, опционально
+
+    :param saved_orders_limit: сколько последних заказов хранить в :attr:`saved_orders`. Должно быть заметно больше
+        кол-ва заказов на одной странице продаж вместе с неподтвержденными, иначе вытесненный заказ с первой
+        страницы будет снова считаться новым.
+    :type saved_orders_limit: :obj:`int`, опционально
+
+    :param max_order_pages: сколько страниц продаж загружать за раз, если новых заказов больше, чем помещается
+        на одной странице.
+    :type max_order_pages: :obj:`int`, опционально
     """
 
     def __init__(self, account: Account, disable_message_requests: bool = False,
                  disabled_order_requests: bool = False,
-                 disabled_buyer_viewing_requests: bool = True):
+                 disabled_buyer_viewing_requests: bool = True,
+                 saved_orders_limit: int = 1000, max_order_pages: int = 5):
         # todo добавить события и исключение событий о новых покупках (не продажах!)
         if not account.is_initiated:
             raise exceptions.AccountNotInitiatedError()
@@ -61,8 +150,12 @@ class Runner:
         self.__last_msg_event_tag = utils.random_tag()
         self.__last_order_event_tag = utils.random_tag()
 
-        self.saved_orders: dict[str, types.OrderShortcut] = {}
-        """Сохраненные состояния заказов ({ID заказа: экземпляр types.OrderShortcut})."""
+        self.saved_orders: OrderedDict[str, types.OrderShortcut] = OrderedDict()
+        """Сохраненные состояния заказов ({ID заказа: экземпляр types.OrderShortcut}), от давно виденных к недавним."""
+        self.saved_orders_limit: int = saved_orders_limit
+        """Максимальное кол-во сохраненных заказов."""
+        self.max_order_pages: int = max_order_pages
+        """Максимальное кол-во страниц продаж за одно обновление."""
 
         self.runner_last_messages: dict[int, list[int, int, str | None]] = {}
         """ID последний сообщений {ID чата: [ID последего сообщения чата, ID последнего прочитанного сообщения чата, 
@@ -176,20 +269,17 @@ class Runner:
         """
         events, lcmc_events = [], []
         self.__last_msg_event_tag = obj.get("tag")
-        parser = BeautifulSoup(obj["data"]["html"], "lxml")
-        chats = parser.find_all("a", {"class": "contact-item"})
+        chats = parsing.parse_chat_bookmarks(obj["data"]["html"])
 
         # Получаем все изменившиеся чаты
         for chat in chats:
-            chat_id = int(chat["data-id"])
+            chat_id = chat.id
             # Если чат удален админами - скип.
-            if not (last_msg_text := chat.find("div", {"class": "contact-item-message"})):
+            if (last_msg_text := chat.last_message_text) is None:
                 continue
 
-            last_msg_text = last_msg_text.text
-
-            node_msg_id = int(chat.get('data-node-msg'))
-            user_msg_id = int(chat.get('data-user-msg'))
+            node_msg_id = chat.node_msg_id
+            user_msg_id = chat.user_msg_id
             by_bot = False
             by_vertex = False
             if last_msg_text.startswith(self.account.bot_character):
@@ -207,11 +297,8 @@ class Runner:
                 # значит сообщение отправлено ботом и оставлено непрочитанным - просто обновляем инфу
                 self.runner_last_messages[chat_id] = [node_msg_id, user_msg_id, last_msg_text_or_none]
                 continue
-            unread = True if "unread" in chat.get("class") else False
-
-            chat_with = chat.find("div", {"class": "media-user-name"}).text
-            chat_obj = types.ChatShortcut(chat_id, chat_with, last_msg_text, node_msg_id,
-                                          user_msg_id, unread, str(chat))
+            chat_obj = types.ChatShortcut(chat_id, chat.name, last_msg_text, node_msg_id,
+                                          user_msg_id, chat.unread, chat.html)
             if last_msg_text_or_none is not None:
                 chat_obj.last_by_bot = by_bot
                 chat_obj.last_by_vertex = by_vertex
@@ -364,26 +451,27 @@ class Runner:
         if not self.make_order_requests:
             return events
 
-        attempts = 3
-        while attempts:
-            attempts -= 1
-            try:
-                orders_list = self.account.get_sales()  # todo добавить возможность реакции на подтверждение очень старых заказов
+        # Заказы, которые уже не в статусе "Оплачен", не разбираются: их статус больше не отслеживается
+        known_ids = {order_id for order_id, order in self.saved_orders.items()
+                     if order.status != types.OrderStatuses.PAID}
+        orders = []
+        start_from, locale, subcategories = None, None, None
+        for _ in range(self.max_order_pages):
+            page = self.__get_sales_page(start_from, known_ids, locale, subcategories)
+            if page is None:
+                if start_from is None:
+                    return events
                 break
-            except exceptions.RequestFailedError as e:
-                logger.error(e)
-            except:
-                logger.error("Не удалось обновить список заказов.")
-                logger.debug("TRACEBACK", exc_info=True)
-            time.sleep(1)
-        else:
-            logger.error("Не удалось обновить список продаж: превышено кол-во попыток.")
-            return events
+            next_order_id, page_orders, locale, subcategories = page
+            orders.extend(page_orders)
+            # Пока последний заказ страницы новый, новые заказы могут быть и на следующей
+            if self.__first_request or not next_order_id or next_order_id in self.saved_orders:
+                break
+            start_from = next_order_id
 
-        saved_orders = {}
-        for order in orders_list[1]:
-            saved_orders[order.id] = order
-            if order.id not in self.saved_orders:
+        for order in orders:
+            saved = self.saved_orders.get(order.id)
+            if saved is None:
                 if self.__first_request:
                     events.append(InitialOrderEvent(self.__last_order_event_tag, order))
                 else:
@@ -391,11 +479,33 @@ class Runner:
                     if order.status == types.OrderStatuses.CLOSED:
                         events.append(OrderStatusChangedEvent(self.__last_order_event_tag, order))
 
-            elif order.status != self.saved_orders[order.id].status:
+            elif order.status != saved.status:
                 events.append(OrderStatusChangedEvent(self.__last_order_event_tag, order))
-        self.saved_orders = saved_orders
+            self.saved_orders[order.id] = order
+            self.saved_orders.move_to_end(order.id)
+
+        while len(self.saved_orders) > self.saved_orders_limit:
+            self.saved_orders.popitem(last=False)
         return events
 
+    def __get_sales_page(self, start_from: str | None, exclude_ids: set[str], locale: str | None,
+                         subcategories: dict | None) -> tuple | None:
+        attempts = 3
+        while attempts:
+            attempts -= 1
+            try:
+                # todo добавить возможность реакции на подтверждение очень старых заказов
+                return self.account.get_sales(start_from, exclude_ids=exclude_ids, locale=locale,
+                                              sudcategories=subcategories)
+            except exceptions.RequestFailedError as e:
+                logger.error(e)
+            except:
+                logger.error("Не удалось обновить список заказов.")
+                logger.debug("TRACEBACK", exc_info=True)
+            time.sleep(1)
+        logger.error("Не удалось обновить список продаж: превышено кол-во попыток.")
+        return None
+
     def update_last_message(self, chat_id: int, message_id: int, message_text: str | None):
         """
         Обновляет сохраненный ID последнего сообщения чата.
@@ -427,7 +537,8 @@ class Runner:
             self.by_bot_ids[chat_id].append(message_id)
 
     def listen(self, requests_delay: int | float = 6.0,
-               ignore_exceptions: bool = True) -> Generator[InitialChatEvent | ChatsListChangedEvent |
+               ignore_exceptions: bool = True,
+               poll_controller: PollController | None = None) -> Generator[InitialChatEvent | ChatsListChangedEvent |
                                                             LastChatMessageChangedEvent | NewMessageEvent |
                                                             InitialOrderEvent | OrdersListChangedEvent | NewOrderEvent |
                                                             OrderStatusChangedEvent]:
@@ -440,6 +551,9 @@ class Runner:
         :param ignore_exceptions: игнорировать ошибки?
         :type ignore_exceptions: :obj:`bool`, опционально
 
+        :param poll_controller: адаптивная задержка между запросами. Если указан, `requests_delay` не используется.
+        :type poll_controller: :class:`FunPayAPI.updater.runner.PollController` or :obj:`None`, опционально
+
         :return: генератор событий FunPay.
         :rtype: :obj:`Generator` of :class:`FunPayAPI.updater.events.InitialChatEvent`,
             :class:`FunPayAPI.updater.events.ChatsListChangedEvent`,
@@ -451,11 +565,14 @@ class Runner:
         """
         events = []
         while True:
+            had_events = False
             try:
                 self.__interlocutor_ids = set([event.message.interlocutor_id for event in events
                                                if event.type == EventTypes.NEW_MESSAGE])
                 updates = self.get_updates()
-                events.extend(self.parse_updates(updates))
+                new_events = self.parse_updates(updates)
+                had_events = bool(new_events)
+                events.extend(new_events)
                 next_events = []
                 for event in events:
                     if self.make_msg_requests and self.make_buyer_viewing_requests \
@@ -476,4 +593,6 @@ class Runner:
                     logger.error("Произошла ошибка при получении событий. "
                                  "(ничего страшного, если это сообщение появляется нечасто).")
                     logger.debug("TRACEBACK", exc_info=True)
+            if poll_controller is not None:
+                requests_delay = poll_controller.next_delay(had_events, self.account.last_429_err_time)
             time.sleep(requests_delay)
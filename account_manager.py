@@ -14,6 +14,7 @@ from pathlib import Path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from databaseHandler.databaseSetup import SQLiteDB
+from steamHandler.mafile_store import mafile_store
 from logger import logger
 
 class AccountManager:
@@ -153,11 +154,11 @@ class AccountManager:
             validation_result = self.db.validate_mafile(mafile_path)
             
             if validation_result["valid"]:
-                data = validation_result["data"]
+                record = validation_result["record"]
                 print("✅ .maFile валиден!")
-                print(f"   Аккаунт: {data['account_name']}")
-                print(f"   Steam ID: {data['Session']['SteamID']}")
-                print(f"   Device ID: {data['device_id']}")
+                print(f"   Аккаунт: {record.account_name}")
+                print(f"   Steam ID: {record.steamid}")
+                print(f"   Device ID: {record.device_id}")
                 return True
             else:
                 print(f"❌ .maFile невалиден: {validation_result['error']}")
@@ -220,12 +221,14 @@ class AccountManager:
                 mafile_path = account['path_to_maFile']
                 print(f"Проверка: {account['account_name']}")
                 
-                if not os.path.exists(mafile_path):
+                # Файл, на который ссылаются несколько лотов, разбирается один раз
+                validation_result = mafile_store.validate(mafile_path)
+                
+                if validation_result.get("error") == "File not found":
                     print(f"   ❌ Файл не найден: {mafile_path}")
                     invalid_count += 1
                     continue
                 
-                validation_result = self.db.validate_mafile(mafile_path)
                 if validation_result["valid"]:
                     print(f"   ✅ Валиден")
                     valid_count += 1
@@ -277,6 +280,15 @@ class AccountManager:
             logger.error(f"Error exporting accounts: {str(e)}")
             print(f"❌ Ошибка при экспорте: {str(e)}")
 
+    def rebuild_customer_stats(self):
+        """Пересчитывает сводную статистику покупателей по всей истории"""
+        print("⏳ Пересчет статистики покупателей...")
+        total = self.db.rebuild_customer_stats()
+        if total >= 0:
+            print(f"✅ Статистика пересчитана для {total} покупателей")
+        else:
+            print("❌ Ошибка при пересчете статистики")
+
 def main():
     """Главное меню утилиты"""
     manager = AccountManager()
@@ -292,10 +304,11 @@ def main():
         print("5. 🧹 Очистить неиспользуемые")
         print("6. 🔍 Массовая проверка .maFile")
         print("7. 📤 Экспорт аккаунтов")
-        print("8. ❌ Выход")
+        print("8. 📊 Пересчитать статистику покупателей")
+        print("9. ❌ Выход")
         print("=" * 60)
         
-        choice = input("Выберите действие (1-8): ").strip()
+        choice = input("Выберите действие (1-9): ").strip()
         
         if choice == "1":
             manager.list_all_accounts()
@@ -332,6 +345,9 @@ def main():
             manager.export_accounts(filename)
         
         elif choice == "8":
+            manager.rebuild_customer_stats()
+        
+        elif choice == "9":
             print("👋 До свидания!")
             break
         
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк парсинга страниц FunPay
+Сравнивает бэкенды FunPayAPI.common.parsing (lxml XPath и BeautifulSoup) на ответе
+runner/ со списком чатов, странице orders/trade (все поля заказов и только ID - как при
+инкрементальной синхронизации) и HTML сообщений чата, и проверяет, что оба бэкенда
+извлекают одинаковые данные.
+
+По умолчанию фикстуры генерируются по разметке FunPay; сохраненные ответы можно
+передать через --runner-fixture (JSON ответа runner/) и --orders-fixture (HTML orders/trade).
+
+Запуск: python benchmarks/funpay_parsing.py --chats 50 --orders 100
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FunPayAPI.common import parsing
+
+SELF_ID = 1000000
+
+CHAT_ITEM = (
+    '<a href="https://funpay.com/chat/?node={id}" class="contact-item{unread}" data-id="{id}" '
+    'data-node-msg="{node_msg}" data-user-msg="{user_msg}">'
+    '<div class="contact-item-photo"><div class="avatar-photo" style="background-image: url(/img/layout/avatar.png);">'
+    '</div></div><div class="media-user-name">buyer_{id}</div>'
+    '<div class="contact-item-message">Здравствуйте, когда будет код? Заказ #{order}</div>'
+    '<div class="contact-item-time">12:{minute:02d}</div></a>'
+)
+
+ORDER_ITEM = (
+    '<a href="https://funpay.com/orders/{order}/" class="tc-item{status}">'
+    '<div class="tc-date"><div class="tc-date-time">сегодня, 12:{minute:02d}</div>'
+    '<div class="tc-date-left">{minute} минут назад</div></div>'
+    '<div class="tc-order">#{order}</div>'
+    '<div class="order-desc"><div>Аренда аккаунта Steam, {hours} ч., Counter-Strike 2 Prime</div>'
+    '<div class="text-muted">Counter-Strike 2, Аренда</div></div>'
+    '<div class="tc-user"><div class="media media-user offline"><div class="media-left">'
+    '<div class="avatar-photo pseudo-a" data-href="https://funpay.com/users/{buyer}/"></div></div>'
+    '<div class="media-body"><div class="media-user-name">'
+    '<span class="pseudo-a" data-href="https://funpay.com/users/{buyer}/">buyer_{buyer}</span></div>'
+    '<div class="media-user-status">был 5 минут назад</div></div></div></div>'
+    '<div class="tc-status text-primary">Оплачен</div>'
+    '<div class="tc-price text-nowrap tc-seller-sum">{price}.00 <span class="unit">₽</span></div></a>'
+)
+
+ORDERS_PAGE = (
+    '<!DOCTYPE html><html lang="ru"><head><meta charset="utf-8"><title>Мои продажи</title></head>'
+    '<body data-app-data=\'{app_data}\'><div class="wrapper"><div class="content-with-cd">'
+    '<form class="form-inline"><select name="game" class="form-control"><option value="">Все игры</option>'
+    '<option value="41" data-data=\'[["lot-1042","Аренда"],["lot-1043","Аккаунты"]]\'>Counter-Strike 2</option>'
+    '<option value="8" data-data=\'[["lot-210","Аренда"],["chip-18","Золото"]]\'>Dota 2</option>'
+    '</select></form><div class="tc table-hover table-clickable tc-selling">'
+    '<div class="tc-header"><div class="tc-date">Дата</div><div class="tc-order">Заказ</div></div>'
+    '{orders}</div><input type="hidden" name="continue" value="{next_order}"></div></div></body></html>'
+)
+
+MESSAGE = (
+    '<div class="chat-msg-item chat-msg-with-head" id="message-{id}"><div class="chat-message">'
+    '<div class="media-user-name"><a href="https://funpay.com/users/{author}/" class="chat-msg-author-link">'
+    'buyer_{author}</a>{label}<div class="chat-msg-date" title="12 марта, 12:00:00">12:00</div></div>'
+    '<div class="chat-msg-body"><div class="chat-msg-text">Добрый день!<br>Пришлите, пожалуйста, код '
+    'для аккаунта №{id}</div></div></div></div>'
+)
+
+SYSTEM_MESSAGE = (
+    '<div class="chat-msg-item chat-msg-with-head" id="message-{id}"><div class="chat-message">'
+    '<div class="media-user-name"><a href="https://funpay.com/users/0/">FunPay</a>'
+    '<span class="chat-msg-author-label label label-success">оповещение</span></div>'
+    '<div class="chat-msg-body"><div class="alert alert-with-icon alert-info" role="alert">'
+    'Покупатель <a href="https://funpay.com/users/{author}/">buyer_{author}</a> оплатил заказ '
+    '<a href="https://funpay.com/orders/{order}/">#{order}</a>. Аренда аккаунта Steam, 2 ч.</div></div></div></div>'
+)
+
+
+def make_runner_response(chats: int) -> dict:
+    html = "".join(CHAT_ITEM.format(id=10000 + i, unread=" unread" if i % 3 == 0 else "", node_msg=5000000 + i,
+                                    user_msg=5000000 + i - (i % 3 == 0), order=f"ABCD{i:04d}", minute=i % 60)
+                   for i in range(chats))
+    return {"objects": [
+        {"type": "orders_counters", "id": SELF_ID, "tag": "a1b2c3d4", "data": {"buyer": 0, "seller": 3}},
+        {"type": "chat_bookmarks", "id": SELF_ID, "tag": "e5f6a7b8", "data": {"order": [], "html": html}},
+    ], "response": False}
+
+
+def make_orders_page(orders: int) -> str:
+    statuses = (" info", "", " warning")
+    items = "".join(ORDER_ITEM.format(order=f"ABCD{i:04d}", status=statuses[i % 3], minute=i % 60,
+                                      hours=1 + i % 24, buyer=20000 + i, price=100 + i)
+                    for i in range(orders))
+    app_data = json.dumps({"locale": "ru", "csrf-token": "token", "userId": SELF_ID})
+    return ORDERS_PAGE.format(app_data=app_data, orders=items, next_order=f"ABCD{orders:04d}")
+
+
+def make_messages(count: int) -> list:
+    messages = []
+    for i in range(count):
+        if i % 10 == 0:
+            html = SYSTEM_MESSAGE.format(id=7000000 + i, author=20000 + i, order=f"ABCD{i:04d}")
+        else:
+            label = '<span class="chat-msg-author-label label label-default">автоответ</span>' if i % 7 == 0 else ""
+            html = MESSAGE.format(id=7000000 + i, author=20000 + i, label=label)
+        messages.append(html.replace("<br>", "\n"))
+    return messages
+
+
+def chat_bookmarks_html(response: dict) -> str:
+    for obj in response["objects"]:
+        if obj.get("type") == "chat_bookmarks":
+            return obj["data"]["html"]
+    return ""
+
+
+def snapshot(value):
+    """Данные результата парсинга без HTML (сериализация разметки у бэкендов различается)"""
+    if isinstance(value, list):
+        return [snapshot(item) for item in value]
+    if isinstance(value, parsing.SalesPage):
+        return (value.logged_out, value.next_order_id, value.app_data, value.game_options, snapshot(value.orders))
+    if isinstance(value, parsing.SaleRow):
+        return (value.classes, value.order_id, value.description, value.price, value.buyer_username,
+                value.buyer_href, value.subcategory_name, value.date)
+    if hasattr(value, "__slots__"):
+        return tuple(getattr(value, name) for name in value.__slots__ if not name.startswith("_"))
+    return value
+
+
+def measure(func, repeat: int) -> float:
+    """Лучшее время из repeat запусков"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк парсинга страниц FunPay")
+    parser.add_argument("--chats", type=int, default=50, help="Чатов в ответе runner/ (без --runner-fixture)")
+    parser.add_argument("--orders", type=int, default=100, help="Заказов на странице (без --orders-fixture)")
+    parser.add_argument("--messages", type=int, default=100, help="Количество сообщений чата")
+    parser.add_argument("--runner-fixture", help="JSON сохраненного ответа runner/")
+    parser.add_argument("--orders-fixture", help="HTML сохраненной страницы orders/trade")
+    parser.add_argument("--repeat", type=int, default=20, help="Количество повторов")
+    args = parser.parse_args()
+
+    if args.runner_fixture:
+        with open(args.runner_fixture, encoding="utf-8") as f:
+            runner_response = json.load(f)
+    else:
+        runner_response = make_runner_response(args.chats)
+    if args.orders_fixture:
+        with open(args.orders_fixture, encoding="utf-8") as f:
+            orders_page = f.read()
+    else:
+        orders_page = make_orders_page(args.orders)
+    bookmarks_html = chat_bookmarks_html(runner_response)
+    messages = make_messages(args.messages)
+
+    cases = {
+        "runner/": lambda: parsing.parse_chat_bookmarks(bookmarks_html),
+        "orders/trade": lambda: snapshot(parsing.parse_sales_page(orders_page)),
+        # Инкрементальная синхронизация: известные заказы пропускаются по ID, поля не разбираются
+        "orders/trade ID": lambda: [order.order_id for order in parsing.parse_sales_page(orders_page).orders],
+        "сообщения": lambda: [parsing.parse_message_html(html) for html in messages],
+    }
+
+    backends = [name for name in parsing.BACKENDS if name != "lxml" or parsing.lxml_html is not None]
+    results, timings = {}, {}
+    for backend in backends:
+        parsing.set_backend(backend)
+        results[backend] = {name: snapshot(func()) for name, func in cases.items()}
+        timings[backend] = {name: measure(func, args.repeat) for name, func in cases.items()}
+
+    chats = len(results[backends[0]]["runner/"])
+    orders = len(results[backends[0]]["orders/trade ID"])
+    print(f"📊 Чатов в runner/: {chats}, заказов на странице: {orders}, сообщений: {len(messages)}; "
+          f"лучший из {args.repeat} запусков")
+    print(f"{'Фрагмент':<16}" + "".join(f"{backend + ', мс':>14}" for backend in backends) + f"{'Ускорение':>12}")
+    for name in cases:
+        row = f"{name:<16}" + "".join(f"{timings[backend][name] * 1000:>14.2f}" for backend in backends)
+        if len(backends) > 1:
+            row += f"{timings['bs4'][name] / timings['lxml'][name]:>11.1f}x"
+        print(row)
+
+    mismatches = [name for name in cases if any(results[b][name] != results[backends[0]][name] for b in backends)]
+    if mismatches:
+        print(f"\n❌ Бэкенды разобрали по-разному: {', '.join(mismatches)}")
+        return 1
+    print("\n✅ Результаты бэкендов совпадают")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк HTTP-транспорта FunPayAPI.Account
+Сравнивает запросы через requests.post (новое TLS-соединение на каждый запрос)
+с пулом keep-alive соединений Account.session на локальном HTTPS-заглушке.
+
+Запуск: python benchmarks/http_session.py --requests 500 --threads 4
+"""
+
+import os
+import sys
+import ssl
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from FunPayAPI.account import Account
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Отвечает на любой запрос небольшим JSON, как funpay.com/runner/"""
+    protocol_version = "HTTP/1.1"
+    body = b'{"objects": [], "response": false}'
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CountingHTTPSServer(ThreadingHTTPServer):
+    """HTTPS-сервер, считающий принятые соединения (= TLS-рукопожатия)"""
+    daemon_threads = True
+
+    def __init__(self, address, context: ssl.SSLContext):
+        super().__init__(address, StubHandler)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.handshakes = 0
+        self._lock = threading.Lock()
+
+    def get_request(self):
+        request = super().get_request()
+        with self._lock:
+            self.handshakes += 1
+        return request
+
+
+def make_certificate(directory: str) -> tuple[str, str]:
+    """Создает самоподписанный сертификат для localhost через openssl"""
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return cert, key
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run(server: CountingHTTPSServer, url: str, send, total: int, threads: int) -> dict:
+    """Выполняет total запросов в threads потоков и собирает метрики"""
+    latencies = []
+    lock = threading.Lock()
+
+    def one(_):
+        start = time.perf_counter()
+        response = send(url)
+        response.content
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    handshakes_before = server.handshakes
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(one, range(total)))
+    duration = time.perf_counter() - started
+    handshakes = server.handshakes - handshakes_before
+
+    return {
+        "handshakes": handshakes,
+        "handshakes_per_minute": handshakes / duration * 60,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "rps": total / duration,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пула HTTP-соединений FunPayAPI")
+    parser.add_argument("--requests", type=int, default=500, help="Количество запросов на режим")
+    parser.add_argument("--threads", type=int, default=4, help="Количество потоков-клиентов")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+
+        server = CountingHTTPSServer(("127.0.0.1", 0), context)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"https://127.0.0.1:{server.server_address[1]}/runner/"
+        payload = {"objects": "[]", "request": "false"}
+
+        session = Account.create_session(pool_maxsize=args.threads)
+        modes = {
+            "requests.post": lambda u: requests.post(u, data=payload, verify=False, timeout=10),
+            "Account.session": lambda u: session.post(u, data=payload, verify=False, timeout=10),
+        }
+
+        print(f"📊 {args.requests} запросов, {args.threads} потоков")
+        print(f"{'Режим':<18}{'Рукопожатий':>12}{'Рукоп./мин':>14}{'p50, мс':>10}{'p95, мс':>10}{'RPS':>10}")
+        for name, send in modes.items():
+            result = run(server, url, send, args.requests, args.threads)
+            print(f"{name:<18}{result['handshakes']:>12}{result['handshakes_per_minute']:>14.0f}"
+                  f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['rps']:>10.0f}")
+
+        session.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
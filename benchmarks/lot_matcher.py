@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сопоставления заказа с лотом
+Сравнивает прежний цикл (две re.sub на каждое название для каждого заказа)
+с префиксным деревом LotNameMatcher на синтетических названиях лотов.
+
+Запуск: python benchmarks/lot_matcher.py --lots 50000 --orders 200
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from databaseHandler.lot_matcher import LotNameMatcher
+
+GAMES = ["CS2", "Dota 2", "Rust", "PUBG", "GTA V", "Apex", "Tarkov", "Valorant", "Dead by Daylight", "Terraria"]
+TAGS = ["Prime", "Premium", "Full Access", "Без VAC", "Много часов", "Инвентарь", "Онлайн"]
+
+
+def make_lot_names(count: int) -> list[str]:
+    names = []
+    for i in range(count):
+        game = random.choice(GAMES)
+        tag = random.choice(TAGS)
+        names.append(f"{game} | {tag} #{i}")
+    return names
+
+
+def loop_match(all_accounts: list[str], order_name: str):
+    """Прежняя реализация из обработчика NEW_ORDER"""
+    cleaned_order_name = re.sub(r"[^\w\s]", " ", order_name)
+    cleaned_order_name = " ".join(cleaned_order_name.split())
+
+    matched_account = None
+    max_similarity = 0
+    for account in all_accounts:
+        cleaned_account = re.sub(r"[^\w\s]", " ", account)
+        cleaned_account = " ".join(cleaned_account.split())
+        if cleaned_account.lower() in cleaned_order_name.lower():
+            similarity = len(cleaned_account)
+            if similarity > max_similarity:
+                max_similarity = similarity
+                matched_account = account
+    return matched_account
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сопоставления заказа с лотом")
+    parser.add_argument("--lots", type=int, default=50000, help="Количество названий лотов")
+    parser.add_argument("--orders", type=int, default=200, help="Количество заказов")
+    parser.add_argument("--loop-orders", type=int, default=10, help="Заказов для прежнего цикла (он медленный)")
+    args = parser.parse_args()
+
+    random.seed(1)
+    names = make_lot_names(args.lots)
+    orders = [
+        f"{random.choice(names)}, Аренда на {random.randint(1, 24)} ч. Steam Guard, моментальная выдача"
+        for _ in range(args.orders)
+    ]
+
+    matcher = LotNameMatcher()
+    started = time.perf_counter()
+    matcher.load(names)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    for order in orders[:args.loop_orders]:
+        assert matcher.match(order) == loop_match(names, order)
+
+    started = time.perf_counter()
+    for order in orders[:args.loop_orders]:
+        loop_match(names, order)
+    loop_ms = (time.perf_counter() - started) * 1000 / args.loop_orders
+
+    started = time.perf_counter()
+    for order in orders:
+        matcher.match(order)
+    trie_ms = (time.perf_counter() - started) * 1000 / len(orders)
+
+    started = time.perf_counter()
+    for i in range(1000):
+        matcher.add(f"Новый лот {i}")
+        matcher.remove(f"Новый лот {i}")
+    update_us = (time.perf_counter() - started) * 1e6 / 2000
+
+    print(f"📊 {args.lots} лотов")
+    print(f"   Построение дерева: {build_ms:.0f} мс")
+    print(f"   Обновление (add/remove): {update_us:.1f} мкс")
+    print(f"{'Режим':<18}{'мс/заказ':>12}")
+    print(f"{'re.sub цикл':<18}{loop_ms:>12.3f}")
+    print(f"{'LotNameMatcher':<18}{trie_ms:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Проверка планов запросов (EXPLAIN QUERY PLAN)
+Создает временную базу через databaseHandler.migrations и проверяет, что горячие
+запросы (события сообщений, AutoGuard, статистика) идут по индексам, а не полным
+перебором таблиц. Бот не собирает статистику (ANALYZE), поэтому планы строятся так же,
+как в рабочей базе. Код возврата 1, если хотя бы один запрос перебирает
+accounts/customer_activity/customer_stats.
+
+Запуск: python benchmarks/query_plans.py --verbose
+"""
+
+import os
+import re
+import sys
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from databaseHandler.migrations import apply_migrations
+from databaseHandler.databaseSetup import FREE_ACCOUNT_CONDITION
+
+# (название, SQL, параметры) - запросы из обработчиков сообщений, AutoGuard и статистики
+HOT_QUERIES = [
+    ("active owners", "SELECT DISTINCT owner FROM accounts WHERE owner IS NOT NULL", ()),
+    ("accounts of owner", "SELECT ID, account_name, path_to_maFile FROM accounts WHERE owner = ?", ("buyer1",)),
+    ("owner rentals with start",
+     "SELECT ID, rental_start, rental_duration FROM accounts WHERE owner = ? AND rental_start IS NOT NULL",
+     ("buyer1",)),
+    ("owner account by name", "SELECT ID FROM accounts WHERE owner = ? AND account_name = ?", ("buyer1", "lot 1")),
+    ("account of owner by id", "SELECT ID FROM accounts WHERE ID = ? AND owner = ?", (1, "buyer1")),
+    ("rental deadlines",
+     "SELECT ID, rental_start, rental_duration FROM accounts WHERE owner IS NOT NULL AND rental_start IS NOT NULL",
+     ()),
+    ("rented count", "SELECT COUNT(*) FROM accounts WHERE owner IS NOT NULL", ()),
+    ("free count", "SELECT COUNT(*) FROM accounts WHERE owner IS NULL", ()),
+    ("free lot names", f"SELECT DISTINCT account_name FROM accounts WHERE {FREE_ACCOUNT_CONDITION}", ()),
+    ("free accounts of lot", f"SELECT ID FROM accounts WHERE account_name = ? AND {FREE_ACCOUNT_CONDITION}",
+     ("lot 1",)),
+    ("accounts by login", "SELECT ID, account_name FROM accounts WHERE login = ?", ("login1",)),
+    ("free accounts by login", "SELECT ID FROM accounts WHERE login = ? AND owner IS NULL", ("login1",)),
+    ("customer access",
+     "SELECT access_count FROM customer_activity "
+     "WHERE customer_username = ? AND account_id = ? AND is_active = TRUE",
+     ("buyer1", 1)),
+    ("customer history",
+     "SELECT * FROM customer_activity WHERE customer_username = ? ORDER BY updated_at DESC",
+     ("buyer1",)),
+    ("account history",
+     "SELECT * FROM customer_activity WHERE account_id = ? ORDER BY updated_at DESC",
+     (1,)),
+    ("customer active rentals",
+     "SELECT COUNT(*) FROM customer_activity WHERE customer_username = ? AND is_active = TRUE",
+     ("buyer1",)),
+    ("customer latest records",
+     "SELECT * FROM customer_activity WHERE customer_username = ? ORDER BY updated_at DESC LIMIT 3",
+     ("buyer1",)),
+    ("latest activity", "SELECT * FROM customer_activity ORDER BY updated_at DESC LIMIT 20", ()),
+    ("customer stats", "SELECT * FROM customer_stats WHERE customer_username = ?", ("buyer1",)),
+    ("recent customers", "SELECT * FROM customer_stats ORDER BY last_activity DESC LIMIT 10", ()),
+]
+
+HOT_TABLES = ("accounts", "customer_activity", "customer_stats")
+# Полный перебор таблицы: "SCAN accounts" без "USING ... INDEX"
+FULL_SCAN = re.compile(r"\bSCAN (\w+)(?! USING)")
+
+
+def explain(conn: sqlite3.Connection, sql: str, params) -> list:
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[3] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов горячих запросов")
+    parser.add_argument("--verbose", action="store_true", help="Печатать план каждого запроса")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "plans.db"))
+        version = apply_migrations(conn)
+
+        print(f"Версия схемы: {version}")
+        print(f"{'Запрос':<28} {'Результат':<10} План")
+        failures = 0
+        for name, sql, params in HOT_QUERIES:
+            plan = explain(conn, sql, params)
+            scans = [m.group(1) for line in plan for m in FULL_SCAN.finditer(line) if m.group(1) in HOT_TABLES]
+            ok = not scans
+            failures += not ok
+            print(f"{name:<28} {'OK' if ok else 'SCAN':<10} {'; '.join(plan) if args.verbose or not ok else ''}")
+        conn.close()
+
+    print(f"\nЗапросов с полным перебором: {failures} из {len(HOT_QUERIES)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
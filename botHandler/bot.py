@@ -1,7 +1,6 @@
 import asyncio
 import os
 import sys
-import sqlite3
 import time
 from datetime import datetime
 
@@ -10,9 +9,13 @@ from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 from config import ADMIN_ID, BOT_TOKEN, HOURS_FOR_REVIEW, SECRET_PHRASE, FUNPAY_GOLDEN_KEY, PROXY_URL as CONF_PROXY_URL, PROXY_LOGIN as CONF_PROXY_LOGIN, PROXY_PASSWORD as CONF_PROXY_PASSWORD
 from databaseHandler.databaseSetup import SQLiteDB
-from messaging.message_sender import send_message_by_owner
+from databaseHandler.connection import get_connection
+from botHandler.state_store import ConversationStateStore
+from botHandler.dispatcher import Dispatcher
+from messaging.message_sender import send_message_by_owner, get_message_queue_stats
 from logger import logger
 from steamHandler.changePassword import changeSteamPassword
+from steamHandler.password_rotation import password_rotation
 
 import requests
 
@@ -45,7 +48,10 @@ except PermissionError:
     os.makedirs(SAVE_DIR, exist_ok=True)
 
 bot = telebot.TeleBot(API_TOKEN)
-user_states = {}
+# Состояния диалогов: с TTL и ограничением числа записей
+user_states = ConversationStateStore()
+# Кнопки и шаги диалогов маршрутизируются по словарям (см. botHandler/dispatcher.py)
+dispatcher = Dispatcher(lambda user_id: user_states.get(user_id)["state"])
 
 # Проверка на запуск только одного экземпляра бота
 def check_bot_instance():
@@ -76,14 +82,13 @@ bot.set_my_commands(
 )
 
 def set_user_state(user_id, state, data=None):
-    user_states[user_id] = {"state": state, "data": data or {}}
+    user_states.set(user_id, state, data)
 
 def get_user_state(user_id):
-    return user_states.get(user_id, {"state": None, "data": {}})
+    return user_states.get(user_id)
 
 def clear_user_state(user_id):
-    if user_id in user_states:
-        del user_states[user_id]
+    user_states.clear(user_id)
 
 def is_user_authorized(user_id):
     """Check if user is authorized using database."""
@@ -132,6 +137,29 @@ def get_main_keyboard():
     return keyboard
 
 ACCOUNTS_PER_PAGE = 5
+LIST_PAGE_SIZE = 10  # Записей на страницу в админских списках (аккаунты, пользователи, покупатели)
+
+
+def add_page_buttons(keyboard, prefix, page, items_page, key):
+    """Кнопки листания для страницы из SQLiteDB.get_*_page: в callback_data - ключ крайней записи и номер страницы"""
+    items = items_page["items"]
+    buttons = []
+    if items_page["has_prev"] and items:
+        buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"{prefix}_prev_{items[0][key]}_{page - 1}"))
+    if items_page["has_next"] and items:
+        buttons.append(InlineKeyboardButton("➡️ Вперёд", callback_data=f"{prefix}_next_{items[-1][key]}_{page + 1}"))
+    if buttons:
+        keyboard.row(*buttons)
+    return keyboard
+
+
+def parse_page_callback(data):
+    """Разбирает callback_data из add_page_buttons: (after, before, page)"""
+    direction, anchor, page = data.rsplit("_", 3)[1:]
+    anchor, page = int(anchor), int(page)
+    if direction == "next":
+        return anchor, None, page
+    return None, anchor, page
 
 def get_manage_accounts_keyboard():
     """Клавиатура для управления аккаунтами (только для админа)"""
@@ -181,19 +209,16 @@ def get_autoguard_keyboard():
     )
     return keyboard
 
-def get_accounts_pagination_keyboard(page, total_pages):
+def get_accounts_pagination_keyboard(page, accounts_page):
     keyboard = InlineKeyboardMarkup(row_width=2)
-    if page > 0:
-        keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"accounts_page_{page - 1}"))
-    if page < total_pages - 1:
-        keyboard.add(InlineKeyboardButton("➡️ Вперёд", callback_data=f"accounts_page_{page + 1}"))
+    add_page_buttons(keyboard, "accounts", page, accounts_page, "id")
     keyboard.add(InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main"))
     return keyboard
 
-@bot.callback_query_handler(func=lambda call: call.data == "show_accounts")
+@dispatcher.callback("show_accounts")
 def show_accounts_callback(call):
-    accounts = db_bot.get_all_accounts()
-    if not accounts:
+    accounts_page = db_bot.get_accounts_page(limit=ACCOUNTS_PER_PAGE)
+    if not accounts_page["items"]:
         bot.edit_message_text(
             "Аккаунты не найдены.",
             chat_id=call.message.chat.id,
@@ -201,20 +226,16 @@ def show_accounts_callback(call):
             reply_markup=get_main_keyboard()
         )
         return
-    set_user_state(call.from_user.id, "viewing_accounts", {"accounts": accounts, "page": 0})
-    send_accounts_page(call.message.chat.id, accounts, 0, call.message.message_id)
+    send_accounts_page(call.message.chat.id, accounts_page, 0, call.message.message_id)
 
-def send_accounts_page(chat_id, accounts, page, message_id=None):
-    start = page * ACCOUNTS_PER_PAGE
-    end = start + ACCOUNTS_PER_PAGE
-    accounts_page = accounts[start:end]
-    total_pages = (len(accounts) + ACCOUNTS_PER_PAGE - 1) // ACCOUNTS_PER_PAGE
+def send_accounts_page(chat_id, accounts_page, page, message_id=None):
+    accounts = accounts_page["items"]
 
-    if not accounts_page:
+    if not accounts:
         msg = "❗Нет больше аккаунтов для отображения."
     else:
         grouped_accounts = {}
-        for account in accounts_page:
+        for account in accounts:
             account_name = account["account_name"]
             if account_name not in grouped_accounts:
                 grouped_accounts[account_name] = []
@@ -238,7 +259,7 @@ def send_accounts_page(chat_id, accounts, page, message_id=None):
                 response.append(account_info)
         msg = "\n\n".join(response)
 
-    keyboard = get_accounts_pagination_keyboard(page, total_pages)
+    keyboard = get_accounts_pagination_keyboard(page, accounts_page)
     if message_id:
         bot.edit_message_text(
             msg,
@@ -255,18 +276,13 @@ def send_accounts_page(chat_id, accounts, page, message_id=None):
             reply_markup=keyboard,
         )
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("accounts_page_"))
+@dispatcher.callback_prefix("accounts_next_", "accounts_prev_")
 def handle_accounts_pagination(call):
-    page = int(call.data.split("_")[-1])
-    state = get_user_state(call.from_user.id)
-    if state["state"] == "viewing_accounts":
-        accounts = state["data"]["accounts"]
-        send_accounts_page(
-            call.message.chat.id, accounts, page, message_id=call.message.message_id
-        )
-        set_user_state(
-            call.from_user.id, "viewing_accounts", {"accounts": accounts, "page": page}
-        )
+    after_id, before_id, page = parse_page_callback(call.data)
+    accounts_page = db_bot.get_accounts_page(after_id, before_id, limit=ACCOUNTS_PER_PAGE)
+    send_accounts_page(
+        call.message.chat.id, accounts_page, page, message_id=call.message.message_id
+    )
     bot.answer_callback_query(call.id)
 
 
@@ -332,17 +348,8 @@ def get_notification_settings_keyboard():
     )
     return keyboard
 
-def get_accounts_pagination_keyboard(page, total_pages):
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    if page > 0:
-        keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data=f"accounts_page_{page - 1}"))
-    if page < total_pages - 1:
-        keyboard.add(InlineKeyboardButton("➡️ Вперёд", callback_data=f"accounts_page_{page + 1}"))
-    keyboard.add(InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main"))
-    return keyboard
-
 # --- МЕНЮ НАСТРОЕК ---
-@bot.callback_query_handler(func=lambda call: call.data == "settings_menu")
+@dispatcher.callback("settings_menu")
 def settings_menu_callback(call):
     bot.edit_message_text(
         chat_id=call.message.chat.id,
@@ -354,7 +361,7 @@ def settings_menu_callback(call):
     bot.answer_callback_query(call.id)
 
 # --- ГОЛД КЕЙ НАСТРОЙКИ ---
-@bot.callback_query_handler(func=lambda call: call.data == "gold_key_settings")
+@dispatcher.callback("gold_key_settings")
 def gold_key_settings_callback(call):
     if call.from_user.id != ADMIN_ID:
         bot.answer_callback_query(call.id, "Доступ запрещён.", show_alert=True)
@@ -371,7 +378,7 @@ def gold_key_settings_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "gold_key_change")
+@dispatcher.callback("gold_key_change")
 def gold_key_change_callback(call):
     if call.from_user.id != ADMIN_ID:
         bot.answer_callback_query(call.id, "Доступ запрещён.", show_alert=True)
@@ -385,7 +392,7 @@ def gold_key_change_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "gold_key_check")
+@dispatcher.callback("gold_key_check")
 def gold_key_check_callback(call):
     if call.from_user.id != ADMIN_ID:
         bot.answer_callback_query(call.id, "Доступ запрещён.", show_alert=True)
@@ -397,7 +404,7 @@ def gold_key_check_callback(call):
     else:
         bot.answer_callback_query(call.id, f"Голд кей невалидный ❌\n{error_msg}", show_alert=True)
 
-@bot.message_handler(func=lambda message: get_user_state(message.from_user.id)["state"] == "waiting_for_gold_key")
+@dispatcher.state("waiting_for_gold_key")
 def process_gold_key(message):
     if message.from_user.id != ADMIN_ID:
         bot.send_message(message.chat.id, "Доступ запрещён.")
@@ -491,7 +498,7 @@ def update_proxy_in_config(proxy_url, proxy_login, proxy_password):
 # --- КОНЕЦ ПРОКСИ СОХРАНЕНИЯ ---
 
 # --- ПРОКСИ КНОПКИ ---
-@bot.callback_query_handler(func=lambda call: call.data == "proxy_settings")
+@dispatcher.callback("proxy_settings")
 def proxy_settings_callback(call):
     if call.from_user.id != ADMIN_ID:
         bot.answer_callback_query(call.id, "Доступ запрещён.", show_alert=True)
@@ -507,7 +514,7 @@ def proxy_settings_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "proxy_set")
+@dispatcher.callback("proxy_set")
 def proxy_set_callback(call):
     if call.from_user.id != ADMIN_ID:
         bot.answer_callback_query(call.id, "Доступ запрещён.", show_alert=True)
@@ -522,7 +529,7 @@ def proxy_set_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "proxy_unset")
+@dispatcher.callback("proxy_unset")
 def proxy_unset_callback(call):
     if call.from_user.id != ADMIN_ID:
         bot.answer_callback_query(call.id, "Доступ запрещён.", show_alert=True)
@@ -545,7 +552,7 @@ def proxy_unset_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "proxy_check")
+@dispatcher.callback("proxy_check")
 def proxy_check_callback(call):
     if call.from_user.id != ADMIN_ID:
         bot.answer_callback_query(call.id, "Доступ запрещён.", show_alert=True)
@@ -593,7 +600,7 @@ def unset_proxy_command(message):
     update_proxy_in_config("", "", "")
     bot.send_message(message.chat.id, "❌ Прокси сброшен! Рекомендуется перезапустить бота.")
 
-@bot.message_handler(func=lambda message: get_user_state(message.from_user.id)["state"] == "waiting_for_proxy_url")
+@dispatcher.state("waiting_for_proxy_url")
 def process_proxy_url(message):
     if message.from_user.id != ADMIN_ID:
         bot.send_message(message.chat.id, "Доступ запрещён.")
@@ -644,7 +651,7 @@ def process_proxy_url(message):
 
 # --- КОНЕЦ ПРОКСИ ---
 
-@bot.callback_query_handler(func=lambda call: call.data == "statistics")
+@dispatcher.callback("statistics")
 def statistics_callback(call):
     if not is_user_authorized(call.from_user.id):
         bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
@@ -682,7 +689,7 @@ def statistics_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "help_menu")
+@dispatcher.callback("help_menu")
 def help_menu_callback(call):
     help_text = (
         "❓ **Справка по использованию бота:**\n\n"
@@ -720,7 +727,7 @@ def help_menu_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "back_to_main")
+@dispatcher.callback("back_to_main")
 def back_to_main_callback(call):
     bot.edit_message_text(
         "🎮 **Steam Rental by Lini**\n\n"
@@ -732,7 +739,7 @@ def back_to_main_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "get_guard_code")
+@dispatcher.callback("get_guard_code")
 def get_guard_code_callback(call):
     """Получение Steam Guard кода через кнопку"""
     user_id = str(call.from_user.id)
@@ -783,11 +790,11 @@ def get_guard_code_callback(call):
         account_name = account['account_name']
         
         # Получаем путь к .maFile
-        conn = sqlite3.connect("database.db")
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT path_to_maFile FROM accounts WHERE ID = ?", (account_id,))
         result = cursor.fetchone()
-        conn.close()
+        cursor.close()
         
         if not result or not result[0]:
             bot.edit_message_text(
@@ -803,9 +810,9 @@ def get_guard_code_callback(call):
         mafile_path = result[0]
         
         # Генерируем Steam Guard код
-        from steamHandler.SteamGuard import get_steam_guard_code
+        from steamHandler.SteamGuard import get_steam_guard_codes, format_code_validity
         
-        guard_code = get_steam_guard_code(mafile_path)
+        guard_code, next_code, seconds_left = get_steam_guard_codes(mafile_path)
         
         if guard_code:
             # Обновляем счетчик доступа
@@ -815,7 +822,7 @@ def get_guard_code_callback(call):
                 f"🔑 **Steam Guard код**\n\n"
                 f"**Аккаунт:** {account_name}\n"
                 f"**Код:** `{guard_code}`\n\n"
-                f"⏰ Код действителен 30 секунд\n"
+                f"{format_code_validity(next_code, seconds_left)}\n"
                 f"🔄 Для получения нового кода отправьте /code\n\n"
                 f"💡 **Полезные команды:**\n"
                 f"/accounts - мои аккаунты\n"
@@ -867,7 +874,7 @@ def get_guard_code_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("get_code_"))
+@dispatcher.callback_prefix("get_code_")
 def get_code_for_account_callback(call):
     """Получение Steam Guard кода для конкретного аккаунта"""
     user_id = str(call.from_user.id)
@@ -875,7 +882,7 @@ def get_code_for_account_callback(call):
     
     try:
         # Получаем информацию об аккаунте
-        conn = sqlite3.connect("database.db")
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
             SELECT account_name, path_to_maFile, owner 
@@ -883,7 +890,7 @@ def get_code_for_account_callback(call):
             WHERE ID = ? AND owner = ?
         """, (account_id, user_id))
         result = cursor.fetchone()
-        conn.close()
+        cursor.close()
         
         if not result:
             bot.edit_message_text(
@@ -908,9 +915,9 @@ def get_code_for_account_callback(call):
             return
         
         # Генерируем Steam Guard код
-        from steamHandler.SteamGuard import get_steam_guard_code
+        from steamHandler.SteamGuard import get_steam_guard_codes, format_code_validity
         
-        guard_code = get_steam_guard_code(mafile_path)
+        guard_code, next_code, seconds_left = get_steam_guard_codes(mafile_path)
         
         if guard_code:
             # Обновляем счетчик доступа
@@ -920,7 +927,7 @@ def get_code_for_account_callback(call):
                 f"🔑 **Steam Guard код**\n\n"
                 f"**Аккаунт:** {account_name}\n"
                 f"**Код:** `{guard_code}`\n\n"
-                f"⏰ Код действителен 30 секунд\n"
+                f"{format_code_validity(next_code, seconds_left)}\n"
                 f"🔄 Для получения нового кода отправьте /code\n\n"
                 f"💡 **Полезные команды:**\n"
                 f"/accounts - мои аккаунты\n"
@@ -1014,7 +1021,7 @@ def test_accounts_command(message):
     
     try:
         # Получаем все аккаунты с владельцами
-        conn = sqlite3.connect("database.db")
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
             SELECT ID, account_name, owner, rental_start, rental_duration, login, password
@@ -1023,7 +1030,7 @@ def test_accounts_command(message):
             ORDER BY rental_start DESC
         """)
         all_accounts = cursor.fetchall()
-        conn.close()
+        cursor.close()
         
         if not all_accounts:
             bot.send_message(
@@ -1091,22 +1098,22 @@ def accounts_command(message):
         logger.info(f"User {user_id} (@{username}) requested accounts, found {len(accounts)} accounts")
         
         # Проверяем все аккаунты в базе для отладки
-        conn = sqlite3.connect("database.db")
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT ID, account_name, owner, rental_start FROM accounts WHERE owner IS NOT NULL")
         all_accounts = cursor.fetchall()
-        conn.close()
+        cursor.close()
         
         logger.info(f"All accounts with owners: {all_accounts}")
         logger.info(f"Looking for user_id: {user_id}, username: {username}")
         
         if not accounts:
             # Проверяем, есть ли аккаунты с этим пользователем
-            conn = sqlite3.connect("database.db")
+            conn = get_connection()
             cursor = conn.cursor()
             cursor.execute("SELECT ID, account_name, owner FROM accounts WHERE owner = ? OR owner = ?", (user_id, username))
             user_accounts = cursor.fetchall()
-            conn.close()
+            cursor.close()
             
             logger.info(f"Direct query for user {user_id} or {username}: {user_accounts}")
             
@@ -1203,22 +1210,22 @@ def code_command(message):
         logger.info(f"User {user_id} (@{username}) requested Steam Guard code, found {len(accounts)} accounts")
         
         # Проверяем все аккаунты в базе для отладки
-        conn = sqlite3.connect("database.db")
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT ID, account_name, owner, rental_start FROM accounts WHERE owner IS NOT NULL")
         all_accounts = cursor.fetchall()
-        conn.close()
+        cursor.close()
         
         logger.info(f"All accounts with owners: {all_accounts}")
         logger.info(f"Looking for user_id: {user_id}, username: {username}")
         
         if not accounts:
             # Проверяем, есть ли аккаунты с этим пользователем
-            conn = sqlite3.connect("database.db")
+            conn = get_connection()
             cursor = conn.cursor()
             cursor.execute("SELECT ID, account_name, owner FROM accounts WHERE owner = ? OR owner = ?", (user_id, username))
             user_accounts = cursor.fetchall()
-            conn.close()
+            cursor.close()
             
             logger.info(f"Direct query for user {user_id} or {username}: {user_accounts}")
             
@@ -1265,11 +1272,11 @@ def code_command(message):
         account_name = account['account_name']
         
         # Получаем путь к .maFile
-        conn = sqlite3.connect("database.db")
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT path_to_maFile FROM accounts WHERE ID = ?", (account_id,))
         result = cursor.fetchone()
-        conn.close()
+        cursor.close()
         
         if not result or not result[0]:
             bot.send_message(
@@ -1284,9 +1291,9 @@ def code_command(message):
         mafile_path = result[0]
         
         # Генерируем Steam Guard код
-        from steamHandler.SteamGuard import get_steam_guard_code
+        from steamHandler.SteamGuard import get_steam_guard_codes, format_code_validity
         
-        guard_code = get_steam_guard_code(mafile_path)
+        guard_code, next_code, seconds_left = get_steam_guard_codes(mafile_path)
         
         if guard_code:
             # Обновляем счетчик доступа
@@ -1296,7 +1303,7 @@ def code_command(message):
                 f"🔑 **Steam Guard код**\n\n"
                 f"**Аккаунт:** {account_name}\n"
                 f"**Код:** `{guard_code}`\n\n"
-                f"⏰ Код действителен 30 секунд\n"
+                f"{format_code_validity(next_code, seconds_left)}\n"
                 f"🔄 Для получения нового кода отправьте /code\n\n"
                 f"💡 **Полезные команды:**\n"
                 f"/accounts - мои аккаунты\n"
@@ -1392,9 +1399,7 @@ def start(message):
         reply_markup=get_main_keyboard()
     )
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"] == "waiting_for_secret_phrase"
-)
+@dispatcher.state("waiting_for_secret_phrase")
 def process_secret_phrase(message):
     if message.text == SECRET_PHRASE:
         # Авторизуем пользователя и сохраняем в базу данных
@@ -1408,7 +1413,7 @@ def process_secret_phrase(message):
         
         if success:
             clear_user_state(message.from_user.id)
-            all_accounts = len(db_bot.get_all_accounts())
+            all_accounts = db_bot.get_total_accounts()
             owned_accounts = all_accounts - len(db_bot.get_unowned_accounts())
             
             # Получаем информацию о пользователе для приветствия
@@ -1432,16 +1437,13 @@ def process_secret_phrase(message):
     else:
         bot.send_message(message.chat.id, "❌ Неверная фраза. Попробуйте снова.")
 
-@bot.callback_query_handler(func=lambda call: call.data == "add_account")
+@dispatcher.callback("add_account")
 def process_add_account(call):
     set_user_state(call.from_user.id, "waiting_for_lot_count", {})
     bot.send_message(call.message.chat.id, "Сколько лотов вы хотите добавить?")
     bot.answer_callback_query(call.id)
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_lot_count"
-)
+@dispatcher.state("waiting_for_lot_count")
 def process_lot_count(message):
     if not message.text.isdigit() or int(message.text) <= 0:
         bot.send_message(message.chat.id, "Пожалуйста, введите положительное число.")
@@ -1455,10 +1457,7 @@ def process_lot_count(message):
     )
     bot.send_message(message.chat.id, "Введите название для лота 1.")
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_lot_names"
-)
+@dispatcher.state("waiting_for_lot_names")
 def process_lot_names(message):
     state_data = get_user_state(message.from_user.id)["data"]
     state_data["lot_names"].append(message.text)
@@ -1480,7 +1479,7 @@ def process_lot_names(message):
             message.chat.id, "Сколько аккаунтов вы хотите добавить для каждого лота?"
         )
 
-@bot.callback_query_handler(func=lambda call: call.data == "delete_account")
+@dispatcher.callback("delete_account")
 def process_delete_account(call):
     set_user_state(call.from_user.id, "waiting_for_account_id", {})
     bot.send_message(
@@ -1488,7 +1487,7 @@ def process_delete_account(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "change_password")
+@dispatcher.callback("change_password")
 def process_change_password(call):
     set_user_state(call.from_user.id, "waiting_for_change_password_id", {})
     bot.send_message(
@@ -1497,7 +1496,7 @@ def process_change_password(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "stop_rent")
+@dispatcher.callback("stop_rent")
 def process_stop_rent(call):
     set_user_state(call.from_user.id, "waiting_for_stop_rent_id", {})
     bot.send_message(
@@ -1506,7 +1505,7 @@ def process_stop_rent(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "manual_rent")
+@dispatcher.callback("manual_rent")
 def manual_rent_callback(call):
     set_user_state(call.from_user.id, "waiting_for_manual_rent_id", {})
     bot.send_message(
@@ -1514,7 +1513,7 @@ def manual_rent_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "extend_rental")
+@dispatcher.callback("extend_rental")
 def extend_rental_callback(call):
     set_user_state(call.from_user.id, "waiting_for_extend_rental_id", {})
     bot.send_message(
@@ -1522,10 +1521,7 @@ def extend_rental_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_owner_name"
-)
+@dispatcher.state("waiting_for_owner_name")
 def process_owner_name(message):
     owner_name = message.text
     state_data = {"owner_name": owner_name}
@@ -1535,10 +1531,7 @@ def process_owner_name(message):
         f"Введите количество часов, которые вы хотите добавить для {owner_name}.",
     )
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_hours_to_add"
-)
+@dispatcher.state("waiting_for_hours_to_add")
 def process_hours_to_add(message):
     if not message.text.isdigit() or int(message.text) <= 0:
         bot.send_message(
@@ -1576,10 +1569,7 @@ def process_hours_to_add(message):
     finally:
         clear_user_state(message.from_user.id)
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_count"
-)
+@dispatcher.state("waiting_for_count")
 def process_count(message):
     if not message.text.isdigit() or int(message.text) <= 0:
         bot.send_message(message.chat.id, "Пожалуйста, введите положительное число.")
@@ -1595,10 +1585,7 @@ def process_count(message):
         parse_mode="Markdown",
     )
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_lot_duration"
-)
+@dispatcher.state("waiting_for_lot_duration")
 def process_lot_duration(message):
     if not message.text.isdigit() or int(message.text) <= 0:
         bot.send_message(
@@ -1626,7 +1613,7 @@ def process_lot_duration(message):
             message.chat.id, "Пожалуйста, загрузите .maFile для аккаунта 1."
         )
 
-@bot.message_handler(content_types=["document"])
+@dispatcher.state("waiting_for_mafile", content_types=["document"])
 def process_mafile(message):
     state = get_user_state(message.from_user.id)
     if state["state"] != "waiting_for_mafile":
@@ -1663,20 +1650,14 @@ def process_mafile(message):
     except Exception as e:
         bot.send_message(message.chat.id, f"Ошибка при сохранении файла: {str(e)}")
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_login"
-)
+@dispatcher.state("waiting_for_login")
 def process_login(message):
     state_data = get_user_state(message.from_user.id)["data"]
     state_data["login"] = message.text
     set_user_state(message.from_user.id, "waiting_for_password", state_data)
     bot.send_message(message.chat.id, "Логин сохранен. Теперь отправьте пароль.")
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_password"
-)
+@dispatcher.state("waiting_for_password")
 def process_password(message):
     state_data = get_user_state(message.from_user.id)["data"]
     current_count = state_data.get("current_count", 0)
@@ -1705,10 +1686,7 @@ def process_password(message):
             f"Все {state_data['total_count']} аккаунтов успешно добавлены! Настройка завершена.",
         )
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_account_id"
-)
+@dispatcher.state("waiting_for_account_id")
 def delete_account_by_id_handler(message):
     if not message.text.isdigit():
         bot.send_message(message.chat.id, "Пожалуйста, введите валидный числовой ID.")
@@ -1724,10 +1702,7 @@ def delete_account_by_id_handler(message):
 
     clear_user_state(message.from_user.id)
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_change_password_id"
-)
+@dispatcher.state("waiting_for_change_password_id")
 def change_password_by_id_handler(message):
     if not message.text.isdigit():
         bot.send_message(message.chat.id, "Пожалуйста, введите валидный числовой ID.")
@@ -1737,7 +1712,7 @@ def change_password_by_id_handler(message):
     bot.send_message(
         message.chat.id, f"🔐 Изменение пароля для аккаунта с ID {account_id}..."
     )
-    conn = sqlite3.connect("database.db")
+    conn = get_connection()
     cursor = conn.cursor()
 
     try:
@@ -1788,53 +1763,28 @@ def change_password_by_id_handler(message):
                 f"Пароль для всех аккаунтов с логином '{login}' успешно изменен на {new_password}.",
             )
     finally:
-        conn.close()
+        cursor.close()
         clear_user_state(message.from_user.id)
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_stop_rent_id"
-)
+@dispatcher.state("waiting_for_stop_rent_id")
 def stop_rent_by_id_handler(message):
     if not message.text.isdigit():
         bot.send_message(message.chat.id, "Пожалуйста, введите валидный числовой ID.")
         return
 
     account_id = int(message.text)
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
 
     try:
-        cursor.execute(
-            """
-            SELECT login
-            FROM accounts
-            WHERE ID = ?
-            """,
-            (account_id,),
-        )
-        result = cursor.fetchone()
+        login, released = db_bot.stop_rentals_by_login(account_id)
 
-        if not result:
+        if login is None:
             bot.send_message(
                 message.chat.id,
                 f"Аккаунт с ID {account_id} не найден.",
             )
             return
 
-        login = result[0]
-
-        cursor.execute(
-            """
-            UPDATE accounts
-            SET owner = NULL, rental_start = NULL
-            WHERE login = ?
-            """,
-            (login,),
-        )
-
-        if cursor.rowcount > 0:
-            conn.commit()
+        if released > 0:
             bot.send_message(
                 message.chat.id,
                 f"Аренда всех аккаунтов с логином '{login}' успешно остановлена.",
@@ -1847,13 +1797,9 @@ def stop_rent_by_id_handler(message):
     except Exception as e:
         bot.send_message(message.chat.id, f"Ошибка при остановке аренды: {str(e)}")
     finally:
-        conn.close()
         clear_user_state(message.from_user.id)
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_manual_rent_id"
-)
+@dispatcher.state("waiting_for_manual_rent_id")
 def process_manual_rent_id(message):
     if not message.text.isdigit():
         bot.send_message(message.chat.id, "Пожалуйста, введите валидный числовой ID.")
@@ -1864,10 +1810,7 @@ def process_manual_rent_id(message):
     set_user_state(message.from_user.id, "waiting_for_manual_rent_owner", state_data)
     bot.send_message(message.chat.id, "Введите никнейм владельца для аренды.")
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_manual_rent_owner"
-)
+@dispatcher.state("waiting_for_manual_rent_owner")
 def process_manual_rent_owner(message):
     state_data = get_user_state(message.from_user.id)["data"]
     account_id = state_data["account_id"]
@@ -1906,10 +1849,7 @@ def process_manual_rent_owner(message):
     finally:
         clear_user_state(message.from_user.id)
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_extend_rental_id"
-)
+@dispatcher.state("waiting_for_extend_rental_id")
 def process_extend_rental_id(message):
     if not message.text.isdigit():
         bot.send_message(message.chat.id, "Пожалуйста, введите валидный числовой ID.")
@@ -1920,10 +1860,7 @@ def process_extend_rental_id(message):
     set_user_state(message.from_user.id, "waiting_for_extend_rental_duration", state_data)
     bot.send_message(message.chat.id, "На сколько часов вы хотите продлить аренду?")
 
-@bot.message_handler(
-    func=lambda message: get_user_state(message.from_user.id)["state"]
-    == "waiting_for_extend_rental_duration"
-)
+@dispatcher.state("waiting_for_extend_rental_duration")
 def process_extend_rental_duration(message):
     if not message.text.isdigit() or int(message.text) <= 0:
         bot.send_message(message.chat.id, "Пожалуйста, введите положительное число часов.")
@@ -1963,7 +1900,7 @@ def process_extend_rental_duration(message):
 def send_message_to_admin(message):
     bot.send_message(ADMIN_ID, message)
 
-@bot.callback_query_handler(func=lambda call: call.data == "system_settings")
+@dispatcher.callback("system_settings")
 def system_settings_callback(call):
     if not is_user_authorized(call.from_user.id):
         bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
@@ -1979,7 +1916,7 @@ def system_settings_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "notification_settings")
+@dispatcher.callback("notification_settings")
 def notification_settings_callback(call):
     if not is_user_authorized(call.from_user.id):
         bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
@@ -1995,7 +1932,7 @@ def notification_settings_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "proxy_status")
+@dispatcher.callback("proxy_status")
 def proxy_status_callback(call):
     if not is_user_authorized(call.from_user.id):
         bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
@@ -2018,7 +1955,7 @@ def proxy_status_callback(call):
     )
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "database_settings")
+@dispatcher.callback("database_settings")
 def database_settings_callback(call):
     if not is_user_authorized(call.from_user.id):
         bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
@@ -2054,7 +1991,7 @@ def database_settings_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "auto_refresh_toggle")
+@dispatcher.callback("auto_refresh_toggle")
 def auto_refresh_toggle_callback(call):
     if not is_user_authorized(call.from_user.id):
         bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
@@ -2062,7 +1999,7 @@ def auto_refresh_toggle_callback(call):
     
     bot.answer_callback_query(call.id, "Функция в разработке")
 
-@bot.callback_query_handler(func=lambda call: call.data == "timeout_settings")
+@dispatcher.callback("timeout_settings")
 def timeout_settings_callback(call):
     if not is_user_authorized(call.from_user.id):
         bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
@@ -2088,7 +2025,7 @@ def get_users_keyboard():
     )
     return keyboard
 
-@bot.callback_query_handler(func=lambda call: call.data == "users_menu")
+@dispatcher.callback("users_menu")
 def users_menu_callback(call):
     """Меню управления пользователями."""
     if call.from_user.id != ADMIN_ID:
@@ -2138,42 +2075,33 @@ def split_message(text, max_length=4000):
     
     return parts
 
-@bot.callback_query_handler(func=lambda call: call.data == "users_list")
+@dispatcher.callback("users_list")
+@dispatcher.callback_prefix("users_list_next_", "users_list_prev_")
 def users_list_callback(call):
-    """Список всех пользователей."""
+    """Список всех пользователей (постранично)."""
     if call.from_user.id != ADMIN_ID:
         bot.answer_callback_query(call.id, "Доступ запрещён.")
         return
     
     try:
-        users = db_bot.get_all_users_info()
+        after_id, before_id, page = None, None, 0
+        if call.data != "users_list":
+            after_id, before_id, page = parse_page_callback(call.data)
+        users_page = db_bot.get_users_page(after_id, before_id, limit=LIST_PAGE_SIZE)
+        users = users_page["items"]
         
         if not users:
             message = "📋 **Список пользователей пуст**"
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(InlineKeyboardButton("🔄 Обновить", callback_data="users_list"))
-            keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data="users_menu"))
-            
-            try:
-                bot.edit_message_text(
-                    message,
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    parse_mode="Markdown",
-                    reply_markup=keyboard
-                )
-            except Exception as edit_error:
-                if "message is not modified" not in str(edit_error):
-                    bot.send_message(call.message.chat.id, message, parse_mode="Markdown", reply_markup=keyboard)
         else:
             # Создаем сообщение
-            message = "👥 **Список пользователей:**\n\n"
-            for i, user in enumerate(users, 1):
+            total_pages = max(1, (users_page["total"] + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE)
+            message = f"👥 **Список пользователей** (стр. {page + 1}/{total_pages}):\n\n"
+            for i, user in enumerate(users, page * LIST_PAGE_SIZE + 1):
                 status = "✅ Активен" if user['is_active'] else "❌ Заблокирован"
                 username = f"@{user['username']}" if user['username'] else "Без username"
-                name = f"{user['first_name']} {user['last_name']}".strip() or "Без имени"
+                name = f"{user['first_name'] or ''} {user['last_name'] or ''}".strip() or "Без имени"
                 
-                user_info = (
+                message += (
                     f"**{i}.** {name}\n"
                     f"   🆔 ID: `{user['user_id']}`\n"
                     f"   👤 Username: {username}\n"
@@ -2182,47 +2110,23 @@ def users_list_callback(call):
                     f"   🔐 Права: {user['permissions']}\n"
                     f"   📊 Статус: {status}\n\n"
                 )
-                
-                # Проверяем, не превысит ли добавление лимит
-                if len(message + user_info) > 4000:
-                    # Отправляем текущую часть
-                    keyboard = InlineKeyboardMarkup()
-                    keyboard.add(InlineKeyboardButton("🔄 Обновить", callback_data="users_list"))
-                    keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data="users_menu"))
-                    
-                    try:
-                        bot.edit_message_text(
-                            message,
-                            chat_id=call.message.chat.id,
-                            message_id=call.message.message_id,
-                            parse_mode="Markdown",
-                            reply_markup=keyboard
-                        )
-                    except Exception as edit_error:
-                        if "message is not modified" not in str(edit_error):
-                            bot.send_message(call.message.chat.id, message, parse_mode="Markdown", reply_markup=keyboard)
-                    
-                    # Начинаем новое сообщение
-                    message = f"👥 **Список пользователей (продолжение):**\n\n{user_info}"
-                else:
-                    message += user_info
-            
-            # Отправляем последнюю часть
-            keyboard = InlineKeyboardMarkup()
-            keyboard.add(InlineKeyboardButton("🔄 Обновить", callback_data="users_list"))
-            keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data="users_menu"))
-            
-            try:
-                bot.edit_message_text(
-                    message,
-                    chat_id=call.message.chat.id,
-                    message_id=call.message.message_id,
-                    parse_mode="Markdown",
-                    reply_markup=keyboard
-                )
-            except Exception as edit_error:
-                if "message is not modified" not in str(edit_error):
-                    bot.send_message(call.message.chat.id, message, parse_mode="Markdown", reply_markup=keyboard)
+        
+        keyboard = InlineKeyboardMarkup()
+        add_page_buttons(keyboard, "users_list", page, users_page, "user_id")
+        keyboard.add(InlineKeyboardButton("🔄 Обновить", callback_data="users_list"))
+        keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data="users_menu"))
+        
+        try:
+            bot.edit_message_text(
+                message,
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                parse_mode="Markdown",
+                reply_markup=keyboard
+            )
+        except Exception as edit_error:
+            if "message is not modified" not in str(edit_error):
+                bot.send_message(call.message.chat.id, message, parse_mode="Markdown", reply_markup=keyboard)
                     
     except Exception as e:
         logger.error(f"Error in users_list_callback: {str(e)}")
@@ -2236,7 +2140,7 @@ def users_list_callback(call):
     except:
         pass
 
-@bot.callback_query_handler(func=lambda call: call.data == "users_add")
+@dispatcher.callback("users_add")
 def users_add_callback(call):
     """Добавление пользователя."""
     if call.from_user.id != ADMIN_ID:
@@ -2266,7 +2170,7 @@ def users_add_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.message_handler(func=lambda message: get_user_state(message.from_user.id)["state"] == "waiting_for_user_id")
+@dispatcher.state("waiting_for_user_id")
 def process_user_id(message):
     """Обработка ID пользователя для добавления."""
     if message.from_user.id != ADMIN_ID:
@@ -2306,7 +2210,7 @@ def process_user_id(message):
         bot.send_message(message.chat.id, f"❌ Ошибка: {str(e)}")
         clear_user_state(message.from_user.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "users_stats")
+@dispatcher.callback("users_stats")
 def users_stats_callback(call):
     """Статистика пользователей."""
     if call.from_user.id != ADMIN_ID:
@@ -2375,64 +2279,82 @@ def show_customers(message):
         return
 
     try:
-        # Получаем активность покупателей
-        activity = db_bot.get_customer_activity()
-        
-        if not activity:
-            bot.send_message(message.chat.id, "📋 Нет данных о покупателях.")
-            return
+        send_customers_page(message.chat.id)
+    except Exception as e:
+        bot.send_message(message.chat.id, f"❌ Ошибка при получении данных покупателей: {str(e)}")
 
-        # Группируем по покупателям
-        customers = {}
-        for record in activity:
-            username = record['customer_username']
-            if username not in customers:
-                customers[username] = []
-            customers[username].append(record)
 
-        response = "👥 **Активность покупателей:**\n\n"
-        
-        for username, records in list(customers.items())[:10]:  # Показываем только первых 10
-            # Получаем статистику покупателя
-            stats = db_bot.get_customer_stats(username)
-            
-            response += f"🛒 **Покупатель:** `{username}`\n"
-            response += f"📊 **Покупок:** {stats.get('total_purchases', 0)}\n"
-            response += f"⏱ **Часов аренды:** {stats.get('total_rental_hours', 0)}\n"
-            response += f"🔑 **Обращений к данным:** {stats.get('total_accesses', 0)}\n"
-            response += f"⭐ **Средний рейтинг:** {stats.get('avg_rating', 'Нет отзывов')}\n"
-            response += f"🔄 **Продлений:** {stats.get('total_extensions', 0)} (+{stats.get('total_extension_hours', 0)}ч)\n\n"
-            
-            # Показываем последние активности
-            recent_records = sorted(records, key=lambda x: x['updated_at'], reverse=True)[:3]
-            for record in recent_records:
-                status = "🟢 Активна" if record['is_active'] else "🔴 Завершена"
-                response += f"  📝 **Аккаунт:** {record['account_name']} (ID: {record['account_id']}) - {status}\n"
-                if record['feedback_rating']:
-                    response += f"  ⭐ **Отзыв:** {record['feedback_rating']}/5 - {record['feedback_text'][:50]}...\n"
-                response += f"  🔑 **Обращений:** {record['access_count']}/{record['max_access_count']}\n"
-                response += f"  📅 **Обновлено:** {record['updated_at']}\n\n"
-            
-            response += "─" * 40 + "\n\n"
+@dispatcher.callback_prefix("customers_next_")
+def customers_page_callback(call):
+    """Следующая страница /customers."""
+    if call.from_user.id != ADMIN_ID:
+        bot.answer_callback_query(call.id, "Доступ запрещён.")
+        return
 
-        if len(customers) > 10:
-            response += f"... и еще {len(customers) - 10} покупателей\n\n"
+    try:
+        # customers_next_<страница>_<последний покупатель>: имя в конце, оно может содержать "_"
+        _, _, page, after = call.data.split("_", 3)
+        send_customers_page(call.message.chat.id, after, int(page))
+    except Exception as e:
+        bot.send_message(call.message.chat.id, f"❌ Ошибка при получении данных покупателей: {str(e)}")
+    bot.answer_callback_query(call.id)
 
-        response += "💡 **Команды:**\n"
-        response += "• `/customer <username>` - детальная информация о покупателе\n"
-        response += "• `/customers_recent` - последние активности\n"
 
-        # Разбиваем сообщение если оно слишком длинное
-        if len(response) > 4000:
-            parts = response.split("─" * 40)
-            for i, part in enumerate(parts):
-                if part.strip():
-                    bot.send_message(message.chat.id, part.strip(), parse_mode="Markdown")
-        else:
-            bot.send_message(message.chat.id, response, parse_mode="Markdown")
+def send_customers_page(chat_id, after=None, page=0):
+    # Сводная статистика: одно чтение customer_stats вместо всей истории
+    total_customers, customers, has_next = db_bot.get_recent_customers(LIST_PAGE_SIZE, after)
+    
+    if not customers:
+        bot.send_message(chat_id, "📋 Нет данных о покупателях.")
+        return
 
-    except Exception as e:
-        bot.send_message(message.chat.id, f"❌ Ошибка при получении данных покупателей: {str(e)}")
+    response = "👥 **Активность покупателей:**\n\n"
+    
+    for stats in customers:
+        username = stats['customer_username']
+        
+        response += f"🛒 **Покупатель:** `{username}`\n"
+        response += f"📊 **Покупок:** {stats.get('total_purchases', 0)}\n"
+        response += f"⏱ **Часов аренды:** {stats.get('total_rental_hours', 0)}\n"
+        response += f"🔑 **Обращений к данным:** {stats.get('total_accesses', 0)}\n"
+        response += f"⭐ **Средний рейтинг:** {stats.get('avg_rating', 'Нет отзывов')}\n"
+        response += f"🔄 **Продлений:** {stats.get('total_extensions', 0)} (+{stats.get('total_extension_hours', 0)}ч)\n\n"
+        
+        # Показываем последние активности
+        recent_records = db_bot.get_customer_activity(customer_username=username, limit=3)
+        for record in recent_records:
+            status = "🟢 Активна" if record['is_active'] else "🔴 Завершена"
+            response += f"  📝 **Аккаунт:** {record['account_name']} (ID: {record['account_id']}) - {status}\n"
+            if record['feedback_rating']:
+                response += f"  ⭐ **Отзыв:** {record['feedback_rating']}/5 - {record['feedback_text'][:50]}...\n"
+            response += f"  🔑 **Обращений:** {record['access_count']}/{record['max_access_count']}\n"
+            response += f"  📅 **Обновлено:** {record['updated_at']}\n\n"
+        
+        response += "─" * 40 + "\n\n"
+
+    shown = page * LIST_PAGE_SIZE + len(customers)
+    if total_customers > shown:
+        response += f"... и еще {total_customers - shown} покупателей\n\n"
+
+    response += "💡 **Команды:**\n"
+    response += "• `/customer <username>` - детальная информация о покупателе\n"
+    response += "• `/customers_recent` - последние активности\n"
+
+    keyboard = None
+    next_data = f"customers_next_{page + 1}_{customers[-1]['customer_username']}"
+    # callback_data в Telegram ограничена 64 байтами
+    if has_next and len(next_data.encode()) <= 64:
+        keyboard = InlineKeyboardMarkup()
+        keyboard.add(InlineKeyboardButton("➡️ Следующие покупатели", callback_data=next_data))
+
+    # Разбиваем сообщение если оно слишком длинное
+    if len(response) > 4000:
+        parts = [part.strip() for part in response.split("─" * 40) if part.strip()]
+        for i, part in enumerate(parts):
+            bot.send_message(chat_id, part, parse_mode="Markdown",
+                             reply_markup=keyboard if i == len(parts) - 1 else None)
+    else:
+        bot.send_message(chat_id, response, parse_mode="Markdown", reply_markup=keyboard)
 
 
 @bot.message_handler(commands=["customer"])
@@ -2514,16 +2436,13 @@ def show_recent_customers(message):
         return
 
     try:
-        # Получаем последние активности
-        activity = db_bot.get_customer_activity()
+        # Получаем последние 20 активностей (уже отсортированы по времени обновления)
+        recent_activity = db_bot.get_customer_activity(limit=20)
         
-        if not activity:
+        if not recent_activity:
             bot.send_message(message.chat.id, "📋 Нет данных о покупателях.")
             return
 
-        # Сортируем по времени обновления и берем последние 20
-        recent_activity = sorted(activity, key=lambda x: x['updated_at'], reverse=True)[:20]
-
         response = "🕒 **Последние активности покупателей:**\n\n"
         
         for record in recent_activity:
@@ -2544,7 +2463,7 @@ def show_recent_customers(message):
 
 # --- УПРАВЛЕНИЕ АККАУНТАМИ ---
 
-@bot.callback_query_handler(func=lambda call: call.data == "manage_accounts")
+@dispatcher.callback("manage_accounts")
 def manage_accounts_callback(call):
     """Меню управления аккаунтами."""
     if call.from_user.id != ADMIN_ID:
@@ -2572,21 +2491,27 @@ def manage_accounts_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "manage_list_all")
+@dispatcher.callback("manage_list_all")
+@dispatcher.callback_prefix("manage_list_next_", "manage_list_prev_")
 def manage_list_all_callback(call):
-    """Список всех аккаунтов для управления."""
+    """Список всех аккаунтов для управления (постранично)."""
     if call.from_user.id != ADMIN_ID:
         bot.answer_callback_query(call.id, "Доступ запрещён.")
         return
     
     try:
-        accounts = db_bot.get_all_accounts()
+        after_id, before_id, page = None, None, 0
+        if call.data != "manage_list_all":
+            after_id, before_id, page = parse_page_callback(call.data)
+        accounts_page = db_bot.get_accounts_page(after_id, before_id, limit=LIST_PAGE_SIZE)
+        accounts = accounts_page["items"]
         
         if not accounts:
             message = "📋 **Список аккаунтов пуст**"
         else:
-            message = "📋 **Все аккаунты в системе:**\n\n"
-            for i, account in enumerate(accounts, 1):
+            total_pages = max(1, (accounts_page["total"] + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE)
+            message = f"📋 **Все аккаунты в системе** (стр. {page + 1}/{total_pages}):\n\n"
+            for i, account in enumerate(accounts, page * LIST_PAGE_SIZE + 1):
                 status = "🔴 В аренде" if account['owner'] else "🟢 Свободен"
                 owner_info = f"Владелец: {account['owner']}" if account['owner'] else "Свободен"
                 
@@ -2600,6 +2525,7 @@ def manage_list_all_callback(call):
                 )
         
         keyboard = InlineKeyboardMarkup()
+        add_page_buttons(keyboard, "manage_list", page, accounts_page, "id")
         keyboard.add(InlineKeyboardButton("🔄 Обновить", callback_data="manage_list_all"))
         keyboard.add(InlineKeyboardButton("⬅️ Назад", callback_data="manage_accounts"))
         
@@ -2627,7 +2553,7 @@ def manage_list_all_callback(call):
     except:
         pass
 
-@bot.callback_query_handler(func=lambda call: call.data == "manage_delete")
+@dispatcher.callback("manage_delete")
 def manage_delete_callback(call):
     """Удаление аккаунта."""
     if call.from_user.id != ADMIN_ID:
@@ -2661,7 +2587,7 @@ def manage_delete_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "manage_replace_mafile")
+@dispatcher.callback("manage_replace_mafile")
 def manage_replace_mafile_callback(call):
     """Замена .maFile аккаунта."""
     if call.from_user.id != ADMIN_ID:
@@ -2691,7 +2617,7 @@ def manage_replace_mafile_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "manage_validate_mafile")
+@dispatcher.callback("manage_validate_mafile")
 def manage_validate_mafile_callback(call):
     """Проверка .maFile."""
     if call.from_user.id != ADMIN_ID:
@@ -2721,7 +2647,7 @@ def manage_validate_mafile_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "manage_stats")
+@dispatcher.callback("manage_stats")
 def manage_stats_callback(call):
     """Статистика аккаунтов."""
     if call.from_user.id != ADMIN_ID:
@@ -2784,7 +2710,7 @@ def manage_stats_callback(call):
 
 # Обработчики состояний для управления аккаунтами
 
-@bot.message_handler(func=lambda message: get_user_state(message.from_user.id)["state"] == "waiting_for_account_id_to_delete")
+@dispatcher.state("waiting_for_account_id_to_delete")
 def process_account_id_to_delete(message):
     """Обработка ID аккаунта для удаления."""
     if message.from_user.id != ADMIN_ID:
@@ -2830,7 +2756,7 @@ def process_account_id_to_delete(message):
         bot.send_message(message.chat.id, f"❌ Ошибка: {str(e)}")
         clear_user_state(message.from_user.id)
 
-@bot.message_handler(func=lambda message: get_user_state(message.from_user.id)["state"] == "waiting_for_account_id_to_replace_mafile")
+@dispatcher.state("waiting_for_account_id_to_replace_mafile")
 def process_account_id_to_replace_mafile(message):
     """Обработка ID аккаунта для замены .maFile."""
     if message.from_user.id != ADMIN_ID:
@@ -2864,7 +2790,7 @@ def process_account_id_to_replace_mafile(message):
         bot.send_message(message.chat.id, f"❌ Ошибка: {str(e)}")
         clear_user_state(message.from_user.id)
 
-@bot.message_handler(func=lambda message: get_user_state(message.from_user.id)["state"] == "waiting_for_new_mafile", content_types=['document'])
+@dispatcher.state("waiting_for_new_mafile", content_types=["document"])
 def process_new_mafile(message):
     """Обработка нового .maFile файла."""
     if message.from_user.id != ADMIN_ID:
@@ -2934,7 +2860,7 @@ def process_new_mafile(message):
         bot.send_message(message.chat.id, f"❌ Ошибка при обработке .maFile: {str(e)}")
         clear_user_state(message.from_user.id)
 
-@bot.message_handler(func=lambda message: get_user_state(message.from_user.id)["state"] == "waiting_for_mafile_to_validate", content_types=['document'])
+@dispatcher.state("waiting_for_mafile_to_validate", content_types=["document"])
 def process_mafile_to_validate(message):
     """Обработка .maFile для проверки."""
     if message.from_user.id != ADMIN_ID:
@@ -2987,7 +2913,7 @@ def process_mafile_to_validate(message):
         clear_user_state(message.from_user.id)
 
 # Обработчик подтверждения удаления
-@bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_delete_"))
+@dispatcher.callback_prefix("confirm_delete_")
 def confirm_delete_callback(call):
     """Подтверждение удаления аккаунта."""
     if call.from_user.id != ADMIN_ID:
@@ -3029,7 +2955,7 @@ def confirm_delete_callback(call):
 
 # --- AUTOGUARD УПРАВЛЕНИЕ ---
 
-@bot.callback_query_handler(func=lambda call: call.data == "autoguard_menu")
+@dispatcher.callback("autoguard_menu")
 def autoguard_menu_callback(call):
     """Меню AutoGuard."""
     if call.from_user.id != ADMIN_ID:
@@ -3057,7 +2983,7 @@ def autoguard_menu_callback(call):
     
     bot.answer_callback_query(call.id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "autoguard_stats")
+@dispatcher.callback("autoguard_stats")
 def autoguard_stats_callback(call):
     """Статистика AutoGuard."""
     if call.from_user.id != ADMIN_ID:
@@ -3113,7 +3039,7 @@ def autoguard_stats_callback(call):
     except:
         pass
 
-@bot.callback_query_handler(func=lambda call: call.data == "autoguard_settings")
+@dispatcher.callback("autoguard_settings")
 def autoguard_settings_callback(call):
     """Настройки AutoGuard."""
     if call.from_user.id != ADMIN_ID:
@@ -3168,7 +3094,7 @@ def autoguard_settings_callback(call):
     except:
         pass
 
-@bot.callback_query_handler(func=lambda call: call.data == "autoguard_restart")
+@dispatcher.callback("autoguard_restart")
 def autoguard_restart_callback(call):
     """Перезапуск AutoGuard."""
     if call.from_user.id != ADMIN_ID:
@@ -3213,7 +3139,7 @@ def autoguard_restart_callback(call):
     except:
         pass
 
-@bot.callback_query_handler(func=lambda call: call.data == "autoguard_stop")
+@dispatcher.callback("autoguard_stop")
 def autoguard_stop_callback(call):
     """Остановка AutoGuard."""
     if call.from_user.id != ADMIN_ID:
@@ -3255,7 +3181,7 @@ def autoguard_stop_callback(call):
     except:
         pass
 
-@bot.callback_query_handler(func=lambda call: call.data == "autoguard_cleanup")
+@dispatcher.callback("autoguard_cleanup")
 def autoguard_cleanup_callback(call):
     """Очистка задач AutoGuard."""
     if call.from_user.id != ADMIN_ID:
@@ -3297,7 +3223,7 @@ def autoguard_cleanup_callback(call):
     except:
         pass
 
-@bot.callback_query_handler(func=lambda call: call.data == "autoguard_tasks")
+@dispatcher.callback("autoguard_tasks")
 def autoguard_tasks_callback(call):
     """Активные задачи AutoGuard."""
     if call.from_user.id != ADMIN_ID:
@@ -3364,7 +3290,7 @@ def autoguard_tasks_callback(call):
     except:
         pass
 
-@bot.callback_query_handler(func=lambda call: call.data == "autoguard_test")
+@dispatcher.callback("autoguard_test")
 def autoguard_test_callback(call):
     """Тест генерации Steam Guard кода."""
     if call.from_user.id != ADMIN_ID:
@@ -3372,41 +3298,46 @@ def autoguard_test_callback(call):
         return
     
     try:
-        # Получаем первый доступный аккаунт для теста
-        conn = sqlite3.connect("database.db")
+        # Проверяем генерацию кодов сразу для всех аккаунтов с .maFile
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
             SELECT id, account_name, path_to_maFile 
             FROM accounts 
             WHERE path_to_maFile IS NOT NULL 
-            LIMIT 1
         """)
         
-        test_account = cursor.fetchone()
-        conn.close()
+        test_accounts = cursor.fetchall()
+        cursor.close()
         
-        if not test_account:
+        if not test_accounts:
             message = "❌ **Тест AutoGuard:**\n\nНет доступных аккаунтов для тестирования."
         else:
-            account_id, account_name, mafile_path = test_account
+            from steamHandler.SteamGuard import generate_codes, load_secrets
             
-            from steamHandler.SteamGuard import get_steam_guard_code
+            started = time.perf_counter()
+            codes = generate_codes(load_secrets({row[2] for row in test_accounts}))
+            elapsed_ms = (time.perf_counter() - started) * 1000
             
-            guard_code = get_steam_guard_code(mafile_path)
+            failed = [(account_name, mafile_path) for _, account_name, mafile_path in test_accounts
+                      if mafile_path not in codes]
+            account_id, account_name, mafile_path = test_accounts[0]
             
-            if guard_code:
+            if not failed:
                 message = (
                     f"✅ **Тест AutoGuard успешен!**\n\n"
-                    f"**Аккаунт:** {account_name}\n"
-                    f"**Код:** `{guard_code}`\n\n"
+                    f"**Аккаунтов:** {len(test_accounts)}\n"
+                    f"**Пример:** {account_name} — `{codes[mafile_path]}`\n"
+                    f"**Время генерации:** {elapsed_ms:.1f} мс\n\n"
                     f"Система работает корректно."
                 )
             else:
+                failed_text = "\n".join(f"• {name}: {path}" for name, path in failed[:10])
                 message = (
                     f"❌ **Тест AutoGuard не удался!**\n\n"
-                    f"**Аккаунт:** {account_name}\n"
-                    f"**Файл:** {mafile_path}\n\n"
+                    f"**Ошибок:** {len(failed)} из {len(test_accounts)}\n"
+                    f"{failed_text}\n\n"
                     f"Проверьте .maFile и настройки."
                 )
         
@@ -3438,7 +3369,7 @@ def autoguard_test_callback(call):
     except:
         pass
 
-@bot.callback_query_handler(func=lambda call: call.data == "autoguard_logs")
+@dispatcher.callback("autoguard_logs")
 def autoguard_logs_callback(call):
     """Логи AutoGuard."""
     if call.from_user.id != ADMIN_ID:
@@ -3497,6 +3428,100 @@ def autoguard_logs_callback(call):
     except:
         pass
 
+@bot.message_handler(commands=["routes"])
+def show_route_stats(message):
+    """Статистика обработчиков кнопок и диалогов (админ)."""
+    if message.from_user.id != ADMIN_ID:
+        bot.send_message(message.chat.id, "❌ Доступ запрещён. Только для администратора.")
+        return
+
+    stats = dispatcher.get_statistics()
+    if not stats:
+        bot.send_message(message.chat.id, "📋 Обработчики еще не вызывались.")
+        return
+
+    response = f"⚙️ **Обработчики бота** (маршрутов: {dispatcher.route_count()})\n\n"
+    top = sorted(stats.items(), key=lambda item: item[1]["total_ms"], reverse=True)[:20]
+    for name, route in top:
+        response += (
+            f"`{name}`: {route['calls']} выз., ср. {route['avg_ms']} мс, "
+            f"макс. {route['max_ms']} мс, ошибок {route['errors']}\n"
+        )
+    bot.send_message(message.chat.id, response, parse_mode="Markdown")
+
+
+
+@bot.message_handler(commands=["outbox"])
+def show_outbox_stats(message):
+    """Состояние очереди исходящих сообщений FunPay (админ)."""
+    if message.from_user.id != ADMIN_ID:
+        bot.send_message(message.chat.id, "❌ Доступ запрещён. Только для администратора.")
+        return
+
+    stats = get_message_queue_stats()
+    bot.send_message(
+        message.chat.id,
+        f"📤 **Очередь сообщений FunPay**\n\n"
+        f"В очереди: {stats['depth']} (макс. {stats['max_depth']}), получателей: {stats['recipients']}\n"
+        f"Отправляется: {stats['in_flight']} из {stats['workers']} потоков\n"
+        f"Отправлено: {stats['sent']}, ошибок: {stats['failed']}, повторов: {stats['retried']}\n"
+        f"Пауз из-за флуд-лимита: {stats['flood_pauses']}, до конца паузы: {stats['paused_for']} сек\n"
+        f"Средняя задержка доставки: {stats['avg_latency_ms']} мс",
+        parse_mode="Markdown",
+    )
+
+@bot.message_handler(commands=["rotations"])
+def show_rotation_jobs(message):
+    """Очередь смены паролей и задачи, исчерпавшие попытки (админ)."""
+    if message.from_user.id != ADMIN_ID:
+        bot.send_message(message.chat.id, "❌ Доступ запрещён. Только для администратора.")
+        return
+
+    summary = db_bot.get_rotation_jobs_summary()
+    failed = db_bot.get_failed_rotation_jobs()
+    response = (
+        f"🔑 Смена паролей Steam\n\n"
+        f"Ожидают: {summary.get('pending', 0)}, выполняются: {summary.get('running', 0)}, "
+        f"выполнены: {summary.get('done', 0)}, не удалось: {summary.get('failed', 0)}\n"
+    )
+    if failed:
+        response += "\n❌ Не удалось сменить пароль (аккаунты сняты с продажи):\n"
+        for job in failed[:20]:
+            response += (
+                f"#{job['job_id']} {job['account_name'] or '—'} (ID {job['account_id']}, {job['login'] or '—'}), "
+                f"попыток {job['attempts']}, {job['updated_at']}: {job['last_error']}\n"
+            )
+            if job['new_password']:
+                # Попытка могла сменить пароль до сбоя - тогда в Steam действует этот пароль
+                response += f"   сохраненный новый пароль: {job['new_password']}\n"
+        response += "\nПовторить: /rotation_retry <ID задачи | all>"
+    # Без parse_mode: тексты ошибок могут содержать символы Markdown
+    bot.send_message(message.chat.id, response)
+
+
+@bot.message_handler(commands=["rotation_retry"])
+def retry_rotation_jobs(message):
+    """Вернуть задачи смены пароля из состояния failed в очередь (админ)."""
+    if message.from_user.id != ADMIN_ID:
+        bot.send_message(message.chat.id, "❌ Доступ запрещён. Только для администратора.")
+        return
+
+    args = message.text.split()[1:]
+    if len(args) != 1 or not (args[0] == "all" or args[0].isdigit()):
+        bot.send_message(message.chat.id, "Использование: /rotation_retry <ID задачи | all>")
+        return
+
+    count = db_bot.retry_failed_rotation_jobs(None if args[0] == "all" else int(args[0]))
+    if not count:
+        bot.send_message(message.chat.id, "📋 Задач в состоянии failed не найдено.")
+        return
+    password_rotation.wake()
+    bot.send_message(message.chat.id, f"🔄 Возвращено в очередь задач: {count}")
+
+# Маршрутизатор регистрируется последним, чтобы команды обрабатывались раньше состояний диалога
+dispatcher.install(bot)
+
+
 def main():
     bot.infinity_polling(none_stop=True, timeout=5)
 
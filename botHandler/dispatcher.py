@@ -0,0 +1,152 @@
+"""
+Маршрутизация обновлений Telegram-бота
+Вместо десятков фильтров telebot, которые проверяются по очереди для каждого
+обновления, бот регистрирует два обработчика: callback-запросы ищутся по точному
+значению call.data или по префиксу, сообщения - по состоянию диалога и типу содержимого.
+Для каждого маршрута считаются вызовы, ошибки и время обработки
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from logger import logger
+
+
+class RouteStats:
+    """Счетчики одного маршрута"""
+
+    __slots__ = ("calls", "errors", "total_time", "max_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": round(self.total_time * 1000, 2),
+            "avg_ms": round(self.total_time * 1000 / self.calls, 2) if self.calls else 0.0,
+            "max_ms": round(self.max_time * 1000, 2),
+        }
+
+
+class Dispatcher:
+    """Таблицы маршрутов callback-запросов и сообщений по состоянию диалога"""
+
+    def __init__(self, state_getter: Callable[[int], Optional[str]]):
+        self._state_getter = state_getter
+        self._callbacks: Dict[str, Callable] = {}
+        self._prefixes: Dict[str, Callable] = {}
+        # Длины зарегистрированных префиксов, от длинных к коротким
+        self._prefix_lengths: List[int] = []
+        self._states: Dict[Tuple[str, str], Callable] = {}
+        self._content_types = set()
+        self._stats: Dict[str, RouteStats] = {}
+        self._stats_lock = threading.Lock()
+
+    def callback(self, *data: str):
+        """Декоратор: обработчик callback-запросов с точным значением call.data"""
+        def decorator(handler):
+            for value in data:
+                self._add(self._callbacks, value, handler)
+            return handler
+        return decorator
+
+    def callback_prefix(self, *prefixes: str):
+        """Декоратор: обработчик callback-запросов, у которых call.data начинается с префикса"""
+        def decorator(handler):
+            for prefix in prefixes:
+                self._add(self._prefixes, prefix, handler)
+                if len(prefix) not in self._prefix_lengths:
+                    self._prefix_lengths.append(len(prefix))
+                    self._prefix_lengths.sort(reverse=True)
+            return handler
+        return decorator
+
+    def state(self, state: str, content_types: Optional[List[str]] = None):
+        """Декоратор: обработчик сообщений пользователя в состоянии диалога state"""
+        def decorator(handler):
+            for content_type in content_types or ["text"]:
+                self._add(self._states, (state, content_type), handler)
+                self._content_types.add(content_type)
+            return handler
+        return decorator
+
+    @staticmethod
+    def _add(routes: dict, key, handler):
+        if key in routes:
+            raise ValueError(f"Route {key!r} is already handled by {routes[key].__name__}")
+        routes[key] = handler
+
+    def resolve_callback(self, data: Optional[str]) -> Optional[Callable]:
+        if not data:
+            return None
+        handler = self._callbacks.get(data)
+        if handler is not None:
+            return handler
+        for length in self._prefix_lengths:
+            handler = self._prefixes.get(data[:length])
+            if handler is not None:
+                return handler
+        return None
+
+    def resolve_message(self, message) -> Optional[Callable]:
+        state = self._state_getter(message.from_user.id)
+        if state is None:
+            return None
+        return self._states.get((state, message.content_type))
+
+    def install(self, bot):
+        """
+        Регистрирует маршрутизатор в telebot. Вызывается после объявления команд,
+        чтобы команды обрабатывались раньше состояний диалога
+        """
+        bot.register_callback_query_handler(self._dispatch_callback, func=lambda call: True)
+        bot.register_message_handler(
+            self._dispatch_message,
+            func=lambda message: self.resolve_message(message) is not None,
+            content_types=sorted(self._content_types),
+        )
+
+    def _dispatch_callback(self, call):
+        handler = self.resolve_callback(call.data)
+        if handler is not None:
+            self._run(handler, call)
+
+    def _dispatch_message(self, message):
+        handler = self.resolve_message(message)
+        if handler is not None:
+            self._run(handler, message)
+
+    def _run(self, handler, update):
+        started = time.perf_counter()
+        failed = False
+        try:
+            handler(update)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                stats = self._stats.get(handler.__name__)
+                if stats is None:
+                    stats = self._stats[handler.__name__] = RouteStats()
+                stats.calls += 1
+                stats.errors += failed
+                stats.total_time += elapsed
+                stats.max_time = max(stats.max_time, elapsed)
+            if elapsed > 5:
+                logger.warning(f"Slow bot handler {handler.__name__}: {elapsed:.1f}s")
+
+    def get_statistics(self) -> dict:
+        """Счетчики по обработчикам: {имя: {"calls", "errors", "total_ms", "avg_ms", "max_ms"}}"""
+        with self._stats_lock:
+            return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+    def route_count(self) -> int:
+        return len(self._callbacks) + len(self._prefixes) + len(self._states)
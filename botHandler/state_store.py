@@ -0,0 +1,67 @@
+"""
+Хранилище состояний диалогов Telegram-бота
+У каждой записи есть срок жизни, общее число записей ограничено: при переполнении
+вытесняются давно не обновлявшиеся. В data хранятся только компактные значения
+(ID аккаунтов, введенные строки), а не строки таблиц - списки берутся из базы постранично
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+USER_STATE_TTL = 3600  # Через сколько секунд без изменений состояние диалога сбрасывается
+USER_STATE_MAX_ENTRIES = 1000  # Сколько незавершенных диалогов хранится одновременно
+
+
+class ConversationStateStore:
+    """Состояния диалогов по user_id с TTL и вытеснением по давности изменения"""
+
+    def __init__(self, ttl: float = USER_STATE_TTL, max_entries: int = USER_STATE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # user_id -> (state, data, expires_at); порядок - от давно измененных к недавним
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.expired = 0
+
+    def set(self, user_id: int, state: str, data: Optional[Dict[str, Any]] = None, ttl: Optional[float] = None):
+        now = time.monotonic()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[user_id] = (state, data or {}, expires_at)
+            self._entries.move_to_end(user_id)
+            self._purge_expired(now)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def get(self, user_id: int) -> Dict[str, Any]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return {"state": None, "data": {}}
+        state, data, expires_at = entry
+        if expires_at <= time.monotonic():
+            with self._lock:
+                if self._entries.get(user_id) is entry:
+                    del self._entries[user_id]
+                    self.expired += 1
+            return {"state": None, "data": {}}
+        return {"state": state, "data": data}
+
+    def clear(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _purge_expired(self, now: float):
+        # Записи упорядочены по времени изменения, поэтому просроченные (при общем TTL) - в начале
+        while self._entries:
+            user_id, (_, _, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[user_id]
+            self.expired += 1
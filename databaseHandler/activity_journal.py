@@ -0,0 +1,190 @@
+"""
+Отложенная запись аналитики (write-behind)
+События customer_activity и журнала действий пользователей копятся в памяти и
+записываются одной транзакцией каждые ACTIVITY_FLUSH_INTERVAL_MS мс или по
+накоплении ACTIVITY_FLUSH_MAX_EVENTS событий. Таблицы, от которых зависит выдача
+аккаунтов (accounts, rotation_jobs), по-прежнему пишутся синхронно.
+Неудачный сброс повторяется с растущей паузой; события не теряются из-за
+блокировки базы, а отбрасывается только событие, которое само не выполняется
+"""
+
+import atexit
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from logger import logger
+from databaseHandler.connection import DEFAULT_DB_NAME, get_connection
+
+ACTIVITY_FLUSH_INTERVAL_MS = 500  # Максимальная задержка записи события (мс)
+ACTIVITY_FLUSH_MAX_EVENTS = 200  # Сбрасывать журнал досрочно при таком числе событий
+ACTIVITY_RETRY_DELAY = 1.0  # Пауза после первого неудачного сброса (сек), далее удваивается
+ACTIVITY_RETRY_MAX_DELAY = 30.0  # Верхняя граница паузы между попытками сброса (сек)
+ACTIVITY_ISOLATE_AFTER_ATTEMPTS = 3  # После стольких неудач события пачки выполняются по одному
+
+
+def _is_lock_error(error: Exception) -> bool:
+    """База занята другим писателем - ошибка временная, событие не виновато"""
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+class ActivityJournal:
+    """Буфер SQL-событий одной базы с фоновым сбросом"""
+
+    def __init__(self, db_name: str = DEFAULT_DB_NAME,
+                 flush_interval_ms: int = ACTIVITY_FLUSH_INTERVAL_MS,
+                 flush_max_events: int = ACTIVITY_FLUSH_MAX_EVENTS):
+        self.db_name = db_name
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_events = flush_max_events
+        self._events: Deque[Tuple[str, tuple]] = deque()
+        self._condition = threading.Condition()
+        # Пачки пишутся строго по очереди, чтобы UPDATE не обогнал свой INSERT
+        self._flush_lock = threading.Lock()
+        self._failed_attempts = 0
+        # time.monotonic(), раньше которого фоновый поток не повторяет неудачный сброс
+        self._retry_at = 0.0
+        self._thread = None
+        self.running = False
+        self.written = 0
+        self.dropped = 0
+
+    def record(self, sql: str, params: tuple = ()):
+        """Поставить запись в очередь; выполнится при ближайшем сбросе"""
+        with self._condition:
+            self._events.append((sql, params))
+            if not self.running:
+                self._start()
+            if len(self._events) >= self.flush_max_events:
+                self._condition.notify()
+
+    def flush(self) -> int:
+        """
+        Записать все накопленные события в текущем потоке. Вызывается перед чтением
+        аналитики, чтобы видеть собственные записи. Возвращает число записанных событий
+        """
+        with self._flush_lock:
+            with self._condition:
+                if not self._events:
+                    return 0
+                batch = list(self._events)
+                self._events.clear()
+
+            try:
+                written = self._write(batch, isolate=self._failed_attempts >= ACTIVITY_ISOLATE_AFTER_ATTEMPTS)
+            except Exception as e:
+                self._failed_attempts += 1
+                delay = min(ACTIVITY_RETRY_DELAY * 2 ** (self._failed_attempts - 1), ACTIVITY_RETRY_MAX_DELAY)
+                self._retry_at = time.monotonic() + delay
+                logger.warning(f"Activity journal flush failed ({self._failed_attempts} in a row), "
+                               f"retrying in {delay:.1f}s: {str(e)}")
+                # Возвращаем пачку в начало очереди, сохраняя порядок
+                with self._condition:
+                    self._events.extendleft(reversed(batch))
+                return 0
+            self._failed_attempts = 0
+            self._retry_at = 0.0
+            self.written += written
+            return written
+
+    def _write(self, batch: list, isolate: bool) -> int:
+        """
+        Выполнить пачку одной транзакцией. При isolate каждое событие выполняется в своей
+        точке сохранения: событие с ошибкой (кроме блокировки базы) отбрасывается, остальные
+        записываются. Возвращает число записанных событий
+        """
+        conn = get_connection(self.db_name)
+        cursor = conn.cursor()
+        try:
+            if conn.in_transaction:
+                conn.commit()
+            cursor.execute("BEGIN")
+            dropped = 0
+            for sql, params in batch:
+                if not isolate:
+                    cursor.execute(sql, params)
+                    continue
+                cursor.execute("SAVEPOINT journal_event")
+                try:
+                    cursor.execute(sql, params)
+                except sqlite3.Error as e:
+                    if _is_lock_error(e):
+                        raise
+                    cursor.execute("ROLLBACK TO journal_event")
+                    dropped += 1
+                    logger.error(f"Dropping activity event that keeps failing: {str(e)}",
+                                 extra_info=f"SQL: {' '.join(sql.split())}, params: {params}")
+                cursor.execute("RELEASE journal_event")
+            conn.commit()
+            self.dropped += dropped
+            return len(batch) - dropped
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def pending(self) -> int:
+        return len(self._events)
+
+    def _start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ActivityJournal")
+        self._thread.start()
+
+    def stop(self):
+        """Остановить фоновый поток и записать остаток"""
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self.running:
+                    return
+                if len(self._events) < self.flush_max_events:
+                    self._condition.wait(self.flush_interval)
+                # После неудачного сброса выдерживаем паузу, даже если события продолжают поступать
+                backoff = self._retry_at - time.monotonic()
+                while self.running and backoff > 0:
+                    self._condition.wait(backoff)
+                    backoff = self._retry_at - time.monotonic()
+                if not self.running:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Activity journal error: {str(e)}")
+
+
+_journals: Dict[str, ActivityJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def get_activity_journal(db_name: str = DEFAULT_DB_NAME) -> ActivityJournal:
+    with _journals_lock:
+        journal = _journals.get(db_name)
+        if journal is None:
+            journal = _journals[db_name] = ActivityJournal(db_name)
+        return journal
+
+
+def flush_activity_journals():
+    """Записать все журналы и остановить их потоки (при завершении работы)"""
+    with _journals_lock:
+        journals = list(_journals.values())
+    for journal in journals:
+        try:
+            journal.stop()
+        except Exception as e:
+            logger.error(f"Error flushing activity journal {journal.db_name}: {str(e)}")
+
+
+atexit.register(flush_activity_journals)
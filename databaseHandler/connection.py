@@ -0,0 +1,94 @@
+"""
+Менеджер соединений SQLite
+Каждый поток получает собственное долгоживущее соединение с одинаковыми настройками:
+WAL (читатели не блокируют писателя), synchronous=NORMAL, busy_timeout, mmap и
+увеличенный кэш страниц. Все обращения к database.db идут через get_connection()
+"""
+
+import sqlite3
+import threading
+from typing import Dict
+
+from logger import logger
+
+DEFAULT_DB_NAME = "database.db"
+SQLITE_BUSY_TIMEOUT_MS = 10000  # Сколько ждать снятия блокировки записи, прежде чем вернуть "database is locked"
+SQLITE_CACHE_SIZE_KB = 16384  # Кэш страниц на соединение (КБ)
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # Размер отображения файла базы в память (байт)
+
+
+class ConnectionManager:
+    """Соединения с одной базой: по одному на поток, настроенные при открытии"""
+
+    def __init__(self, db_name: str = DEFAULT_DB_NAME):
+        self.db_name = db_name
+        self._local = threading.local()
+        self._connections: Dict[threading.Thread, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+        self._wal_enabled = False
+
+    def connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока (создается при первом обращении)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                # Соединения завершившихся потоков больше никто не использует
+                for thread in [t for t in self._connections if not t.is_alive()]:
+                    self._connections.pop(thread).close()
+                self._connections[threading.current_thread()] = conn
+        return conn
+
+    def close(self):
+        """Закрыть соединение текущего потока"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                self._connections.pop(threading.current_thread(), None)
+            conn.close()
+
+    def close_all(self):
+        """Закрыть соединения всех потоков (при завершении работы)"""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections = {}
+        for conn in connections:
+            conn.close()
+
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread=False только для close_all и закрытия соединений завершившихся потоков
+        conn = sqlite3.connect(self.db_name, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        if not self._wal_enabled:
+            # Режим журнала хранится в файле базы - достаточно включить один раз
+            mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if mode.lower() != "wal":
+                logger.warning(f"SQLite WAL mode is not available for {self.db_name}, journal mode: {mode}")
+            self._wal_enabled = True
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = {-SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_name: str = DEFAULT_DB_NAME) -> ConnectionManager:
+    with _managers_lock:
+        manager = _managers.get(db_name)
+        if manager is None:
+            manager = _managers[db_name] = ConnectionManager(db_name)
+        return manager
+
+
+def get_connection(db_name: str = DEFAULT_DB_NAME) -> sqlite3.Connection:
+    """
+    Соединение текущего потока с базой. Его нельзя закрывать после использования -
+    закрывайте только курсоры
+    """
+    return get_connection_manager(db_name).connection()
@@ -1,147 +1,54 @@
 import sqlite3
+import threading
+import time
 
 from datetime import datetime, timedelta
 
 from logger import logger
+from databaseHandler.connection import get_connection_manager
+from databaseHandler.activity_journal import get_activity_journal
+from databaseHandler.migrations import apply_migrations, rebuild_customer_stats
+from databaseHandler.rental_scheduler import rental_scheduler, rental_deadline
+from databaseHandler.lot_matcher import lot_matcher
+from databaseHandler.inventory import free_accounts
+from steamHandler.SteamGuard import invalidate_guard_code
+from steamHandler.mafile_store import mafile_store
+
+# Аккаунт можно продать: он без владельца и не ждет смены пароля
+# (задача в состоянии 'failed' тоже держит аккаунт снятым с продажи до ручного повтора)
+FREE_ACCOUNT_CONDITION = (
+    "(owner IS NULL AND ID NOT IN (SELECT account_id FROM rotation_jobs WHERE state != 'done'))"
+)
+
+# Сколько секунд COUNT(*) отдается из кэша. Запись в этом процессе сбрасывает кэш сразу,
+# изменения из других процессов (account_manager.py) видны не позже чем через TTL
+ROW_COUNT_CACHE_TTL = 30
+_row_counts = {}
+_row_counts_lock = threading.Lock()
+
+CUSTOMER_STATS_COLUMNS = (
+    "customer_username, total_purchases, total_rental_hours, total_accesses, "
+    "total_extensions, total_extension_hours, rating_sum, rating_count"
+)
 
 
 class SQLiteDB:
     def __init__(self, db_name="database.db"):
         self.db_name = db_name
-        # Open a persistent connection to the database
-        self.conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        # Each thread gets its own pooled connection (see databaseHandler.connection)
+        self._connections = get_connection_manager(db_name)
+        # Analytics writes (customer_activity, user activity) are batched in the background
+        self._journal = get_activity_journal(db_name)
         self.create_table()
 
-    def create_table(self):
-        """Create the 'accounts' table if it does not exist."""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS accounts (
-                ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                account_name TEXT NOT NULL UNIQUE,
-                path_to_maFile TEXT NOT NULL,
-                login TEXT NOT NULL,
-                password TEXT NOT NULL,
-                rental_duration INTEGER NOT NULL,
-                owner TEXT DEFAULT NULL,
-                rental_start TIMESTAMP DEFAULT NULL,
-                access_count INTEGER DEFAULT 0,
-                max_access_count INTEGER DEFAULT 3,
-                last_access TIMESTAMP DEFAULT NULL
-            )
-            """
-        )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS authorized_users (
-                user_id INTEGER PRIMARY KEY,
-                authorized_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-        )
-        
-        # Таблица для отслеживания покупателей
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS customer_activity (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_username TEXT NOT NULL,
-                account_id INTEGER,
-                account_name TEXT,
-                purchase_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                rental_duration INTEGER,
-                access_count INTEGER DEFAULT 0,
-                max_access_count INTEGER DEFAULT 3,
-                last_access_time TIMESTAMP DEFAULT NULL,
-                feedback_rating INTEGER DEFAULT NULL,
-                feedback_text TEXT DEFAULT NULL,
-                feedback_time TIMESTAMP DEFAULT NULL,
-                rental_extended_count INTEGER DEFAULT 0,
-                total_extension_hours INTEGER DEFAULT 0,
-                is_active BOOLEAN DEFAULT TRUE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-        )
-        
-        # Миграция для обновления таблицы authorized_users
-        self._migrate_authorized_users_table(cursor)
-        
-        # Миграция для обновления таблицы accounts
-        self._migrate_accounts_table(cursor)
-        
-        # Создаем таблицы для системы платежей
-        self._create_payment_tables(cursor)
-        
-        self.conn.commit()
-        cursor.close()
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The calling thread's connection to the database."""
+        return self._connections.connection()
 
-    def _migrate_authorized_users_table(self, cursor):
-        """Миграция таблицы authorized_users для добавления новых полей."""
-        try:
-            # Проверяем, есть ли уже новые поля
-            cursor.execute("PRAGMA table_info(authorized_users)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            # Добавляем новые поля, если их нет
-            if 'username' not in columns:
-                cursor.execute("ALTER TABLE authorized_users ADD COLUMN username TEXT")
-            if 'first_name' not in columns:
-                cursor.execute("ALTER TABLE authorized_users ADD COLUMN first_name TEXT")
-            if 'last_name' not in columns:
-                cursor.execute("ALTER TABLE authorized_users ADD COLUMN last_name TEXT")
-            if 'last_activity' not in columns:
-                cursor.execute("ALTER TABLE authorized_users ADD COLUMN last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-            if 'is_active' not in columns:
-                cursor.execute("ALTER TABLE authorized_users ADD COLUMN is_active BOOLEAN DEFAULT 1")
-            if 'permissions' not in columns:
-                cursor.execute("ALTER TABLE authorized_users ADD COLUMN permissions TEXT DEFAULT 'user'")
-            
-            # Обновляем существующие записи
-            cursor.execute("UPDATE authorized_users SET last_activity = authorized_at WHERE last_activity IS NULL")
-            cursor.execute("UPDATE authorized_users SET is_active = 1 WHERE is_active IS NULL")
-            cursor.execute("UPDATE authorized_users SET permissions = 'user' WHERE permissions IS NULL")
-            
-            logger.info("Migration completed successfully")
-        except Exception as e:
-            logger.error(f"Migration error: {str(e)}")
-            # Если миграция не удалась, пересоздаем таблицу
-            cursor.execute("DROP TABLE IF EXISTS authorized_users")
-            cursor.execute(
-                """
-                CREATE TABLE authorized_users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    authorized_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1,
-                    permissions TEXT DEFAULT 'user'
-                )
-                """
-            )
-
-    def _migrate_accounts_table(self, cursor):
-        """Миграция таблицы accounts для добавления полей ограничения доступа."""
-        try:
-            # Проверяем, есть ли уже новые поля
-            cursor.execute("PRAGMA table_info(accounts)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            # Добавляем новые поля, если их нет
-            if 'access_count' not in columns:
-                cursor.execute("ALTER TABLE accounts ADD COLUMN access_count INTEGER DEFAULT 0")
-            if 'max_access_count' not in columns:
-                cursor.execute("ALTER TABLE accounts ADD COLUMN max_access_count INTEGER DEFAULT 3")
-            if 'last_access' not in columns:
-                cursor.execute("ALTER TABLE accounts ADD COLUMN last_access TIMESTAMP DEFAULT NULL")
-            
-            logger.info("Accounts table migration completed successfully")
-        except Exception as e:
-            logger.error(f"Accounts table migration error: {str(e)}")
+    def create_table(self):
+        """Bring the schema up to date by applying pending migrations (see databaseHandler.migrations)."""
+        apply_migrations(self.conn)
 
     def add_account(
         self, account_name, path_to_maFile, login, password, duration, owner=None
@@ -163,10 +70,14 @@ class SQLiteDB:
                 (account_name, path_to_maFile, login, password, duration, owner),
             )
             self.conn.commit()
+            self._invalidate_row_count("accounts")
+            lot_matcher.add(account_name)
+            self._sync_free_accounts(cursor, [cursor.lastrowid])
             logger.info(f"Account '{account_name}' added successfully")
             return True
         except Exception as e:
             logger.error(f"Error adding account: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -189,6 +100,10 @@ class SQLiteDB:
             # Удаляем аккаунт
             cursor.execute("DELETE FROM accounts WHERE ID = ?", (account_id,))
             self.conn.commit()
+            self._invalidate_row_count("accounts")
+            rental_scheduler.cancel(account_id)
+            lot_matcher.remove(account_name)
+            free_accounts.remove(account_id)
             
             # Пытаемся удалить .maFile файл
             try:
@@ -204,6 +119,7 @@ class SQLiteDB:
             
         except Exception as e:
             logger.error(f"Error deleting account {account_id}: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -230,6 +146,10 @@ class SQLiteDB:
             )
             self.conn.commit()
             
+            # Коды старого файла больше не действительны
+            invalidate_guard_code(old_mafile_path)
+            invalidate_guard_code(new_mafile_path)
+            
             # Удаляем старый .maFile если он существует и отличается от нового
             try:
                 import os
@@ -244,6 +164,7 @@ class SQLiteDB:
             
         except Exception as e:
             logger.error(f"Error updating .maFile for account {account_id}: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -255,9 +176,11 @@ class SQLiteDB:
             
             # Проверяем существование аккаунта
             cursor.execute("SELECT account_name FROM accounts WHERE ID = ?", (account_id,))
-            if not cursor.fetchone():
+            row = cursor.fetchone()
+            if not row:
                 logger.warning(f"Account with ID {account_id} not found")
                 return False
+            old_account_name = row[0]
             
             # Строим запрос обновления
             updates = []
@@ -290,12 +213,18 @@ class SQLiteDB:
                 params
             )
             self.conn.commit()
+            if duration is not None:
+                self._reschedule_rental(cursor, account_id)
+            if account_name is not None and account_name != old_account_name:
+                lot_matcher.rename(old_account_name, account_name)
+                self._sync_free_accounts(cursor, [account_id])
             
             logger.info(f"Updated account {account_id} with fields: {', '.join(updates)}")
             return True
             
         except Exception as e:
             logger.error(f"Error updating account {account_id}: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -333,43 +262,8 @@ class SQLiteDB:
             return None
 
     def validate_mafile(self, mafile_path):
-        """Validate .maFile format and content."""
-        try:
-            import json
-            import os
-            
-            if not os.path.exists(mafile_path):
-                return {"valid": False, "error": "File not found"}
-            
-            with open(mafile_path, "r", encoding='utf-8') as f:
-                data = json.load(f)
-            
-            required_fields = ["account_name", "shared_secret", "identity_secret", "device_id", "Session"]
-            missing_fields = []
-            
-            for field in required_fields:
-                if field not in data:
-                    missing_fields.append(field)
-            
-            if missing_fields:
-                return {"valid": False, "error": f"Missing fields: {', '.join(missing_fields)}"}
-            
-            if "SteamID" not in data["Session"]:
-                return {"valid": False, "error": "Missing SteamID in Session"}
-            
-            # Проверяем формат shared_secret (должен быть base64)
-            try:
-                import base64
-                base64.b64decode(data["shared_secret"])
-            except Exception:
-                return {"valid": False, "error": "Invalid shared_secret format (not base64)"}
-            
-            return {"valid": True, "data": data}
-            
-        except json.JSONDecodeError:
-            return {"valid": False, "error": "Invalid JSON format"}
-        except Exception as e:
-            return {"valid": False, "error": str(e)}
+        """Validate .maFile format and content (parsed once and cached by MaFileStore)."""
+        return mafile_store.validate(mafile_path)
 
     def can_access_account(self, account_id, username):
         """Проверить, может ли пользователь получить доступ к аккаунту."""
@@ -444,6 +338,7 @@ class SQLiteDB:
                 
         except Exception as e:
             logger.error(f"Error incrementing access count: {str(e)}")
+            self.conn.rollback()
             return {"success": False, "error": str(e)}
         finally:
             cursor.close()
@@ -461,6 +356,7 @@ class SQLiteDB:
             return True
         except Exception as e:
             logger.error(f"Error resetting access count: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -501,10 +397,10 @@ class SQLiteDB:
         """Retrieve all accounts with no owner assigned."""
         cursor = self.conn.cursor()
         cursor.execute(
-            """
+            f"""
             SELECT ID, account_name, path_to_maFile, login, password, rental_duration
             FROM accounts 
-            WHERE owner IS NULL
+            WHERE {FREE_ACCOUNT_CONDITION}
             """
         )
         rows = cursor.fetchall()
@@ -540,6 +436,11 @@ class SQLiteDB:
                 (owner_id, account_id),
             )
             if cursor.rowcount == 0:
+                # Аккаунт уже занят. UPDATE уже открыл транзакцию - без rollback соединение
+                # этого потока держало бы блокировку записи до своего следующего commit
+                self.conn.rollback()
+                # Индекс свободных мог устареть
+                self._sync_free_accounts(cursor, [account_id])
                 return False
             # Get the login of the updated account
             cursor.execute(
@@ -551,8 +452,14 @@ class SQLiteDB:
                 (account_id,),
             )
             login_row = cursor.fetchone()
+            changed_ids = [account_id]
             if login_row:
                 login = login_row[0]
+                cursor.execute(
+                    "SELECT ID FROM accounts WHERE login = ? AND owner IS NULL",
+                    (login,),
+                )
+                changed_ids += [row[0] for row in cursor.fetchall()]
                 # Mark all accounts with the same login as 'OTHER_ACCOUNT'
                 cursor.execute(
                     """
@@ -563,13 +470,122 @@ class SQLiteDB:
                     (login,),
                 )
             self.conn.commit()
+            self._reschedule_rental(cursor, account_id)
+            self._sync_free_accounts(cursor, changed_ids)
             return True
         except Exception as e:
             logger.error(f"Error setting account owner: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
 
+    def reserve_accounts(self, lot_name: str, count: int, buyer: str) -> list:
+        """
+        Atomically assign `count` free accounts of a lot to a buyer.
+        Runs in one BEGIN IMMEDIATE transaction: the accounts get the owner and rental start,
+        accounts sharing their logins are marked 'OTHER_ACCOUNT'. Returns the reserved
+        accounts as dicts, or an empty list (and changes nothing) if there are not enough.
+        """
+        candidates = free_accounts.take(lot_name, count) or []
+        if self.conn.in_transaction:
+            # Незавершенная запись этого потока: BEGIN IMMEDIATE упал бы, а rollback в обработчике
+            # ошибки молча отменил бы чужие изменения. Фиксируем их, как фиксировал бы следующий commit
+            logger.warning(f"Committing a pending transaction before reserving accounts of '{lot_name}'")
+            self.conn.commit()
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            reserved = self._assign_owner(
+                cursor, buyer,
+                f"ID IN ({','.join('?' * len(candidates))}) AND {FREE_ACCOUNT_CONDITION}",
+                candidates,
+            ) if candidates else []
+            if len(reserved) < count:
+                # Индекс устарел - добираем недостающие аккаунты запросом по названию лота
+                taken = [row[0] for row in reserved]
+                reserved += self._assign_owner(
+                    cursor, buyer,
+                    f"""ID IN (
+                        SELECT ID FROM accounts
+                        WHERE account_name = ? AND {FREE_ACCOUNT_CONDITION}
+                        AND ID NOT IN ({','.join('?' * len(taken))})
+                        ORDER BY ID LIMIT ?
+                    )""",
+                    [lot_name, *taken, count - len(taken)],
+                )
+            if len(reserved) < count:
+                self.conn.rollback()
+                self._sync_free_accounts(cursor, candidates)
+                return []
+
+            # Mark all accounts with the same logins as 'OTHER_ACCOUNT'
+            logins = list({row[3] for row in reserved})
+            cursor.execute(
+                f"""
+                SELECT ID FROM accounts
+                WHERE login IN ({','.join('?' * len(logins))}) AND owner IS NULL
+                """,
+                logins,
+            )
+            sibling_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(
+                f"""
+                UPDATE accounts
+                SET owner = 'OTHER_ACCOUNT'
+                WHERE login IN ({','.join('?' * len(logins))}) AND owner IS NULL
+                """,
+                logins,
+            )
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"Error reserving {count} accounts of '{lot_name}' for {buyer}: {str(e)}")
+            self.conn.rollback()
+            self._sync_free_accounts(cursor, candidates)
+            cursor.close()
+            return []
+
+        try:
+            for row in reserved:
+                self._reschedule_rental(cursor, row[0])
+            self._sync_free_accounts(cursor, candidates + [row[0] for row in reserved] + sibling_ids)
+        finally:
+            cursor.close()
+        return [
+            {
+                "id": row[0],
+                "account_name": row[1],
+                "path_to_maFile": row[2],
+                "login": row[3],
+                "password": row[4],
+                "rental_duration": row[5],
+            }
+            for row in reserved
+        ]
+
+    def _assign_owner(self, cursor, owner: str, condition: str, params: list) -> list:
+        """Set the owner and rental start of the accounts matching `condition` and return their rows."""
+        columns = "ID, account_name, path_to_maFile, login, password, rental_duration"
+        assignment = (
+            "owner = ?, rental_start = DATETIME(CURRENT_TIMESTAMP, '+3 hours', '+10 minutes'), "
+            "access_count = 0, last_access = NULL"
+        )
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            cursor.execute(
+                f"UPDATE accounts SET {assignment} WHERE {condition} RETURNING {columns}",
+                [owner, *params],
+            )
+            return sorted(cursor.fetchall())
+        # SQLite без RETURNING: транзакция уже держит блокировку записи, SELECT + UPDATE атомарны
+        cursor.execute(f"SELECT {columns} FROM accounts WHERE {condition} ORDER BY ID", params)
+        rows = cursor.fetchall()
+        if rows:
+            cursor.execute(
+                f"UPDATE accounts SET {assignment} WHERE ID IN ({','.join('?' * len(rows))})",
+                [owner, *(row[0] for row in rows)],
+            )
+        return rows
+
     def get_active_owners(self):
         """Retrieve all unique owner IDs where owner is not NULL."""
         cursor = self.conn.cursor()
@@ -627,6 +643,7 @@ class SQLiteDB:
             return success
         except Exception as e:
             logger.error(f"Error updating password: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -697,6 +714,8 @@ class SQLiteDB:
                 logger.error(f"No account found with ID {account_id}.")
                 return False
             login = result[0]
+            cursor.execute("SELECT ID, account_name FROM accounts WHERE login = ?", (login,))
+            deleted = cursor.fetchall()
             cursor.execute(
                 """
                 DELETE FROM accounts
@@ -706,26 +725,116 @@ class SQLiteDB:
             )
             success = cursor.rowcount > 0
             self.conn.commit()
+            self._invalidate_row_count("accounts")
+            for deleted_id, account_name in deleted:
+                rental_scheduler.cancel(deleted_id)
+                lot_matcher.remove(account_name)
+                free_accounts.remove(deleted_id)
             return success
         except Exception as e:
             logger.error(f"Error deleting accounts: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
 
     def get_total_accounts(self):
         """Retrieve the total number of accounts."""
+        return self.count_rows("accounts")
+
+    def count_rows(self, table: str) -> int:
+        """Row count of a table, served from a cache shared by all SQLiteDB instances of this database."""
+        key = (self.db_name, table)
+        with _row_counts_lock:
+            cached = _row_counts.get(key)
+        if cached and time.monotonic() - cached[1] < ROW_COUNT_CACHE_TTL:
+            return cached[0]
         try:
             cursor = self.conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM accounts")
-            total_accounts = cursor.fetchone()[0]
-            return total_accounts
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            count = cursor.fetchone()[0]
+            with _row_counts_lock:
+                _row_counts[key] = (count, time.monotonic())
+            return count
         except Exception as e:
-            logger.error(f"Error retrieving total accounts: {str(e)}")
+            logger.error(f"Error counting rows of {table}: {str(e)}")
             return 0
         finally:
             cursor.close()
 
+    def _invalidate_row_count(self, table: str):
+        with _row_counts_lock:
+            _row_counts.pop((self.db_name, table), None)
+
+    def _keyset_page(self, table: str, columns: str, key_columns: tuple, descending: bool,
+                     after=None, before=None, limit: int = 10):
+        """
+        Fetch one page ordered by key_columns without OFFSET (keyset pagination).
+        The last key column must be unique; after/before is its value for the last/first row
+        of the page currently shown. Returns (rows, has_prev, has_next).
+        """
+        keys = ", ".join(key_columns)
+        forward = before is None
+        anchor = after if forward else before
+        # Обход индекса вперед или назад относительно порядка вывода
+        ascending = forward != descending
+        direction = "ASC" if ascending else "DESC"
+
+        query = f"SELECT {columns} FROM {table}"
+        params = []
+        if anchor is not None:
+            query += (
+                f" WHERE ({keys}) {'>' if ascending else '<'} "
+                f"(SELECT {keys} FROM {table} WHERE {key_columns[-1]} = ?)"
+            )
+            params.append(anchor)
+        query += " ORDER BY " + ", ".join(f"{column} {direction}" for column in key_columns) + " LIMIT ?"
+        params.append(limit + 1)
+
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if forward:
+            return rows, anchor is not None, more
+        rows.reverse()
+        return rows, more, True
+
+    def get_accounts_page(self, after_id: int = None, before_id: int = None, limit: int = 10) -> dict:
+        """
+        Retrieve one page of accounts ordered by ID.
+        Pass after_id (last ID shown) for the next page or before_id (first ID shown) for the previous one.
+        Returns {"items": [...], "has_prev": bool, "has_next": bool, "total": int}.
+        """
+        try:
+            rows, has_prev, has_next = self._keyset_page(
+                "accounts",
+                "ID, account_name, path_to_maFile, login, password, rental_duration, owner",
+                ("ID",), False, after_id, before_id, limit
+            )
+            items = [
+                {
+                    "id": row[0],
+                    "account_name": row[1],
+                    "path_to_maFile": row[2],
+                    "login": row[3],
+                    "password": row[4],
+                    "rental_duration": row[5],
+                    "owner": row[6],
+                }
+                for row in rows
+            ]
+            return {"items": items, "has_prev": has_prev, "has_next": has_next,
+                    "total": self.count_rows("accounts")}
+        except Exception as e:
+            logger.error(f"Error retrieving accounts page: {str(e)}")
+            return {"items": [], "has_prev": False, "has_next": False, "total": 0}
+
     def get_all_account_names(self) -> list:
         """Retrieve all distinct account names."""
         try:
@@ -743,7 +852,12 @@ class SQLiteDB:
         """Retrieve account names for accounts with no owner."""
         try:
             cursor = self.conn.cursor()
-            cursor.execute("SELECT account_name FROM accounts WHERE owner IS NULL")
+            cursor.execute(
+                f"""
+                SELECT account_name FROM accounts
+                WHERE {FREE_ACCOUNT_CONDITION}
+                """
+            )
             unowned_account_names = [row[0] for row in cursor.fetchall()]
             return unowned_account_names
         except Exception as e:
@@ -956,9 +1070,12 @@ class SQLiteDB:
                     )
 
             self.conn.commit()
+            for account_id, _ in accounts:
+                self._reschedule_rental(cursor, account_id)
             return True
         except Exception as e:
             logger.error(f"Error adding hours for owner {owner}: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -1088,9 +1205,337 @@ class SQLiteDB:
         finally:
             cursor.close()
 
+    def get_rental_deadlines(self) -> list:
+        """Retrieve (ID, rental_start, rental_duration) of all active rentals."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                SELECT ID, rental_start, rental_duration
+                FROM accounts
+                WHERE owner IS NOT NULL AND rental_start IS NOT NULL
+                """
+            )
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error retrieving rental deadlines: {str(e)}")
+            return []
+        finally:
+            cursor.close()
+
+    def stop_rentals_by_login(self, account_id: int):
+        """
+        Stop the rentals of all accounts sharing the login of the given account.
+        Returns (login, number of released accounts) or (None, 0) if the account does not exist.
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT login FROM accounts WHERE ID = ?", (account_id,))
+            result = cursor.fetchone()
+            if not result:
+                return None, 0
+            login = result[0]
+            cursor.execute(
+                "SELECT ID FROM accounts WHERE login = ? AND owner IS NOT NULL",
+                (login,),
+            )
+            released_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(
+                """
+                UPDATE accounts
+                SET owner = NULL, rental_start = NULL
+                WHERE login = ?
+                """,
+                (login,),
+            )
+            self.conn.commit()
+            for released_id in released_ids:
+                rental_scheduler.cancel(released_id)
+            self._sync_free_accounts(cursor, released_ids)
+            return login, len(released_ids)
+        except Exception as e:
+            logger.error(f"Error stopping rentals for account {account_id}: {str(e)}")
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def expire_rental(self, account_id: int) -> bool:
+        """
+        Release an expired rental and enqueue a password rotation in one transaction.
+        The account is not offered for sale until the rotation job is done.
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO rotation_jobs (account_id, owner, next_attempt_at)
+                SELECT ID, owner, ? FROM accounts WHERE ID = ?
+                """,
+                (time.time(), account_id),
+            )
+            cursor.execute(
+                "UPDATE accounts SET owner = NULL, rental_start = NULL WHERE ID = ?",
+                (account_id,),
+            )
+            self.conn.commit()
+            rental_scheduler.cancel(account_id)
+            self._sync_free_accounts(cursor, [account_id])
+            return True
+        except Exception as e:
+            logger.error(f"Error expiring rental for account {account_id}: {str(e)}")
+            self.conn.rollback()
+            return False
+        finally:
+            cursor.close()
+
+    def claim_rotation_jobs(self, limit: int, generate_password) -> list:
+        """
+        Mark up to `limit` due pending rotation jobs as running and return them.
+        The new password of a job (`generate_password()`) is committed here, before Steam is called,
+        and stays the same across attempts: after a crash it is known which password the
+        interrupted attempt may have applied.
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                SELECT j.id, j.account_id, j.attempts, a.path_to_maFile, a.password, j.new_password
+                FROM rotation_jobs j
+                JOIN accounts a ON a.ID = j.account_id
+                WHERE j.state = 'pending' AND j.next_attempt_at <= ?
+                ORDER BY j.next_attempt_at
+                LIMIT ?
+                """,
+                (time.time(), limit),
+            )
+            # row[6]: пароль сохранен прошлой попыткой и мог уже примениться в Steam
+            rows = [row[:5] + (row[5] or generate_password(), row[5] is not None) for row in cursor.fetchall()]
+            cursor.executemany(
+                """
+                UPDATE rotation_jobs
+                SET state = 'running', attempts = attempts + 1, new_password = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """,
+                [(row[5], row[0]) for row in rows],
+            )
+            # Задачи удаленных аккаунтов выполнять не нужно
+            cursor.execute(
+                """
+                UPDATE rotation_jobs SET state = 'done', updated_at = CURRENT_TIMESTAMP
+                WHERE state = 'pending' AND account_id NOT IN (SELECT ID FROM accounts)
+                """
+            )
+            self.conn.commit()
+            return [
+                {
+                    "job_id": row[0],
+                    "account_id": row[1],
+                    "attempts": row[2] + 1,
+                    "path_to_maFile": row[3],
+                    "password": row[4],
+                    "new_password": row[5],
+                    "password_saved": row[6],
+                }
+                for row in rows
+            ]
+        except Exception as e:
+            logger.error(f"Error claiming rotation jobs: {str(e)}")
+            self.conn.rollback()
+            return []
+        finally:
+            cursor.close()
+
+    def complete_rotation_jobs(self, results: list, retry_delay: float = 60, max_retry_delay: float = 3600,
+                               max_attempts: int = 10) -> bool:
+        """
+        Store the outcome of claimed rotation jobs in one transaction.
+        results: [(job_id, account_id, attempts, new_password or None, error or None), ...]
+        Failed jobs go back to pending with an exponential backoff; after `max_attempts`
+        they stay in the terminal 'failed' state (the account is kept off sale).
+        """
+        try:
+            cursor = self.conn.cursor()
+            now = time.time()
+            for job_id, account_id, attempts, new_password, error in results:
+                if new_password:
+                    # Пароль общий для всех лотов с этим логином
+                    cursor.execute(
+                        """
+                        UPDATE accounts SET password = ?
+                        WHERE login = (SELECT login FROM accounts WHERE ID = ?)
+                        """,
+                        (new_password, account_id),
+                    )
+                    cursor.execute(
+                        """
+                        UPDATE rotation_jobs
+                        SET state = 'done', last_error = NULL, new_password = NULL,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                        """,
+                        (job_id,),
+                    )
+                elif attempts >= max_attempts:
+                    cursor.execute(
+                        """
+                        UPDATE rotation_jobs
+                        SET state = 'failed', last_error = ?, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                        """,
+                        (error, job_id),
+                    )
+                else:
+                    delay = min(max_retry_delay, retry_delay * 2 ** (attempts - 1))
+                    cursor.execute(
+                        """
+                        UPDATE rotation_jobs
+                        SET state = 'pending', next_attempt_at = ?, last_error = ?,
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                        """,
+                        (now + delay, error, job_id),
+                    )
+            self.conn.commit()
+            self._sync_free_accounts(cursor, [result[1] for result in results if result[3]])
+            return True
+        except Exception as e:
+            logger.error(f"Error completing rotation jobs: {str(e)}")
+            self.conn.rollback()
+            return False
+        finally:
+            cursor.close()
+
+    def reset_running_rotation_jobs(self) -> int:
+        """Return jobs left running by a previous process back to pending."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                UPDATE rotation_jobs SET state = 'pending', updated_at = CURRENT_TIMESTAMP
+                WHERE state = 'running'
+                """
+            )
+            count = cursor.rowcount
+            self.conn.commit()
+            return count
+        except Exception as e:
+            logger.error(f"Error resetting running rotation jobs: {str(e)}")
+            self.conn.rollback()
+            return 0
+        finally:
+            cursor.close()
+
+    def get_failed_rotation_jobs(self) -> list:
+        """Retrieve rotation jobs that ran out of attempts, newest first."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                SELECT j.id, j.account_id, a.account_name, a.login, j.owner, j.attempts,
+                       j.last_error, j.updated_at, j.new_password
+                FROM rotation_jobs j
+                LEFT JOIN accounts a ON a.ID = j.account_id
+                WHERE j.state = 'failed'
+                ORDER BY j.updated_at DESC
+                """
+            )
+            return [
+                {
+                    "job_id": row[0],
+                    "account_id": row[1],
+                    "account_name": row[2],
+                    "login": row[3],
+                    "owner": row[4],
+                    "attempts": row[5],
+                    "last_error": row[6],
+                    "updated_at": row[7],
+                    "new_password": row[8],
+                }
+                for row in cursor.fetchall()
+            ]
+        except Exception as e:
+            logger.error(f"Error getting failed rotation jobs: {str(e)}")
+            return []
+        finally:
+            cursor.close()
+
+    def retry_failed_rotation_jobs(self, job_id: int = None) -> int:
+        """Return a failed rotation job (or all of them) to pending with a fresh attempt counter."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                UPDATE rotation_jobs
+                SET state = 'pending', attempts = 0, next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE state = 'failed' AND (? IS NULL OR id = ?)
+                """,
+                (time.time(), job_id, job_id),
+            )
+            count = cursor.rowcount
+            self.conn.commit()
+            return count
+        except Exception as e:
+            logger.error(f"Error retrying failed rotation jobs: {str(e)}")
+            self.conn.rollback()
+            return 0
+        finally:
+            cursor.close()
+
+    def get_rotation_jobs_summary(self) -> dict:
+        """Count rotation jobs by state."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT state, COUNT(*) FROM rotation_jobs GROUP BY state")
+            return dict(cursor.fetchall())
+        except Exception as e:
+            logger.error(f"Error getting rotation jobs summary: {str(e)}")
+            return {}
+        finally:
+            cursor.close()
+
+    def load_free_accounts(self):
+        """Fill the in-memory free account index from the database."""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(f"SELECT ID, account_name, {FREE_ACCOUNT_CONDITION} FROM accounts ORDER BY ID")
+            free_accounts.load(cursor.fetchall())
+        except Exception as e:
+            logger.error(f"Error loading free account index: {str(e)}")
+        finally:
+            cursor.close()
+
+    def _sync_free_accounts(self, cursor, account_ids: list):
+        """Push the committed state of the given accounts to the free account index."""
+        if not account_ids:
+            return
+        placeholders = ",".join("?" * len(account_ids))
+        cursor.execute(
+            f"SELECT ID, account_name, {FREE_ACCOUNT_CONDITION} FROM accounts WHERE ID IN ({placeholders})",
+            list(account_ids),
+        )
+        rows = cursor.fetchall()
+        free_accounts.update(rows)
+        # Аккаунты, которых больше нет в базе
+        for account_id in set(account_ids) - {row[0] for row in rows}:
+            free_accounts.remove(account_id)
+
+    def _reschedule_rental(self, cursor, account_id: int):
+        """Push the current rental deadline of an account to the expiry scheduler."""
+        cursor.execute(
+            "SELECT owner, rental_start, rental_duration FROM accounts WHERE ID = ?",
+            (account_id,),
+        )
+        row = cursor.fetchone()
+        if row and row[0] is not None and row[1] is not None:
+            rental_scheduler.schedule(account_id, rental_deadline(row[1], row[2]))
+        else:
+            rental_scheduler.cancel(account_id)
+
     def close(self):
-        """Close the persistent database connection."""
-        self.conn.close()
+        """Close the calling thread's database connection."""
+        self._connections.close()
 
     def add_authorized_user(self, user_id: int, username: str = None, first_name: str = None, 
                            last_name: str = None, permissions: str = 'user') -> bool:
@@ -1106,10 +1551,12 @@ class SQLiteDB:
                 (user_id, username, first_name, last_name, permissions),
             )
             self.conn.commit()
+            self._invalidate_row_count("authorized_users")
             logger.info(f"User {user_id} ({username or 'Unknown'}) added to authorized users")
             return True
         except Exception as e:
             logger.error(f"Error adding authorized user: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -1146,21 +1593,19 @@ class SQLiteDB:
     def update_user_activity(self, user_id: int) -> bool:
         """Update user's last activity timestamp."""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
+            self._journal.record(
                 "UPDATE authorized_users SET last_activity = CURRENT_TIMESTAMP WHERE user_id = ?",
                 (user_id,)
             )
-            self.conn.commit()
             return True
         except Exception as e:
             logger.error(f"Error updating user activity: {str(e)}")
             return False
-        finally:
-            cursor.close()
 
     def get_user_info(self, user_id: int) -> dict:
         """Get detailed user information."""
+        # Сначала дописываем отложенные события, чтобы видеть собственные записи
+        self._journal.flush()
         try:
             cursor = self.conn.cursor()
             cursor.execute(
@@ -1192,6 +1637,8 @@ class SQLiteDB:
 
     def get_all_users_info(self) -> list:
         """Get information about all users."""
+        # Сначала дописываем отложенные события, чтобы видеть собственные записи
+        self._journal.flush()
         try:
             cursor = self.conn.cursor()
             cursor.execute(
@@ -1221,6 +1668,37 @@ class SQLiteDB:
         finally:
             cursor.close()
 
+    def get_users_page(self, after_user_id: int = None, before_user_id: int = None, limit: int = 10) -> dict:
+        """
+        Get one page of users, newest authorizations first (same order as get_all_users_info).
+        Returns {"items": [...], "has_prev": bool, "has_next": bool, "total": int}.
+        """
+        self._journal.flush()
+        try:
+            rows, has_prev, has_next = self._keyset_page(
+                "authorized_users",
+                "user_id, username, first_name, last_name, authorized_at, last_activity, is_active, permissions",
+                ("authorized_at", "user_id"), True, after_user_id, before_user_id, limit
+            )
+            items = [
+                {
+                    "user_id": row[0],
+                    "username": row[1],
+                    "first_name": row[2],
+                    "last_name": row[3],
+                    "authorized_at": row[4],
+                    "last_activity": row[5],
+                    "is_active": bool(row[6]),
+                    "permissions": row[7]
+                }
+                for row in rows
+            ]
+            return {"items": items, "has_prev": has_prev, "has_next": has_next,
+                    "total": self.count_rows("authorized_users")}
+        except Exception as e:
+            logger.error(f"Error getting users page: {str(e)}")
+            return {"items": [], "has_prev": False, "has_next": False, "total": 0}
+
     def deactivate_user(self, user_id: int) -> bool:
         """Deactivate a user (soft delete)."""
         try:
@@ -1233,6 +1711,7 @@ class SQLiteDB:
             return cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Error deactivating user: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -1249,6 +1728,7 @@ class SQLiteDB:
             return cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Error activating user: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -1265,6 +1745,7 @@ class SQLiteDB:
             return cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Error updating user permissions: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -1294,11 +1775,13 @@ class SQLiteDB:
             self.conn.commit()
             
             if success:
+                self._reschedule_rental(cursor, account_id)
                 logger.info(f"Rental extended for account {account_id} by {additional_hours} hours")
             
             return success
         except Exception as e:
             logger.error(f"Error extending rental duration: {str(e)}")
+            self.conn.rollback()
             return False
         finally:
             cursor.close()
@@ -1363,8 +1846,7 @@ class SQLiteDB:
             bool: True если успешно, False иначе
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
+            self._journal.record(
                 """
                 INSERT INTO customer_activity 
                 (customer_username, account_id, account_name, rental_duration, purchase_time)
@@ -1372,7 +1854,6 @@ class SQLiteDB:
                 """,
                 (customer_username, account_id, account_name, rental_duration)
             )
-            self.conn.commit()
             
             logger.info(f"Customer purchase logged: {customer_username} -> {account_name} (ID: {account_id})")
             return True
@@ -1380,8 +1861,6 @@ class SQLiteDB:
         except Exception as e:
             logger.error(f"Error logging customer purchase: {str(e)}")
             return False
-        finally:
-            cursor.close()
     
     def log_customer_access(self, customer_username: str, account_id: int) -> bool:
         """
@@ -1395,8 +1874,7 @@ class SQLiteDB:
             bool: True если успешно, False иначе
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
+            self._journal.record(
                 """
                 UPDATE customer_activity 
                 SET access_count = access_count + 1, 
@@ -1406,7 +1884,6 @@ class SQLiteDB:
                 """,
                 (customer_username, account_id)
             )
-            self.conn.commit()
             
             logger.info(f"Customer access logged: {customer_username} -> account {account_id}")
             return True
@@ -1414,8 +1891,6 @@ class SQLiteDB:
         except Exception as e:
             logger.error(f"Error logging customer access: {str(e)}")
             return False
-        finally:
-            cursor.close()
     
     def log_customer_feedback(self, customer_username: str, account_id: int, rating: int, feedback_text: str) -> bool:
         """
@@ -1431,8 +1906,7 @@ class SQLiteDB:
             bool: True если успешно, False иначе
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
+            self._journal.record(
                 """
                 UPDATE customer_activity 
                 SET feedback_rating = ?, 
@@ -1443,7 +1917,6 @@ class SQLiteDB:
                 """,
                 (rating, feedback_text, customer_username, account_id)
             )
-            self.conn.commit()
             
             logger.info(f"Customer feedback logged: {customer_username} -> {rating}/5 for account {account_id}")
             return True
@@ -1451,8 +1924,6 @@ class SQLiteDB:
         except Exception as e:
             logger.error(f"Error logging customer feedback: {str(e)}")
             return False
-        finally:
-            cursor.close()
     
     def log_rental_extension(self, customer_username: str, account_id: int, extension_hours: int) -> bool:
         """
@@ -1467,8 +1938,7 @@ class SQLiteDB:
             bool: True если успешно, False иначе
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
+            self._journal.record(
                 """
                 UPDATE customer_activity 
                 SET rental_extended_count = rental_extended_count + 1,
@@ -1478,7 +1948,6 @@ class SQLiteDB:
                 """,
                 (extension_hours, customer_username, account_id)
             )
-            self.conn.commit()
             
             logger.info(f"Rental extension logged: {customer_username} -> +{extension_hours}h for account {account_id}")
             return True
@@ -1486,57 +1955,47 @@ class SQLiteDB:
         except Exception as e:
             logger.error(f"Error logging rental extension: {str(e)}")
             return False
-        finally:
-            cursor.close()
     
-    def get_customer_activity(self, customer_username: str = None, account_id: int = None) -> list:
+    def get_customer_activity(self, customer_username: str = None, account_id: int = None, limit: int = None) -> list:
         """
         Получить активность покупателей
         
         Args:
             customer_username (str, optional): Фильтр по имени пользователя
             account_id (int, optional): Фильтр по ID аккаунта
+            limit (int, optional): Вернуть только столько последних записей
             
         Returns:
             list: Список записей активности
         """
+        # Сначала дописываем отложенные события, чтобы видеть собственные записи
+        self._journal.flush()
         try:
             cursor = self.conn.cursor()
             
             if customer_username and account_id:
-                cursor.execute(
-                    """
-                    SELECT * FROM customer_activity 
-                    WHERE customer_username = ? AND account_id = ?
-                    ORDER BY updated_at DESC
-                    """,
-                    (customer_username, account_id)
-                )
+                condition, params = "WHERE customer_username = ? AND account_id = ?", [customer_username, account_id]
             elif customer_username:
-                cursor.execute(
-                    """
-                    SELECT * FROM customer_activity 
-                    WHERE customer_username = ?
-                    ORDER BY updated_at DESC
-                    """,
-                    (customer_username,)
-                )
+                condition, params = "WHERE customer_username = ?", [customer_username]
             elif account_id:
-                cursor.execute(
-                    """
-                    SELECT * FROM customer_activity 
-                    WHERE account_id = ?
-                    ORDER BY updated_at DESC
-                    """,
-                    (account_id,)
-                )
+                condition, params = "WHERE account_id = ?", [account_id]
             else:
-                cursor.execute(
-                    """
-                    SELECT * FROM customer_activity 
-                    ORDER BY updated_at DESC
-                    """
-                )
+                condition, params = "", []
+            
+            limit_clause = ""
+            if limit:
+                limit_clause = "LIMIT ?"
+                params.append(limit)
+            
+            cursor.execute(
+                f"""
+                SELECT * FROM customer_activity 
+                {condition}
+                ORDER BY updated_at DESC
+                {limit_clause}
+                """,
+                params
+            )
             
             results = cursor.fetchall()
             
@@ -1558,7 +2017,7 @@ class SQLiteDB:
     
     def get_customer_stats(self, customer_username: str) -> dict:
         """
-        Получить статистику покупателя
+        Получить статистику покупателя (из сводной таблицы customer_stats)
         
         Args:
             customer_username (str): Имя пользователя
@@ -1566,37 +2025,18 @@ class SQLiteDB:
         Returns:
             dict: Статистика покупателя
         """
+        # Сначала дописываем отложенные события, чтобы видеть собственные записи
+        self._journal.flush()
         try:
             cursor = self.conn.cursor()
-            
-            # Общая статистика
             cursor.execute(
-                """
-                SELECT 
-                    COUNT(*) as total_purchases,
-                    SUM(rental_duration) as total_rental_hours,
-                    SUM(access_count) as total_accesses,
-                    SUM(rental_extended_count) as total_extensions,
-                    SUM(total_extension_hours) as total_extension_hours,
-                    AVG(feedback_rating) as avg_rating
-                FROM customer_activity 
-                WHERE customer_username = ? AND is_active = TRUE
-                """,
+                f"SELECT {CUSTOMER_STATS_COLUMNS} FROM customer_stats WHERE customer_username = ?",
                 (customer_username,)
             )
+            row = cursor.fetchone()
             
-            stats = cursor.fetchone()
-            
-            if stats and stats[0] > 0:
-                return {
-                    "customer_username": customer_username,
-                    "total_purchases": stats[0] or 0,
-                    "total_rental_hours": stats[1] or 0,
-                    "total_accesses": stats[2] or 0,
-                    "total_extensions": stats[3] or 0,
-                    "total_extension_hours": stats[4] or 0,
-                    "avg_rating": round(stats[5], 2) if stats[5] else None
-                }
+            if row and row[1] > 0:
+                return self._customer_stats_dict(row)
             else:
                 return {
                     "customer_username": customer_username,
@@ -1614,6 +2054,65 @@ class SQLiteDB:
         finally:
             cursor.close()
     
+    def get_recent_customers(self, limit: int = 10, after: str = None) -> tuple:
+        """
+        Получить покупателей с самой свежей активностью
+        
+        Args:
+            limit (int): Сколько покупателей вернуть
+            after (str, optional): Последний покупатель предыдущей страницы
+            
+        Returns:
+            tuple: (всего покупателей, список статистик как в get_customer_stats, есть ли следующая страница)
+        """
+        self._journal.flush()
+        try:
+            rows, _, has_next = self._keyset_page(
+                "customer_stats", CUSTOMER_STATS_COLUMNS,
+                ("last_activity", "customer_username"), True, after, None, limit
+            )
+            return self.count_rows("customer_stats"), [self._customer_stats_dict(row) for row in rows], has_next
+        except Exception as e:
+            logger.error(f"Error getting recent customers: {str(e)}")
+            return 0, [], False
+    
+    @staticmethod
+    def _customer_stats_dict(row) -> dict:
+        username, purchases, hours, accesses, extensions, extension_hours, rating_sum, rating_count = row
+        return {
+            "customer_username": username,
+            "total_purchases": purchases,
+            "total_rental_hours": hours,
+            "total_accesses": accesses,
+            "total_extensions": extensions,
+            "total_extension_hours": extension_hours,
+            "avg_rating": round(rating_sum / rating_count, 2) if rating_count else None
+        }
+    
+    def rebuild_customer_stats(self) -> int:
+        """
+        Пересчитать customer_stats по всей истории customer_activity
+        
+        Returns:
+            int: Количество покупателей, или -1 при ошибке
+        """
+        self._journal.flush()
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            rebuild_customer_stats(cursor)
+            cursor.execute("SELECT COUNT(*) FROM customer_stats")
+            total = cursor.fetchone()[0]
+            self.conn.commit()
+            logger.info(f"Customer stats rebuilt for {total} customers")
+            return total
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Error rebuilding customer stats: {str(e)}")
+            return -1
+        finally:
+            cursor.close()
+    
     def deactivate_customer_activity(self, customer_username: str, account_id: int) -> bool:
         """
         Деактивировать активность покупателя (при завершении аренды)
@@ -1626,8 +2125,7 @@ class SQLiteDB:
             bool: True если успешно, False иначе
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute(
+            self._journal.record(
                 """
                 UPDATE customer_activity 
                 SET is_active = FALSE, updated_at = CURRENT_TIMESTAMP
@@ -1635,7 +2133,6 @@ class SQLiteDB:
                 """,
                 (customer_username, account_id)
             )
-            self.conn.commit()
             
             logger.info(f"Customer activity deactivated: {customer_username} -> account {account_id}")
             return True
@@ -1643,69 +2140,3 @@ class SQLiteDB:
         except Exception as e:
             logger.error(f"Error deactivating customer activity: {str(e)}")
             return False
-        finally:
-            cursor.close()
-    
-    def _create_payment_tables(self, cursor):
-        """Создает таблицы для системы платежей и подписок."""
-        try:
-            # Таблица балансов пользователей
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_balances (
-                    user_id INTEGER PRIMARY KEY,
-                    balance DECIMAL(10, 2) DEFAULT 0.00,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            )
-            
-            # Таблица подписок пользователей
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS user_subscriptions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    plan_id TEXT NOT NULL,
-                    subscription_end TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_id)
-                )
-                """
-            )
-            
-            # Таблица транзакций
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS payment_transactions (
-                    id TEXT PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    amount DECIMAL(10, 2) NOT NULL,
-                    currency TEXT DEFAULT 'RUB',
-                    payment_method TEXT NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    paid_at TIMESTAMP NULL,
-                    description TEXT DEFAULT ''
-                )
-                """
-            )
-            
-            # Таблица настроек платежей
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS payment_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            )
-            
-            logger.info("Payment tables created successfully")
-            
-        except Exception as e:
-            logger.error(f"Error creating payment tables: {str(e)}")
-            self.conn.rollback()
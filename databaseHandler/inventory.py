@@ -0,0 +1,88 @@
+"""
+Индекс свободных аккаунтов по названию лота
+Держит в памяти списки свободных ID для каждого лота, чтобы обработка заказа
+не зависела от общего числа аккаунтов. Источник истины - база: индекс
+заполняется из нее при запуске, а SQLiteDB обновляет его после каждого коммита,
+меняющего владельца, очередь смены пароля или название аккаунта
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from logger import logger
+
+
+class FreeAccountIndex:
+    """Свободные аккаунты по лотам: lot_name -> упорядоченное множество ID"""
+
+    def __init__(self):
+        # dict сохраняет порядок вставки и дает O(1) добавление и удаление
+        self._free: Dict[str, Dict[int, None]] = {}
+        self._lot_of: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def load(self, rows: Iterable[Tuple[int, str, bool]]):
+        """Заполнить индекс строками (ID, account_name, свободен ли аккаунт)"""
+        with self._lock:
+            self._free = {}
+            self._lot_of = {}
+            for account_id, account_name, is_free in rows:
+                self._set(account_id, account_name, is_free)
+        logger.info(f"Free account index loaded: {self.total_free()} free accounts in {len(self._free)} lots")
+
+    def update(self, rows: Iterable[Tuple[int, str, bool]]):
+        """Обновить состояние аккаунтов по свежим строкам из базы"""
+        with self._lock:
+            for account_id, account_name, is_free in rows:
+                self._set(account_id, account_name, is_free)
+
+    def remove(self, account_id: int):
+        """Забыть удаленный аккаунт"""
+        with self._lock:
+            self._discard(account_id)
+            self._lot_of.pop(account_id, None)
+
+    def take(self, lot_name: str, count: int) -> Optional[List[int]]:
+        """
+        Забрать count свободных ID лота за O(count) или None, если их не хватает.
+        Забранные ID нужно либо занять в базе, либо вернуть через update()
+        """
+        with self._lock:
+            free = self._free.get(lot_name)
+            if not free or len(free) < count:
+                return None
+            taken = []
+            for account_id in free:
+                taken.append(account_id)
+                if len(taken) == count:
+                    break
+            for account_id in taken:
+                del free[account_id]
+            return taken
+
+    def count(self, lot_name: str) -> int:
+        return len(self._free.get(lot_name, ()))
+
+    def total_free(self) -> int:
+        return sum(len(free) for free in self._free.values())
+
+    def _set(self, account_id: int, account_name: str, is_free: bool):
+        if self._lot_of.get(account_id) != account_name:
+            self._discard(account_id)
+            self._lot_of[account_id] = account_name
+        if is_free:
+            self._free.setdefault(account_name, {})[account_id] = None
+        else:
+            self._discard(account_id)
+
+    def _discard(self, account_id: int):
+        lot_name = self._lot_of.get(account_id)
+        free = self._free.get(lot_name)
+        if free is not None:
+            free.pop(account_id, None)
+            if not free:
+                del self._free[lot_name]
+
+
+# Глобальный индекс свободных аккаунтов, который обновляет SQLiteDB
+free_accounts = FreeAccountIndex()
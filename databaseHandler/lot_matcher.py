@@ -0,0 +1,130 @@
+"""
+Сопоставление названия заказа FunPay с названием лота
+Названия лотов нормализуются один раз и хранятся в префиксном дереве,
+которое обновляется при добавлении, удалении и переименовании аккаунтов
+"""
+
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+from logger import logger
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_lot_name(name: str) -> str:
+    """Заменяет знаки препинания пробелами, схлопывает пробелы и приводит к нижнему регистру"""
+    return " ".join(_PUNCTUATION.sub(" ", name).split()).lower()
+
+
+class _Node:
+    __slots__ = ("children", "names")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        # Исходные названия, нормализующиеся в путь до этого узла: {название: порядковый номер}
+        self.names: Dict[str, int] = {}
+
+
+class LotNameMatcher:
+    """
+    Префиксное дерево нормализованных названий лотов.
+    match() возвращает самое длинное название, входящее в текст заказа как подстрока
+    (при равной длине - добавленное раньше). Обход дерева начинается заново с каждой
+    позиции текста: O(длина текста × глубина дерева), без автомата Ахо-Корасик -
+    тексты заказов короткие, а дерево проще обновлять при изменении аккаунтов
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._counts: Counter = Counter()
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.loaded_at = 0.0
+
+    def load(self, names: Iterable[str]):
+        """Построить дерево заново (names - названия всех аккаунтов, с повторами)"""
+        with self._lock:
+            self._root = _Node()
+            self._counts = Counter()
+            self._seq = 0
+            for name in names:
+                self._add(name)
+            self.loaded_at = time.monotonic()
+        logger.info(f"Lot matcher loaded {len(self._counts)} lot names")
+
+    def add(self, name: str):
+        with self._lock:
+            self._add(name)
+
+    def remove(self, name: str):
+        with self._lock:
+            self._remove(name)
+
+    def rename(self, old_name: str, new_name: str):
+        with self._lock:
+            self._remove(old_name)
+            self._add(new_name)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def _add(self, name: str):
+        self._counts[name] += 1
+        if self._counts[name] > 1:
+            return
+        key = normalize_lot_name(name)
+        if not key:
+            return
+        node = self._root
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+        self._seq += 1
+        node.names[name] = self._seq
+
+    def _remove(self, name: str):
+        if self._counts[name] > 1:
+            self._counts[name] -= 1
+            return
+        self._counts.pop(name, None)
+        key = normalize_lot_name(name)
+        path = [self._root]
+        for char in key:
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].names.pop(name, None)
+        # Удаляем опустевшие узлы снизу вверх
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node.names or node.children:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+
+    def match(self, text: str) -> Optional[str]:
+        """Самое длинное название лота, содержащееся в тексте заказа"""
+        text = normalize_lot_name(text)
+        root = self._root
+        best_length, best_seq, best_name = 0, 0, None
+        for start in range(len(text)):
+            node = root.children.get(text[start])
+            position = start
+            while node is not None:
+                position += 1
+                if node.names:
+                    length = position - start
+                    name, seq = min(node.names.items(), key=lambda item: item[1])
+                    if length > best_length or (length == best_length and seq < best_seq):
+                        best_length, best_seq, best_name = length, seq, name
+                if position == len(text):
+                    break
+                node = node.children.get(text[position])
+        return best_name
+
+
+# Глобальный индекс названий лотов, который SQLiteDB обновляет при изменении аккаунтов
+lot_matcher = LotNameMatcher()
@@ -0,0 +1,468 @@
+"""
+Версионные миграции схемы database.db
+Применённые шаги записываются в таблицу schema_version; при запуске выполняются
+только шаги с большим номером, каждый в своей транзакции. Новые изменения схемы
+добавляются в конец MIGRATIONS, существующие шаги не редактируются
+"""
+
+import sqlite3
+from typing import Callable, List, Tuple
+
+from logger import logger
+
+
+def _create_base_tables(cursor):
+    """Основные таблицы: аккаунты, авторизованные пользователи, активность покупателей"""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS accounts (
+            ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_name TEXT NOT NULL UNIQUE,
+            path_to_maFile TEXT NOT NULL,
+            login TEXT NOT NULL,
+            password TEXT NOT NULL,
+            rental_duration INTEGER NOT NULL,
+            owner TEXT DEFAULT NULL,
+            rental_start TIMESTAMP DEFAULT NULL,
+            access_count INTEGER DEFAULT 0,
+            max_access_count INTEGER DEFAULT 3,
+            last_access TIMESTAMP DEFAULT NULL
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS authorized_users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            authorized_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1,
+            permissions TEXT DEFAULT 'user'
+        )
+        """
+    )
+
+    # Таблица для отслеживания покупателей
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS customer_activity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_username TEXT NOT NULL,
+            account_id INTEGER,
+            account_name TEXT,
+            purchase_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            rental_duration INTEGER,
+            access_count INTEGER DEFAULT 0,
+            max_access_count INTEGER DEFAULT 3,
+            last_access_time TIMESTAMP DEFAULT NULL,
+            feedback_rating INTEGER DEFAULT NULL,
+            feedback_text TEXT DEFAULT NULL,
+            feedback_time TIMESTAMP DEFAULT NULL,
+            rental_extended_count INTEGER DEFAULT 0,
+            total_extension_hours INTEGER DEFAULT 0,
+            is_active BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def _table_columns(cursor, table: str) -> List[str]:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [column[1] for column in cursor.fetchall()]
+
+
+def _add_authorized_users_profile(cursor):
+    """Профиль, активность и права в authorized_users (для баз со старой схемой таблицы)"""
+    columns = _table_columns(cursor, "authorized_users")
+
+    if 'username' not in columns:
+        cursor.execute("ALTER TABLE authorized_users ADD COLUMN username TEXT")
+    if 'first_name' not in columns:
+        cursor.execute("ALTER TABLE authorized_users ADD COLUMN first_name TEXT")
+    if 'last_name' not in columns:
+        cursor.execute("ALTER TABLE authorized_users ADD COLUMN last_name TEXT")
+    if 'last_activity' not in columns:
+        # ALTER TABLE не принимает CURRENT_TIMESTAMP как значение по умолчанию,
+        # существующие записи заполняются ниже из authorized_at
+        cursor.execute("ALTER TABLE authorized_users ADD COLUMN last_activity TIMESTAMP DEFAULT NULL")
+    if 'is_active' not in columns:
+        cursor.execute("ALTER TABLE authorized_users ADD COLUMN is_active BOOLEAN DEFAULT 1")
+    if 'permissions' not in columns:
+        cursor.execute("ALTER TABLE authorized_users ADD COLUMN permissions TEXT DEFAULT 'user'")
+
+    # Обновляем существующие записи
+    cursor.execute("UPDATE authorized_users SET last_activity = authorized_at WHERE last_activity IS NULL")
+    cursor.execute("UPDATE authorized_users SET is_active = 1 WHERE is_active IS NULL")
+    cursor.execute("UPDATE authorized_users SET permissions = 'user' WHERE permissions IS NULL")
+
+
+def _add_accounts_access_limits(cursor):
+    """Поля ограничения доступа в accounts"""
+    columns = _table_columns(cursor, "accounts")
+
+    if 'access_count' not in columns:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN access_count INTEGER DEFAULT 0")
+    if 'max_access_count' not in columns:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN max_access_count INTEGER DEFAULT 3")
+    if 'last_access' not in columns:
+        cursor.execute("ALTER TABLE accounts ADD COLUMN last_access TIMESTAMP DEFAULT NULL")
+
+
+def _create_payment_tables(cursor):
+    """Таблицы системы платежей и подписок"""
+    # Таблица балансов пользователей
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_balances (
+            user_id INTEGER PRIMARY KEY,
+            balance DECIMAL(10, 2) DEFAULT 0.00,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+    # Таблица подписок пользователей
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            plan_id TEXT NOT NULL,
+            subscription_end TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id)
+        )
+        """
+    )
+
+    # Таблица транзакций
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_transactions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            amount DECIMAL(10, 2) NOT NULL,
+            currency TEXT DEFAULT 'RUB',
+            payment_method TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            paid_at TIMESTAMP NULL,
+            description TEXT DEFAULT ''
+        )
+        """
+    )
+
+    # Таблица настроек платежей
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def _create_rotation_jobs_table(cursor):
+    """Очередь смены паролей после окончания аренды"""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS rotation_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER NOT NULL,
+            owner TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT DEFAULT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+    # Не больше одной незавершенной задачи на аккаунт
+    cursor.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_rotation_jobs_active_account
+        ON rotation_jobs (account_id) WHERE state != 'done'
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_rotation_jobs_due
+        ON rotation_jobs (state, next_attempt_at)
+        """
+    )
+
+
+def _create_accounts_indexes(cursor):
+    """Индексы accounts для поиска аренд по владельцу, свободных лотов и аккаунтов по логину"""
+    # Активные аренды: owner = ?, owner IS NOT NULL, выборка сроков аренды
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_accounts_owner_rental
+        ON accounts (owner, rental_start) WHERE owner IS NOT NULL
+        """
+    )
+    # Свободные лоты: покрывает список названий без чтения арендованных строк
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_accounts_free_name
+        ON accounts (account_name) WHERE owner IS NULL
+        """
+    )
+    # Аккаунты с общим логином (смена пароля, OTHER_ACCOUNT, остановка аренды)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_accounts_login ON accounts (login)")
+
+
+def _create_customer_activity_indexes(cursor):
+    """Индексы customer_activity по покупателю и по аккаунту"""
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_customer_activity_customer
+        ON customer_activity (customer_username, account_id)
+        """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_customer_activity_account
+        ON customer_activity (account_id)
+        """
+    )
+
+
+def _customer_stats_delta(row: str, sign: int) -> str:
+    """UPDATE, добавляющий (sign=1) или вычитающий (sign=-1) вклад строки customer_activity"""
+    active = f"(CASE WHEN {row}.is_active THEN {sign} ELSE 0 END)"
+    return f"""
+        UPDATE customer_stats SET
+            total_purchases = total_purchases + {active},
+            total_rental_hours = total_rental_hours + {active} * COALESCE({row}.rental_duration, 0),
+            total_accesses = total_accesses + {active} * COALESCE({row}.access_count, 0),
+            total_extensions = total_extensions + {active} * COALESCE({row}.rental_extended_count, 0),
+            total_extension_hours = total_extension_hours + {active} * COALESCE({row}.total_extension_hours, 0),
+            rating_sum = rating_sum + {active} * COALESCE({row}.feedback_rating, 0),
+            rating_count = rating_count + {active} * ({row}.feedback_rating IS NOT NULL)
+        WHERE customer_username = {row}.customer_username;
+    """
+
+
+def _customer_stats_touch(row: str) -> str:
+    """Создать строку покупателя при необходимости и сдвинуть время последней активности"""
+    return f"""
+        INSERT OR IGNORE INTO customer_stats (customer_username) VALUES ({row}.customer_username);
+        UPDATE customer_stats
+        SET last_activity = MAX(COALESCE(last_activity, ''), COALESCE({row}.updated_at, ''))
+        WHERE customer_username = {row}.customer_username;
+    """
+
+
+def rebuild_customer_stats(cursor):
+    """Пересчитать customer_stats по всей истории customer_activity"""
+    cursor.execute("DELETE FROM customer_stats")
+    cursor.execute(
+        """
+        INSERT INTO customer_stats (
+            customer_username, total_purchases, total_rental_hours, total_accesses,
+            total_extensions, total_extension_hours, rating_sum, rating_count, last_activity
+        )
+        SELECT
+            customer_username,
+            SUM(CASE WHEN is_active THEN 1 ELSE 0 END),
+            SUM(CASE WHEN is_active THEN COALESCE(rental_duration, 0) ELSE 0 END),
+            SUM(CASE WHEN is_active THEN COALESCE(access_count, 0) ELSE 0 END),
+            SUM(CASE WHEN is_active THEN COALESCE(rental_extended_count, 0) ELSE 0 END),
+            SUM(CASE WHEN is_active THEN COALESCE(total_extension_hours, 0) ELSE 0 END),
+            SUM(CASE WHEN is_active THEN COALESCE(feedback_rating, 0) ELSE 0 END),
+            SUM(CASE WHEN is_active AND feedback_rating IS NOT NULL THEN 1 ELSE 0 END),
+            MAX(updated_at)
+        FROM customer_activity
+        GROUP BY customer_username
+        """
+    )
+
+
+def _create_customer_stats(cursor):
+    """
+    Сводная статистика покупателей. Учитываются активные аренды, как и в прежнем
+    агрегате get_customer_stats; триггеры на customer_activity поддерживают ее при каждой записи
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS customer_stats (
+            customer_username TEXT PRIMARY KEY,
+            total_purchases INTEGER NOT NULL DEFAULT 0,
+            total_rental_hours INTEGER NOT NULL DEFAULT 0,
+            total_accesses INTEGER NOT NULL DEFAULT 0,
+            total_extensions INTEGER NOT NULL DEFAULT 0,
+            total_extension_hours INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            last_activity TIMESTAMP DEFAULT NULL
+        )
+        """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_customer_stats_last_activity ON customer_stats (last_activity)"
+    )
+    # Последние записи покупателя и всей истории без сортировки таблицы
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_customer_activity_customer_updated
+        ON customer_activity (customer_username, updated_at)
+        """
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_customer_activity_updated ON customer_activity (updated_at)"
+    )
+
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_customer_stats_insert AFTER INSERT ON customer_activity
+        BEGIN
+            {_customer_stats_touch("NEW")}
+            {_customer_stats_delta("NEW", 1)}
+        END
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_customer_stats_update AFTER UPDATE ON customer_activity
+        BEGIN
+            {_customer_stats_delta("OLD", -1)}
+            {_customer_stats_touch("NEW")}
+            {_customer_stats_delta("NEW", 1)}
+        END
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_customer_stats_delete AFTER DELETE ON customer_activity
+        BEGIN
+            {_customer_stats_delta("OLD", -1)}
+        END
+        """
+    )
+
+    rebuild_customer_stats(cursor)
+
+
+def _create_authorized_users_index(cursor):
+    """Постраничный список пользователей (новые сверху) без сортировки таблицы"""
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_authorized_users_authorized_at
+        ON authorized_users (authorized_at, user_id)
+        """
+    )
+
+
+def _add_rotation_jobs_new_password(cursor):
+    """Новый пароль задачи смены пароля хранится в базе до обращения к Steam"""
+    if 'new_password' not in _table_columns(cursor, "rotation_jobs"):
+        cursor.execute("ALTER TABLE rotation_jobs ADD COLUMN new_password TEXT DEFAULT NULL")
+
+
+# (версия, описание, шаг). Шаги 1-5 повторяют прежние create_table/_migrate_* и
+# безопасны для баз, созданных до появления schema_version
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "base tables", _create_base_tables),
+    (2, "authorized_users profile columns", _add_authorized_users_profile),
+    (3, "accounts access limit columns", _add_accounts_access_limits),
+    (4, "payment tables", _create_payment_tables),
+    (5, "rotation jobs queue", _create_rotation_jobs_table),
+    (6, "accounts indexes", _create_accounts_indexes),
+    (7, "customer_activity indexes", _create_customer_activity_indexes),
+    (8, "customer stats rollup", _create_customer_stats),
+    (9, "authorized_users listing index", _create_authorized_users_index),
+    (10, "rotation jobs new password", _add_rotation_jobs_new_password),
+]
+
+
+class MigrationError(RuntimeError):
+    """Шаг миграции не применился; работать со схемой ниже последней версии нельзя"""
+
+    def __init__(self, version: int, description: str, error: Exception):
+        self.version = version
+        self.description = description
+        super().__init__(f"Schema migration {version} ({description}) failed: {str(error)}")
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Номер последней применённой миграции (0 для пустой базы)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+        )
+        if cursor.fetchone() is None:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations=None) -> int:
+    """
+    Применяет недостающие миграции по порядку. Каждый шаг и запись о нем в
+    schema_version выполняются в одной транзакции BEGIN IMMEDIATE, поэтому
+    параллельно запущенные процессы не применят шаг дважды. При ошибке шаг
+    откатывается и возбуждается MigrationError - запуск с недомигрированной
+    схемой останавливается. Возвращает итоговую версию схемы
+    """
+    if migrations is None:
+        migrations = MIGRATIONS
+
+    if conn.in_transaction:
+        conn.commit()
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        conn.commit()
+
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = cursor.fetchone()[0]
+
+        for version, description, step in migrations:
+            if version <= current:
+                continue
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                # Другой процесс мог применить шаг, пока мы ждали блокировку
+                cursor.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))
+                if cursor.fetchone() is None:
+                    step(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                        (version, description),
+                    )
+                    logger.info(f"Applied schema migration {version}: {description}")
+                conn.commit()
+                current = version
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Schema migration {version} ({description}) failed: {str(e)}")
+                raise MigrationError(version, description, e) from e
+
+        return current
+    finally:
+        cursor.close()
@@ -0,0 +1,145 @@
+"""
+Планировщик истечения аренд
+Min-heap дедлайнов аренд: поток спит ровно до ближайшего дедлайна,
+изменения аренд добавляются за O(log n) без пересканирования таблицы
+"""
+
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from logger import logger
+
+
+def rental_deadline(rental_start: str, rental_duration: int) -> float:
+    """Unix-время окончания аренды (rental_start хранится в локальном времени)"""
+    start_time = datetime.fromisoformat(rental_start)
+    return (start_time + timedelta(hours=rental_duration)).timestamp()
+
+
+class RentalExpiryScheduler:
+    """Очередь дедлайнов аренд с ленивым удалением устаревших записей"""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int]] = []
+        self._deadlines: Dict[int, float] = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._on_expire: Optional[Callable[[int], None]] = None
+        self._listeners = []
+        self.running = False
+
+    def add_listener(self, listener):
+        """
+        Подписать объект на начало и конец аренд. Слушатель реализует
+        rentals_loaded(deadlines), rental_scheduled(account_id, deadline) и rental_cancelled(account_id)
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, event: str, *args):
+        for listener in self._listeners:
+            try:
+                getattr(listener, event)(*args)
+            except Exception as e:
+                logger.error(f"Error in rental listener {event}: {str(e)}")
+
+    def schedule(self, account_id: int, deadline: float):
+        """Добавить или перенести дедлайн аренды"""
+        with self._condition:
+            if self._deadlines.get(account_id) == deadline:
+                return
+            self._deadlines[account_id] = deadline
+            heapq.heappush(self._heap, (deadline, account_id))
+            # Перестраиваем кучу, если мусора стало больше живых записей
+            if len(self._heap) > 2 * len(self._deadlines) + 64:
+                self._heap = [(d, a) for a, d in self._deadlines.items()]
+                heapq.heapify(self._heap)
+            if self._heap[0] == (deadline, account_id):
+                self._condition.notify()
+        self._notify("rental_scheduled", account_id, deadline)
+
+    def cancel(self, account_id: int):
+        """Убрать аренду из расписания (запись в куче станет устаревшей)"""
+        with self._condition:
+            self._deadlines.pop(account_id, None)
+        self._notify("rental_cancelled", account_id)
+
+    def load(self, rentals: List[Tuple[int, str, int]]):
+        """Заполнить расписание активными арендами (id, rental_start, rental_duration)"""
+        with self._condition:
+            for account_id, rental_start, rental_duration in rentals:
+                try:
+                    self._deadlines[account_id] = rental_deadline(rental_start, rental_duration)
+                except (TypeError, ValueError) as e:
+                    logger.error(f"Invalid rental_start for account {account_id}: {str(e)}")
+            self._heap = [(d, a) for a, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+            self._condition.notify()
+            deadlines = dict(self._deadlines)
+        self._notify("rentals_loaded", deadlines)
+        logger.info(f"Rental expiry scheduler loaded {len(self._deadlines)} active rentals")
+
+    def next_deadline(self) -> Optional[Tuple[int, float]]:
+        """Ближайшая аренда и ее дедлайн"""
+        with self._condition:
+            self._drop_stale()
+            if not self._heap:
+                return None
+            deadline, account_id = self._heap[0]
+            return account_id, deadline
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def start(self, on_expire: Callable[[int], None]):
+        """Запустить поток, вызывающий on_expire(account_id) в момент дедлайна"""
+        if self.running:
+            return
+        self._on_expire = on_expire
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self.running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _drop_stale(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self.running:
+                    self._drop_stale()
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                if not self.running:
+                    return
+                deadline, account_id = heapq.heappop(self._heap)
+                del self._deadlines[account_id]
+
+            try:
+                self._on_expire(account_id)
+            except Exception as e:
+                logger.error(f"Error releasing expired rental {account_id}: {str(e)}")
+                # Повторим попытку через минуту, если аренду никто не перенес
+                with self._condition:
+                    if account_id not in self._deadlines:
+                        self._deadlines[account_id] = time.time() + 60
+                        heapq.heappush(self._heap, (self._deadlines[account_id], account_id))
+
+
+# Глобальный планировщик, в который SQLiteDB сообщает об изменениях аренд
+rental_scheduler = RentalExpiryScheduler()
@@ -1,21 +1,22 @@
 # Standard library imports
 import random
 import time
-import asyncio
-import sqlite3
-import threading
-import re
-from datetime import datetime, timedelta
 
 # Third-party imports
-from FunPayAPI import Account, Runner, types, enums, events
+from FunPayAPI import Runner, PollController, types, enums, events
 
 # Project-specific imports
 from config import FUNPAY_GOLDEN_KEY, ADMIN_ID, HOURS_FOR_REVIEW
 
 from databaseHandler.databaseSetup import SQLiteDB
-from steamHandler.SteamGuard import get_steam_guard_code
-from steamHandler.changePassword import changeSteamPassword
+from databaseHandler.connection import get_connection
+from databaseHandler.rental_scheduler import rental_scheduler, rental_deadline
+from databaseHandler.lot_matcher import lot_matcher, normalize_lot_name
+from databaseHandler.inventory import free_accounts
+from funpayHandler.session import FunPaySession
+from steamHandler.SteamGuard import get_steam_guard_codes, format_code_validity
+from steamHandler.steam_time import steam_time
+from steamHandler.password_rotation import password_rotation
 from steamHandler.auto_guard import start_auto_guard, send_welcome_guard_code, get_auto_guard_stats
 from messaging.message_sender import initialize_message_sender, send_message_by_owner
 from logger import logger
@@ -24,6 +25,10 @@ from pytz import timezone
 
 TOKEN = FUNPAY_GOLDEN_KEY
 REFRESH_INTERVAL = 1300  # 30 minutes in seconds
+LOT_MATCHER_RELOAD_INTERVAL = 60  # Min seconds between matcher reloads after an unmatched order
+POLL_MIN_DELAY = 1.5  # Seconds between FunPay polls while events keep arriving
+POLL_MAX_DELAY = 20  # Poll delay ceiling when the shop is idle
+POLL_REQUESTS_PER_MINUTE = 30  # Budget of runner/ polls per sliding minute
 
 feedbackGiven = []
 
@@ -31,79 +36,41 @@ moscow_tz = timezone("Europe/Moscow")
 
 db = SQLiteDB()
 
+funpay_session = FunPaySession(TOKEN, ttl=REFRESH_INTERVAL)
 
-def refresh_session():
-    global acc, runner
-    logger.info("Refreshing FunPay session...")
-    acc = Account(TOKEN).get()
-    runner = Runner(acc)
-    logger.info("FunPay session refreshed successfully.")
 
+def release_expired_rental(account_id):
+    """Releases an account whose rental deadline has been reached and changes its password"""
+    account = db.get_account_by_id(account_id)
+    if not account or account["owner"] is None or account["rental_start"] is None:
+        return
 
-def check_rental_expiration():
-    """Checks for expired rentals and changes passwords every minute"""
-    while True:
-        try:
-            conn = sqlite3.connect("database.db")
-            cursor = conn.cursor()
-            
-            # Get all accounts with active rentals
-            cursor.execute("""
-                SELECT id, account_name, login, password, rental_duration, rental_start, owner
-                FROM accounts 
-                WHERE owner IS NOT NULL AND rental_start IS NOT NULL
-            """)
-            
-            active_rentals = cursor.fetchall()
-            
-            for rental in active_rentals:
-                account_id, account_name, login, password, rental_duration, rental_start, owner = rental
-                
-                # Check if rental has expired
-                start_time = datetime.fromisoformat(rental_start)
-                end_time = start_time + timedelta(hours=rental_duration)
-                
-                if datetime.now() >= end_time:
-                    logger.info(f"Rental expired for account {account_name} (owner: {owner})")
-                    
-                    # Change password
-                    try:
-                        cursor.execute("SELECT path_to_maFile FROM accounts WHERE id = ?", (account_id,))
-                        mafile_result = cursor.fetchone()
-                        
-                        if mafile_result:
-                            mafile_path = mafile_result[0]
-                            new_password = asyncio.run(changeSteamPassword(mafile_path, password))
-                            
-                            # Update password in database
-                            cursor.execute(
-                                "UPDATE accounts SET password = ? WHERE id = ?",
-                                (new_password, account_id)
-                            )
-                            
-                            logger.info(f"Password changed for expired account {account_name}")
-                            
-                    except Exception as e:
-                        logger.error(f"Error changing password for account {account_id}: {str(e)}")
-                    
-                    # Clear owner and rental_start
-                    cursor.execute(
-                        "UPDATE accounts SET owner = NULL, rental_start = NULL WHERE id = ?",
-                        (account_id,)
-                    )
-                    
-                    # Деактивируем активность покупателя
-                    db.deactivate_customer_activity(owner, account_id)
-                    
-                    logger.info(f"Account {account_name} released from {owner}")
-            
-            conn.commit()
-            conn.close()
-            
-        except Exception as e:
-            logger.error(f"Error in rental expiration checker: {str(e)}")
+    # Аренду могли продлить в обход SQLiteDB - сверяемся с базой
+    deadline = rental_deadline(account["rental_start"], account["rental_duration"])
+    if deadline > time.time():
+        rental_scheduler.schedule(account_id, deadline)
+        return
+
+    account_name, owner = account["account_name"], account["owner"]
+    logger.info(f"Rental expired for account {account_name} (owner: {owner})")
+
+    # Освобождаем аккаунт и ставим смену пароля в очередь одной транзакцией;
+    # аккаунт не продается, пока задача не выполнена
+    if not db.expire_rental(account_id):
+        raise RuntimeError(f"Failed to release account {account_name}")
 
-        time.sleep(60)  # Check every 60 seconds (1 minute)
+    # Деактивируем активность покупателя
+    db.deactivate_customer_activity(owner, account_id)
+
+    logger.info(f"Account {account_name} released from {owner}, password rotation queued")
+    password_rotation.wake()
+
+
+def check_rental_expiration():
+    """Loads active rentals once and releases each one exactly at its deadline"""
+    password_rotation.start(db)
+    rental_scheduler.load(db.get_rental_deadlines())
+    rental_scheduler.start(release_expired_rental)
 
 
 def startFunpay():
@@ -118,20 +85,23 @@ def startFunpay():
             print("❌ Ошибка: FUNPAY_GOLDEN_KEY не задан в config.py")
             return
         
-        acc = Account(TOKEN).get()
-        runner = Runner(acc)
+        acc = funpay_session.start()
+        # При перезапуске потока аккаунт и его Runner переиспользуются
+        runner = acc.runner or Runner(acc)
         logger.info("FunPay account and runner initialized.")
         
         # Инициализируем отправитель сообщений
         initialize_message_sender(acc)
         logger.info("Message sender initialized.")
-        
-        last_refresh = time.time()
 
-        logger.info("Starting rental expiration checker thread...")
+        # Синхронизация времени Steam в фоне, чтобы к первому заказу смещение было известно
+        steam_time.start()
 
-        timerChecker_thread = threading.Thread(target=check_rental_expiration, daemon=True)
-        timerChecker_thread.start()
+        lot_matcher.load(db.get_all_account_names())
+        db.load_free_accounts()
+
+        logger.info("Starting rental expiration scheduler...")
+        check_rental_expiration()
 
         # Запускаем автоматическую систему выдачи Steam Guard кодов
         logger.info("Starting AutoGuard system...")
@@ -139,22 +109,10 @@ def startFunpay():
 
         logger.info("FunPay bot started successfully. Listening for events...")
 
-        for event in runner.listen(requests_delay=8):
+        poll_controller = PollController(min_delay=POLL_MIN_DELAY, max_delay=POLL_MAX_DELAY,
+                                         requests_per_minute=POLL_REQUESTS_PER_MINUTE)
+        for event in runner.listen(poll_controller=poll_controller):
             try:
-                global send_message_by_owner
-                current_time = time.time()
-                if current_time - last_refresh >= REFRESH_INTERVAL:
-                    logger.info("Refreshing session due to interval timeout...")
-                    refresh_session()
-                    last_refresh = current_time
-
-                def send_message_by_owner(owner, message):
-                    try:
-                        chat = acc.get_chat_by_name(owner, True)
-                        acc.send_message(chat.id, message)
-                    except Exception as e:
-                        logger.error(f"Failed to send message to {owner}: {str(e)}")
-
                 # Отладочная информация о типе события
                 logger.debug(f"Получено событие: {event.type}", extra_info=f"Event type: {event.type}")
                 
@@ -174,53 +132,33 @@ def startFunpay():
                         event.order.price
                     )
 
-                    accounts = db.get_unowned_accounts()
-
-                    acc = Account(TOKEN).get()
-                    chat = acc.get_chat_by_name(event.order.buyer_username, True)
-
-                    all_accounts = db.get_all_account_names()
-
                     order_name = event.order.description
                     number_of_orders = event.order.amount
 
                     logger.debug(f"Название заказа: {order_name}", extra_info="Original order name")
+                    logger.debug(f"Очищенное название: {normalize_lot_name(order_name)}", extra_info="Cleaned order name")
 
-                    cleaned_order_name = re.sub(r"[^\w\s]", " ", order_name)
-                    cleaned_order_name = " ".join(cleaned_order_name.split())
-                    logger.debug(f"Очищенное название: {cleaned_order_name}", extra_info="Cleaned order name")
-
-                    matched_account = None
-                    max_similarity = 0
-
-                    for account in all_accounts:
-                        cleaned_account = re.sub(r"[^\w\s]", " ", account)
-                        cleaned_account = " ".join(cleaned_account.split())
-
-                        if cleaned_account.lower() in cleaned_order_name.lower():
-                            similarity = len(cleaned_account)
-                            if similarity > max_similarity:
-                                max_similarity = similarity
-                                matched_account = account
+                    matched_account = lot_matcher.match(order_name)
+                    if matched_account is None and time.monotonic() - lot_matcher.loaded_at > LOT_MATCHER_RELOAD_INTERVAL:
+                        # Лот мог быть добавлен другим процессом (например, account_manager.py)
+                        lot_matcher.load(db.get_all_account_names())
+                        db.load_free_accounts()
+                        matched_account = lot_matcher.match(order_name)
 
                     if matched_account:
                         logger.info(f"✅ Найден подходящий аккаунт: {matched_account}", extra_info="Account matched successfully")
 
-                        available_accounts = [
-                            acc for acc in accounts if acc["account_name"] == matched_account
-                        ]
-
-                        if len(available_accounts) >= number_of_orders:
-                            logger.info(f"📦 Найдено {len(available_accounts)} доступных аккаунтов для {matched_account}", 
-                                      extra_info=f"Available: {len(available_accounts)}, Required: {number_of_orders}")
+                        # Все аккаунты заказа резервируются одной транзакцией
+                        selected_accounts = db.reserve_accounts(
+                            matched_account, number_of_orders, event.order.buyer_username
+                        )
 
-                            selected_accounts = available_accounts[:number_of_orders]
+                        if selected_accounts:
+                            logger.info(f"📦 Зарезервировано {len(selected_accounts)} аккаунтов для {matched_account}", 
+                                      extra_info=f"Left: {free_accounts.count(matched_account)}, Required: {number_of_orders}")
 
                             for i, account in enumerate(selected_accounts):
                                 try:
-                                    # Set owner and rental start time
-                                    db.set_account_owner(account["id"], event.order.buyer_username)
-                                    
                                     # Логируем выдачу аккаунта
                                     logger.account_assigned(account["id"], event.order.buyer_username, account['account_name'])
                                     
@@ -251,8 +189,8 @@ def startFunpay():
                                         f"------------------------------------------------------------------------------"
                                     )
 
-                                    send_message_by_owner(event.order.buyer_username, message)
-                                    logger.debug(f"Сообщение отправлено пользователю {event.order.buyer_username}", 
+                                    send_message_by_owner(event.order.buyer_username, message, chat_id=event.order.chat_id)
+                                    logger.debug(f"Сообщение поставлено в очередь для {event.order.buyer_username}", 
                                                extra_info=f"Account ID: {account['id']}")
                                     
                                     # Автоматически отправляем Steam Guard код при покупке
@@ -264,9 +202,9 @@ def startFunpay():
                                             account['path_to_maFile']
                                         )
                                         if success:
-                                            logger.info(f"Welcome guard code sent to {event.order.buyer_username} for {account['account_name']}")
+                                            logger.debug(f"Welcome guard code queued for {event.order.buyer_username} for {account['account_name']}")
                                         else:
-                                            logger.warning(f"Failed to send welcome guard code to {event.order.buyer_username} for {account['account_name']}")
+                                            logger.warning(f"Failed to queue welcome guard code for {event.order.buyer_username} for {account['account_name']}")
                                     except Exception as guard_error:
                                         logger.error(f"Error sending welcome guard code: {str(guard_error)}")
 
@@ -278,13 +216,15 @@ def startFunpay():
                             logger.warning(f"Not enough available accounts for {matched_account}")
                             send_message_by_owner(
                                 event.order.buyer_username,
-                                f"Извините, в данный момент нет доступных аккаунтов для '{matched_account}'. Попробуйте позже."
+                                f"Извините, в данный момент нет доступных аккаунтов для '{matched_account}'. Попробуйте позже.",
+                                chat_id=event.order.chat_id
                             )
                     else:
                         logger.warning(f"No matching account found for order: {order_name}")
                         send_message_by_owner(
                             event.order.buyer_username,
-                            f"Извините, не удалось найти подходящий аккаунт для заказа '{order_name}'. Обратитесь к администратору."
+                            f"Извините, не удалось найти подходящий аккаунт для заказа '{order_name}'. Обратитесь к администратору.",
+                            chat_id=event.order.chat_id
                         )
 
                 elif hasattr(events.EventTypes, 'ORDER_PAID') and event.type is events.EventTypes.ORDER_PAID:
@@ -303,7 +243,7 @@ def startFunpay():
                 elif hasattr(events.EventTypes, 'NEW_MESSAGE') and event.type is events.EventTypes.NEW_MESSAGE:
                     logger.info("Processing new message event...")
 
-                    conn = sqlite3.connect("database.db")
+                    conn = get_connection()
                     cursor = conn.cursor()
 
                     try:
@@ -340,13 +280,14 @@ def startFunpay():
                                         
                                         if mafile_result:
                                             mafile_path = mafile_result[0]
-                                            guard_code = get_steam_guard_code(mafile_path)
+                                            guard_code, next_code, seconds_left = get_steam_guard_codes(mafile_path)
                                             
                                             if guard_code:
-                                                send_message_by_owner(
-                                                    sender_username,
-                                                    f"🔐 Код подтверждения для аккаунта {account_name}:\n`{guard_code}`"
+                                                code_text = (
+                                                    f"🔐 Код подтверждения для аккаунта {account_name}:\n`{guard_code}`\n"
+                                                    f"{format_code_validity(next_code, seconds_left)}"
                                                 )
+                                                send_message_by_owner(sender_username, code_text)
                                             else:
                                                 send_message_by_owner(
                                                     sender_username,
@@ -509,7 +450,7 @@ def startFunpay():
                     except Exception as e:
                         logger.error(f"Error processing message: {str(e)}")
                     finally:
-                        conn.close()
+                        cursor.close()
 
                 elif hasattr(events.EventTypes, 'CHAT_OPENED') and event.type is events.EventTypes.CHAT_OPENED:
                     logger.log_chat_opened(event.chat.name)
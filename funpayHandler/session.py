@@ -0,0 +1,80 @@
+"""
+Долгоживущая сессия FunPay
+Один экземпляр Account на весь процесс, обновляемый в фоне по TTL или после 403
+"""
+
+import time
+import threading
+
+from FunPayAPI import Account
+from logger import logger
+
+
+class FunPaySession:
+    """Потокобезопасная обертка над единственным экземпляром Account"""
+
+    def __init__(self, golden_key: str, ttl: int = 1300, check_interval: float = 5.0):
+        self.golden_key = golden_key
+        self.ttl = ttl
+        self.check_interval = check_interval
+
+        self.account: Account | None = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._refresh_thread = None
+        self.running = False
+
+    def start(self) -> Account:
+        """Авторизоваться в FunPay и запустить фоновое обновление сессии"""
+        with self._lock:
+            if self.account is None:
+                self.account = Account(self.golden_key).get()
+        if not self.running:
+            self.running = True
+            self._refresh_thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._refresh_thread.start()
+            logger.info("FunPay session refresher started", extra_info=f"TTL: {self.ttl}s")
+        return self.account
+
+    def stop(self):
+        """Остановить фоновое обновление и закрыть соединения"""
+        self.running = False
+        self._wakeup.set()
+        if self._refresh_thread:
+            self._refresh_thread.join(timeout=5)
+        if self.account:
+            self.account.close()
+
+    def needs_refresh(self) -> bool:
+        """Истек ли TTL сессии или FunPay ответил 403 после последнего обновления"""
+        acc = self.account
+        if acc is None or acc.last_update is None:
+            return True
+        return time.time() - acc.last_update >= self.ttl or acc.last_403_err_time >= acc.last_update
+
+    def refresh(self, force: bool = False) -> bool:
+        """Обновить PHPSESSID и csrf-токен текущего аккаунта на месте"""
+        with self._lock:
+            if not force and not self.needs_refresh():
+                return False
+            logger.info("Refreshing FunPay session...")
+            self.account.get()
+            logger.info("FunPay session refreshed successfully.")
+            return True
+
+    def request_refresh(self):
+        """Разбудить фоновый поток для немедленной проверки сессии"""
+        self._wakeup.set()
+
+    def _refresh_loop(self):
+        while self.running:
+            self._wakeup.wait(self.check_interval)
+            self._wakeup.clear()
+            if not self.running:
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing FunPay session: {str(e)}")
+                # Не долбим FunPay, пока он недоступен
+                self._wakeup.wait(60)
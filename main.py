@@ -2,7 +2,8 @@ from botHandler.bot import main
 from funpayHandler.funpay import startFunpay
 from config import BOT_TOKEN, FUNPAY_GOLDEN_KEY, ADMIN_ID
 from logger import logger
-from messaging.message_sender import is_message_sender_ready
+from databaseHandler.activity_journal import flush_activity_journals
+from messaging.message_sender import is_message_sender_ready, shutdown_message_sender
 from bot_instance_manager import BotInstanceManager, check_bot_instance, force_cleanup_bot
 
 import threading
@@ -195,6 +196,18 @@ def main_loop():
         except Exception as e:
             logger.error(f"Error releasing lock: {str(e)}")
         
+        try:
+            # Досылаем сообщения, оставшиеся в очереди
+            shutdown_message_sender()
+        except Exception as e:
+            logger.error(f"Error draining message queue: {str(e)}")
+        
+        try:
+            # Дописываем отложенную аналитику до выхода
+            flush_activity_journals()
+        except Exception as e:
+            logger.error(f"Error flushing activity journal: {str(e)}")
+        
         try:
             logger.bot_stop()
             logger.funpay_stop()
@@ -4,7 +4,11 @@
 Решает проблему циклических импортов
 """
 
+import time
+from concurrent.futures import Future
+
 from logger import logger
+from messaging.outbound_queue import OutboundQueue, OUTBOUND_FLOOD_DELAY
 
 
 class MessageSender:
@@ -13,6 +17,7 @@ class MessageSender:
     def __init__(self):
         self.acc = None
         self._initialized = False
+        self.queue = OutboundQueue(flood_check=self._flooded_recently)
     
     def initialize(self, account):
         """Инициализация с аккаунтом FunPay"""
@@ -20,33 +25,58 @@ class MessageSender:
         self._initialized = True
         logger.debug("MessageSender initialized")
     
-    def send_message_by_owner(self, owner, message):
-        """Send a message to the specified owner."""
+    def send_message_by_owner(self, owner, message, callback=None, chat_id=None) -> Future:
+        """
+        Поставить сообщение владельцу в очередь отправки и сразу вернуть Future.
+        Future получает True после доставки или False при ошибке; callback(bool),
+        если передан, вызывается из рабочего потока очереди. chat_id (например,
+        OrderShortcut.chat_id вида users-{id1}-{id2}) используется, если чата
+        владельца еще нет в списке сохраненных - без дополнительного запроса чатов
+        """
         if not self._initialized or not self.acc:
             logger.error("MessageSender not initialized")
-            return False
-        
-        try:
-            chat = self.acc.get_chat_by_name(owner, True)
-            self.acc.send_message(chat.id, message)
-            logger.debug(f"Message sent to {owner}")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to send message to {owner}: {str(e)}")
-            return False
+            future = Future()
+            future.set_result(False)
+        else:
+            acc = self.acc
+
+            def send():
+                chat = acc.get_chat_by_name(owner, chat_id is None)
+                if chat is not None:
+                    acc.send_message(chat.id, message, owner)
+                elif chat_id is not None:
+                    acc.send_message(chat_id, message, owner)
+                else:
+                    raise LookupError(f"Chat with {owner} not found")
+                logger.debug(f"Message sent to {owner}")
+
+            future = self.queue.submit(owner, send)
+        if callback is not None:
+            future.add_done_callback(lambda done: callback(done.result()))
+        return future
     
+    def _flooded_recently(self, error: Exception) -> bool:
+        """Ошибка доставки сразу после того, как аккаунт получил флуд-лимит"""
+        if self.acc is None or getattr(error, "chat_id", None) is None:
+            return False
+        return time.time() - self.acc.last_flood_err_time < OUTBOUND_FLOOD_DELAY
+
     def is_initialized(self):
         """Проверка инициализации"""
         return self._initialized and self.acc is not None
+    
+    def shutdown(self, timeout: float = 10.0) -> bool:
+        """Дождаться отправки очереди при завершении работы"""
+        return self.queue.stop(timeout)
 
 
 # Глобальный экземпляр отправителя сообщений
 message_sender = MessageSender()
 
 
-def send_message_by_owner(owner, message):
-    """Функция-обертка для отправки сообщений"""
-    return message_sender.send_message_by_owner(owner, message)
+def send_message_by_owner(owner, message, callback=None, chat_id=None) -> Future:
+    """Функция-обертка для отправки сообщений (не блокирует, возвращает Future)"""
+    return message_sender.send_message_by_owner(owner, message, callback, chat_id)
 
 
 def initialize_message_sender(account):
@@ -57,3 +87,13 @@ def initialize_message_sender(account):
 def is_message_sender_ready():
     """Проверка готовности отправителя сообщений"""
     return message_sender.is_initialized()
+
+
+def shutdown_message_sender(timeout: float = 10.0) -> bool:
+    """Отправить оставшиеся сообщения и остановить очередь"""
+    return message_sender.shutdown(timeout)
+
+
+def get_message_queue_stats() -> dict:
+    """Статистика очереди исходящих сообщений"""
+    return message_sender.queue.get_statistics()
@@ -0,0 +1,283 @@
+"""
+Очередь исходящих сообщений FunPay
+Отправка выполняется пулом рабочих потоков: сообщения одному получателю уходят
+строго по очереди, разным получателям - параллельно. При 429 и ошибках установки
+соединения отправка повторяется с экспоненциальной задержкой; таймаут чтения и 5xx
+на POST runner/ не повторяются - FunPay мог уже принять сообщение. Флуд-лимит FunPay ("Нельзя
+отправлять сообщения слишком часто.") приостанавливает все потоки до конца паузы.
+Вызывающий поток получает Future и не ждет сети
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Optional
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from FunPayAPI.account import FLOOD_ERROR_MESSAGES
+from logger import logger
+
+OUTBOUND_WORKERS = 4  # Сколько получателей обслуживается одновременно
+OUTBOUND_MAX_ATTEMPTS = 5  # Попыток отправки одного сообщения
+OUTBOUND_RETRY_DELAY = 1.0  # Задержка перед первым повтором (сек), далее удваивается
+OUTBOUND_RETRY_MAX_DELAY = 30.0  # Верхняя граница задержки между повторами (сек)
+OUTBOUND_FLOOD_DELAY = 5.0  # Пауза всей очереди после флуд-лимита (сек), далее удваивается
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """HTTP-статус из исключения FunPayAPI/requests, если он есть"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_flood_error(error: Exception) -> bool:
+    """Флуд-лимит FunPay: MessageNotDeliveredError с HTTP 200 и текстом о слишком частой отправке"""
+    return getattr(error, "error_message", None) in FLOOD_ERROR_MESSAGES
+
+
+def _is_connect_error(error: Exception) -> bool:
+    """Соединение не установлено - запрос точно не дошел до FunPay"""
+    if isinstance(error, (requests.ConnectTimeout, ConnectionRefusedError)):
+        return True
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # requests оборачивает MaxRetryError, причина которого - ошибка установки соединения
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+def _is_idempotent(error: Exception) -> bool:
+    """Упал идемпотентный запрос (например, GET списка чатов перед отправкой)"""
+    request = getattr(error, "request", None)
+    if request is None:
+        request = getattr(getattr(error, "response", None), "request", None)
+    return getattr(request, "method", None) in ("GET", "HEAD", "OPTIONS")
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Стоит ли повторять отправку: флуд-лимит, 429 или ошибка установки соединения.
+    Таймаут чтения, обрыв и 5xx повторяются только для идемпотентных запросов: POST
+    runner/ мог быть принят, и повтор продублировал бы сообщение покупателю
+    """
+    if is_flood_error(error) or _is_connect_error(error):
+        return True
+    status = _status_code(error)
+    if status == 429:
+        return True
+    if _is_idempotent(error):
+        return isinstance(error, OSError) or (status is not None and status >= 500)
+    return False
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _OutboundMessage:
+    __slots__ = ("send", "future", "description", "enqueued_at", "attempts")
+
+    def __init__(self, send: Callable[[], None], future: Future, description: str):
+        self.send = send
+        self.future = future
+        self.description = description
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class OutboundQueue:
+    """Очереди сообщений по получателям и пул потоков, который их разбирает"""
+
+    def __init__(self, workers: int = OUTBOUND_WORKERS, max_attempts: int = OUTBOUND_MAX_ATTEMPTS,
+                 retry_delay: float = OUTBOUND_RETRY_DELAY, retry_max_delay: float = OUTBOUND_RETRY_MAX_DELAY,
+                 flood_delay: float = OUTBOUND_FLOOD_DELAY,
+                 flood_check: Optional[Callable[[Exception], bool]] = None):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.flood_delay = flood_delay
+        # Дополнительная проверка флуд-лимита (например, по Account.last_flood_err_time)
+        self.flood_check = flood_check
+        # ключ получателя -> сообщения в порядке постановки
+        self._pending: Dict[str, Deque[_OutboundMessage]] = {}
+        # Получатели с сообщениями, которых сейчас не обслуживает ни один поток
+        self._ready: Deque[str] = deque()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._busy = 0
+        # time.monotonic(), до которого ни один поток не отправляет сообщения (флуд-лимит)
+        self._paused_until = 0.0
+        self.running = False
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.flood_pauses = 0
+        self.max_depth = 0
+        self._total_latency = 0.0
+
+    def submit(self, key: str, send: Callable[[], None], description: str = "") -> Future:
+        """
+        Поставить отправку в очередь получателя key. send вызывается в рабочем потоке;
+        Future получает True после успешной отправки или False, если все попытки исчерпаны
+        """
+        future = Future()
+        message = _OutboundMessage(send, future, description or key)
+        with self._condition:
+            if not self.running:
+                self._start()
+            queue = self._pending.get(key)
+            if queue is None:
+                # Очередь получателя пуста и не занята потоком - он становится готовым
+                queue = self._pending[key] = deque()
+                self._ready.append(key)
+                self._condition.notify()
+            queue.append(message)
+            self.max_depth = max(self.max_depth, self._depth())
+        return future
+
+    def depth(self) -> int:
+        """Число сообщений, ожидающих отправки (включая отправляемые сейчас)"""
+        with self._condition:
+            return self._depth()
+
+    def _depth(self) -> int:
+        return sum(len(queue) for queue in self._pending.values())
+
+    def _start(self):
+        self.running = True
+        self._threads = []
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, daemon=True, name=f"OutboundQueue-{index}")
+            thread.start()
+            self._threads.append(thread)
+        logger.debug("Outbound message queue started", extra_info=f"Workers: {self.workers}")
+
+    def stop(self, timeout: float = 10.0) -> bool:
+        """Дождаться отправки очереди (не дольше timeout) и остановить потоки"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while (self._pending or self._busy) and self.running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            drained = not self._pending
+            if not drained:
+                logger.warning(f"Outbound queue stopped with {self._depth()} unsent messages")
+            self.running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1)
+        self._threads = []
+        return drained
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self.running and not self._ready:
+                    self._condition.wait()
+                if not self.running:
+                    return
+                key = self._ready.popleft()
+                message = self._pending[key][0]
+                self._busy += 1
+
+            delivered = self._deliver(message)
+
+            with self._condition:
+                self._busy -= 1
+                queue = self._pending[key]
+                queue.popleft()
+                if queue:
+                    # В конец очереди готовых, чтобы один получатель не занимал поток
+                    self._ready.append(key)
+                    self._condition.notify()
+                else:
+                    del self._pending[key]
+                if delivered:
+                    self.sent += 1
+                    self._total_latency += time.monotonic() - message.enqueued_at
+                else:
+                    self.failed += 1
+                self._condition.notify_all()
+            message.future.set_result(delivered)
+
+    def _is_flood(self, error: Exception) -> bool:
+        return is_flood_error(error) or (self.flood_check is not None and self.flood_check(error))
+
+    def _pause(self, delay: float):
+        """Приостановить отправку во всех потоках на delay секунд"""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.flood_pauses += 1
+
+    def _wait_pause(self):
+        with self._condition:
+            while self.running:
+                remaining = self._paused_until - time.monotonic()
+                if remaining <= 0:
+                    return
+                self._condition.wait(remaining)
+
+    def _deliver(self, message: _OutboundMessage) -> bool:
+        while True:
+            self._wait_pause()
+            message.attempts += 1
+            try:
+                message.send()
+                return True
+            except Exception as e:
+                flood = self._is_flood(e)
+                if message.attempts >= self.max_attempts or not (flood or is_retryable(e)) or not self.running:
+                    logger.error(f"Failed to send message to {message.description} "
+                                 f"after {message.attempts} attempt(s): {str(e)}")
+                    return False
+                if flood:
+                    delay = min(self.flood_delay * 2 ** (message.attempts - 1), self.retry_max_delay)
+                    with self._condition:
+                        self.retried += 1
+                    self._pause(delay)
+                    logger.warning(f"FunPay flood limit, pausing outbound queue for {delay:.1f}s "
+                                   f"(message to {message.description}, "
+                                   f"attempt {message.attempts}/{self.max_attempts})")
+                    continue
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = self.retry_delay * 2 ** (message.attempts - 1)
+                    delay += random.uniform(0, delay / 2)
+                delay = min(delay, self.retry_max_delay)
+                with self._condition:
+                    self.retried += 1
+                logger.warning(f"Retrying message to {message.description} in {delay:.1f}s "
+                               f"(attempt {message.attempts}/{self.max_attempts}): {str(e)}")
+                time.sleep(delay)
+
+    def get_statistics(self) -> dict:
+        with self._condition:
+            return {
+                "running": self.running,
+                "workers": self.workers,
+                "depth": self._depth(),
+                "max_depth": self.max_depth,
+                "recipients": len(self._pending),
+                "in_flight": self._busy,
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "flood_pauses": self.flood_pauses,
+                "paused_for": round(max(self._paused_until - time.monotonic(), 0.0), 1),
+                "avg_latency_ms": round(self._total_latency * 1000 / self.sent, 2) if self.sent else 0.0,
+            }
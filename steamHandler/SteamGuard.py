@@ -3,8 +3,8 @@ import time
 import hmac
 import json
 import struct
+import threading
 import base64
-import requests
 from hashlib import sha1
 import argparse
 
@@ -15,39 +15,44 @@ except ImportError:
     import logging
     logger = logging.getLogger(__name__)
 
+try:
+    from steamHandler.steam_time import steam_time
+    from steamHandler.mafile_store import mafile_store
+except ImportError:
+    from steam_time import steam_time
+    from mafile_store import mafile_store
+
 
 def getQueryTime():
     """Получает разность времени между сервером Steam и локальным временем"""
+    return steam_time.offset
+
+
+GUARD_CODE_PERIOD = 30  # Время жизни Steam Guard кода (сек)
+GUARD_CODE_NEXT_THRESHOLD = 5  # За сколько секунд до смены кода показывать следующий
+
+
+def getGuardCode(shared_secret, time_window=None):
+    """Генерирует Steam Guard код для текущего (или указанного) 30-секундного интервала"""
     try:
-        request = requests.post(
-            "https://api.steampowered.com/ITwoFactorService/QueryTime/v0001", 
-            timeout=30
-        )
-        json_data = request.json()
-        server_time = int(json_data["response"]["server_time"]) - time.time()
-        logger.debug(f"Steam server time offset: {server_time} seconds")
-        return server_time
+        # Декодируем shared_secret
+        secret_bytes = base64.b64decode(shared_secret)
     except Exception as e:
-        logger.warning(f"Failed to get Steam server time: {str(e)}")
-        return 0
+        logger.error(f"Error generating Steam Guard code: {str(e)}")
+        return None
+    return guard_code_from_secret(secret_bytes, time_window)
 
 
-def getGuardCode(shared_secret):
-    """Генерирует Steam Guard код с улучшенной синхронизацией времени"""
+def guard_code_from_secret(secret_bytes, time_window=None):
+    """Генерирует Steam Guard код по уже декодированному shared_secret"""
     symbols = "23456789BCDFGHJKMNPQRTVWXY"
     code = ""
     
-    # Получаем синхронизированное время
-    server_offset = getQueryTime()
-    timestamp = time.time() + server_offset
-    
-    # Используем временной интервал 30 секунд
-    time_window = int(timestamp / 30)
+    if time_window is None:
+        # Получаем синхронизированное время (смещение обновляется в фоне)
+        time_window = int(steam_time.now() / GUARD_CODE_PERIOD)
     
     try:
-        # Декодируем shared_secret
-        secret_bytes = base64.b64decode(shared_secret)
-        
         # Создаем HMAC
         _hmac = hmac.new(
             secret_bytes, 
@@ -72,36 +77,151 @@ def getGuardCode(shared_secret):
         return None
 
 
+def load_secrets(mafile_paths):
+    """
+    Загружает shared_secret для пакетной генерации: [(путь к .maFile, secret_bytes), ...].
+    Файлы, из которых не удалось получить shared_secret, пропускаются
+    """
+    secrets = []
+    for mafile_path in mafile_paths:
+        try:
+            record = mafile_store.get(mafile_path)
+        except Exception as e:
+            logger.error(f"Error loading .maFile {mafile_path}: {str(e)}")
+            continue
+        if record.shared_secret_bytes is None:
+            logger.error(f"Missing shared_secret in .maFile {mafile_path}")
+            continue
+        secrets.append((mafile_path, record.shared_secret_bytes))
+    return secrets
+
+
+def generate_codes(accounts, window=None):
+    """
+    Генерирует коды для всех аккаунтов за один проход.
+    accounts - пары (ключ, secret_bytes), например из load_secrets();
+    window - 30-секундный интервал (по умолчанию текущий, смещение времени берется один раз).
+    Возвращает {ключ: код}
+    """
+    if window is None:
+        window = int(steam_time.now() / GUARD_CODE_PERIOD)
+
+    symbols = "23456789BCDFGHJKMNPQRTVWXY"
+    message = struct.pack(">Q", window)
+    hmac_digest = hmac.digest
+    unpack_from = struct.unpack_from
+
+    codes = {}
+    for key, secret_bytes in accounts:
+        digest = hmac_digest(secret_bytes, message, "sha1")
+        value = unpack_from(">I", digest, digest[19] & 0xF)[0] & 0x7FFFFFFF
+        code = ""
+        for _ in range(5):
+            value, index = divmod(value, 26)
+            code += symbols[index]
+        codes[key] = code
+    return codes
+
+
+class GuardCodeCache:
+    """
+    Кэш Steam Guard кодов по ключу (путь к .maFile, 30-секундный интервал).
+    Вместе с текущим кодом сразу вычисляется код следующего интервала
+    """
+
+    def __init__(self):
+        self._codes = {}
+        self._lock = threading.Lock()
+        self._window = None
+
+    def get(self, mafile_path, time_window):
+        return self._codes.get((mafile_path, time_window))
+
+    def put(self, mafile_path, time_window, code, next_code):
+        with self._lock:
+            if self._window is None or time_window > self._window:
+                # Начался новый интервал - коды прошлых интервалов больше не нужны
+                self._window = time_window
+                self._codes = {key: value for key, value in self._codes.items() if key[1] >= time_window}
+            self._codes[(mafile_path, time_window)] = code
+            self._codes[(mafile_path, time_window + 1)] = next_code
+
+    def invalidate(self, mafile_path):
+        with self._lock:
+            self._codes = {key: value for key, value in self._codes.items() if key[0] != mafile_path}
+
+    def __len__(self):
+        return len(self._codes)
+
+
+guard_code_cache = GuardCodeCache()
+
+
+def invalidate_guard_code(mafile_path):
+    """Сбрасывает закэшированные коды и запись .maFile после его замены"""
+    guard_code_cache.invalidate(mafile_path)
+    mafile_store.invalidate(mafile_path)
+
+
+def get_steam_guard_codes(mafile_path):
+    """
+    Возвращает (текущий код, код следующего интервала, секунд до смены кода).
+    Коды берутся из кэша; .maFile читается только при промахе
+    """
+    timestamp = steam_time.now()
+    time_window = int(timestamp / GUARD_CODE_PERIOD)
+    seconds_left = GUARD_CODE_PERIOD - timestamp % GUARD_CODE_PERIOD
+
+    code = guard_code_cache.get(mafile_path, time_window)
+    next_code = guard_code_cache.get(mafile_path, time_window + 1)
+    if code is None or next_code is None:
+        code, next_code = _generate_guard_codes(mafile_path, time_window)
+        if code is None:
+            return None, None, seconds_left
+    return code, next_code, seconds_left
+
+
+def format_code_validity(next_code, seconds_left):
+    """Строка о сроке действия кода; за GUARD_CODE_NEXT_THRESHOLD сек. до смены показывает следующий код"""
+    if seconds_left < GUARD_CODE_NEXT_THRESHOLD:
+        return f"⏰ Код сменится через {int(seconds_left) + 1} сек., следующий: `{next_code}`"
+    return f"⏰ Код действителен еще {int(seconds_left)} сек."
+
+
 def get_steam_guard_code(mafile_path):
     """Получает Steam Guard код из .maFile с улучшенной обработкой ошибок"""
+    return get_steam_guard_codes(mafile_path)[0]
+
+
+def _generate_guard_codes(mafile_path, time_window):
+    """Берет shared_secret из MaFileStore и кэширует коды текущего и следующего интервалов"""
     try:
-        with open(mafile_path, "r", encoding='utf-8') as file:
-            data = json.loads(file.read())
+        record = mafile_store.get(mafile_path)
             
         # Проверяем наличие необходимых данных
-        if "shared_secret" not in data:
+        if record.shared_secret_bytes is None:
             logger.error("Missing shared_secret in .maFile")
-            return None
+            return None, None
             
-        # Генерируем код
-        code = getGuardCode(data["shared_secret"])
+        # Генерируем коды
+        code = guard_code_from_secret(record.shared_secret_bytes, time_window)
+        next_code = guard_code_from_secret(record.shared_secret_bytes, time_window + 1)
         
         if code is None:
             logger.error("Failed to generate Steam Guard code")
-            return None
+            return None, None
+        
+        guard_code_cache.put(mafile_path, time_window, code, next_code)
             
-        logger.info(f"Successfully generated Steam Guard code for {data.get('account_name', 'unknown')}")
-        return code
+        logger.info(f"Successfully generated Steam Guard code for {record.account_name or 'unknown'}")
+        return code, next_code
 
     except FileNotFoundError:
         logger.error(f"Steam Guard file not found: {mafile_path}")
-        return None
+        return None, None
     except json.JSONDecodeError as e:
         logger.error(f"Invalid .maFile format: {str(e)}")
-        return None
-    except KeyError as e:
-        logger.error(f"Missing required data in .maFile: {str(e)}")
-        return None
+        return None, None
     except Exception as e:
         logger.error(f"Unexpected error getting Steam Guard code: {str(e)}")
-        return None
+        return None, None
@@ -5,9 +5,10 @@
 """
 
 import time
+import heapq
+import random
 import threading
 import asyncio
-import sqlite3
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import json
@@ -22,7 +23,9 @@ from config import (
     AUTO_GUARD_LOG_LEVEL,
     ADMIN_ID
 )
-from steamHandler.SteamGuard import get_steam_guard_code
+from steamHandler.SteamGuard import get_steam_guard_code, generate_codes, load_secrets
+from databaseHandler.rental_scheduler import rental_scheduler
+from databaseHandler.connection import get_connection
 from logger import logger
 from messaging.message_sender import send_message_by_owner
 
@@ -39,13 +42,22 @@ class AutoGuardManager:
         self.notify_admin = AUTO_GUARD_NOTIFY_ADMIN
         self.log_level = AUTO_GUARD_LOG_LEVEL
         
-        # Активные задачи отправки кодов
-        self.active_tasks: Dict[str, Dict] = {}
+        # Состояние отправки кодов по активным арендам (account_id -> данные задачи)
+        self.active_tasks: Dict[int, Dict] = {}
+        
+        # Очередь (время отправки, account_id) и актуальные время отправки / конец аренды
+        self._queue: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+        self._deadlines: Dict[int, float] = {}
+        self._condition = threading.Condition()
         
         # Поток для периодической отправки кодов
         self.scheduler_thread = None
         self.running = False
         
+        # Начало и конец аренд приходят из планировщика истечения аренд
+        rental_scheduler.add_listener(self)
+        
         logger.info("AutoGuardManager initialized", extra_info=f"Enabled: {self.enabled}, OnPurchase: {self.on_purchase}")
         logger.autoguard_start()
     
@@ -67,51 +79,122 @@ class AutoGuardManager:
     
     def stop_scheduler(self):
         """Остановить планировщик"""
-        self.running = False
+        with self._condition:
+            self.running = False
+            self._condition.notify()
         if self.scheduler_thread:
             self.scheduler_thread.join(timeout=5)
         logger.info("AutoGuard scheduler stopped")
         logger.guard_scheduler_stop()
     
+    def rentals_loaded(self, deadlines: Dict[int, float]):
+        """Активные аренды при запуске: первые отправки равномерно распределяются по интервалу"""
+        now = time.time()
+        with self._condition:
+            for account_id, deadline in deadlines.items():
+                self._deadlines[account_id] = deadline
+                if account_id not in self._due:
+                    self._push(account_id, now + random.uniform(0, self.interval))
+            self._condition.notify()
+    
+    def rental_scheduled(self, account_id: int, deadline: float):
+        """Аренда началась или продлена"""
+        with self._condition:
+            self._deadlines[account_id] = deadline
+            if account_id not in self._due:
+                # Код при покупке уже отправлен приветствием - следующий через интервал
+                self._push(account_id, time.time() + self.interval)
+                self._condition.notify()
+    
+    def rental_cancelled(self, account_id: int):
+        """Аренда закончилась - запись в очереди станет устаревшей"""
+        with self._condition:
+            self._deadlines.pop(account_id, None)
+            self._due.pop(account_id, None)
+            self.active_tasks.pop(account_id, None)
+    
+    def _push(self, account_id: int, due: float):
+        self._due[account_id] = due
+        heapq.heappush(self._queue, (due, account_id))
+        # Перестраиваем кучу, если устаревших записей стало больше живых
+        if len(self._queue) > 2 * len(self._due) + 64:
+            self._queue = [(d, a) for a, d in self._due.items()]
+            heapq.heapify(self._queue)
+    
+    def _pop_due(self) -> List[int]:
+        """Дождаться ближайшей отправки и забрать все наступившие (вызывается под _condition)"""
+        while self.running:
+            while self._queue and self._due.get(self._queue[0][1]) != self._queue[0][0]:
+                heapq.heappop(self._queue)
+            if not self._queue:
+                self._condition.wait()
+                continue
+            delay = self._queue[0][0] - time.time()
+            if delay > 0:
+                self._condition.wait(delay)
+                continue
+            
+            now = time.time()
+            due_ids = []
+            while self._queue and self._queue[0][0] <= now:
+                due, account_id = heapq.heappop(self._queue)
+                if self._due.get(account_id) != due:
+                    continue
+                due_ids.append(account_id)
+                # Следующая отправка через интервал, если аренда к тому времени не закончится
+                next_due = due + self.interval
+                if next_due < self._deadlines.get(account_id, 0):
+                    self._push(account_id, next_due)
+                else:
+                    del self._due[account_id]
+            return due_ids
+        return []
+    
     def _scheduler_loop(self):
         """Основной цикл планировщика"""
         while self.running:
+            with self._condition:
+                due_ids = self._pop_due()
+            if not due_ids:
+                continue
             try:
-                self._process_all_active_rentals()
-                time.sleep(self.interval)
+                self._process_due_rentals(due_ids)
             except Exception as e:
                 logger.error(f"Error in AutoGuard scheduler: {str(e)}")
-                time.sleep(60)  # Ждем минуту при ошибке
     
-    def _process_all_active_rentals(self):
-        """Обработать все активные аренды"""
+    def _process_due_rentals(self, account_ids: List[int]):
+        """Отправить коды арендам, у которых наступило время отправки"""
         try:
-            conn = sqlite3.connect("database.db")
+            conn = get_connection()
             cursor = conn.cursor()
             
-            # Получаем все активные аренды
-            cursor.execute("""
-                SELECT id, account_name, login, password, rental_duration, rental_start, owner, path_to_maFile
+            placeholders = ",".join("?" * len(account_ids))
+            cursor.execute(f"""
+                SELECT id, account_name, rental_duration, rental_start, owner, path_to_maFile
                 FROM accounts 
-                WHERE owner IS NOT NULL AND rental_start IS NOT NULL
-            """)
-            
-            active_rentals = cursor.fetchall()
+                WHERE id IN ({placeholders}) AND owner IS NOT NULL AND rental_start IS NOT NULL
+            """, account_ids)
             
-            for rental in active_rentals:
-                account_id, account_name, login, password, rental_duration, rental_start, owner, mafile_path = rental
-                
+            due_rentals = []
+            for account_id, account_name, rental_duration, rental_start, owner, mafile_path in cursor.fetchall():
                 # Проверяем, не истекла ли аренда
                 if self._is_rental_expired(rental_start, rental_duration):
                     continue
-                
-                # Отправляем код если нужно
-                self._send_guard_code_if_needed(account_id, account_name, owner, mafile_path)
+                due_rentals.append((account_id, account_name, owner, mafile_path))
+            
+            cursor.close()
+            
+            if not due_rentals:
+                return
+            
+            # Все коды текущего интервала генерируются за один проход
+            codes = generate_codes(load_secrets({rental[3] for rental in due_rentals}))
             
-            conn.close()
+            for account_id, account_name, owner, mafile_path in due_rentals:
+                self._send_guard_code(account_id, account_name, owner, codes.get(mafile_path))
             
         except Exception as e:
-            logger.error(f"Error processing active rentals: {str(e)}")
+            logger.error(f"Error processing due rentals: {str(e)}")
     
     def _is_rental_expired(self, rental_start: str, rental_duration: int) -> bool:
         """Проверить, истекла ли аренда"""
@@ -123,19 +206,9 @@ class AutoGuardManager:
             logger.error(f"Error checking rental expiration: {str(e)}")
             return True
     
-    def _send_guard_code_if_needed(self, account_id: int, account_name: str, owner: str, mafile_path: str):
-        """Отправить Steam Guard код если нужно"""
+    def _send_guard_code(self, account_id: int, account_name: str, owner: str, guard_code: Optional[str]):
+        """Отправить заранее сгенерированный Steam Guard код"""
         try:
-            # Проверяем, не отправляли ли мы код недавно
-            task_key = f"{account_id}_{owner}"
-            if task_key in self.active_tasks:
-                last_sent = self.active_tasks[task_key].get('last_sent', 0)
-                if time.time() - last_sent < self.interval:
-                    return  # Слишком рано для повторной отправки
-            
-            # Получаем код
-            guard_code = self._get_guard_code_with_retry(mafile_path, account_name)
-            
             if guard_code:
                 # Отправляем код
                 message = (
@@ -152,23 +225,12 @@ class AutoGuardManager:
                     logger.warning("Message sender not ready, skipping guard code send")
                     return
                 
-                success = send_message_by_owner(owner, message)
-                
-                if success:
-                    # Обновляем информацию о задаче
-                    self.active_tasks[task_key] = {
-                        'last_sent': time.time(),
-                        'account_name': account_name,
-                        'owner': owner,
-                        'success_count': self.active_tasks.get(task_key, {}).get('success_count', 0) + 1
-                    }
-                    
-                    logger.info(f"AutoGuard code sent to {owner} for {account_name}", 
-                               extra_info=f"Code: {guard_code}")
-                    logger.guard_code_sent(account_name, owner, guard_code)
-                else:
-                    logger.warning(f"Failed to send AutoGuard code to {owner} for {account_name}")
-                    logger.guard_code_error(account_name, owner, "Failed to send message")
+                send_message_by_owner(
+                    owner, message,
+                    callback=lambda delivered: self._on_guard_code_delivered(
+                        delivered, account_id, account_name, owner, guard_code
+                    )
+                )
                 
             else:
                 # Не удалось получить код
@@ -179,6 +241,26 @@ class AutoGuardManager:
             logger.error(f"Error sending guard code to {owner} for {account_name}: {str(e)}")
             self._handle_guard_code_error(account_id, account_name, owner, str(e))
     
+    def _on_guard_code_delivered(self, delivered: bool, account_id: int, account_name: str,
+                                 owner: str, guard_code: str):
+        """Учесть результат отправки кода (вызывается из очереди сообщений)"""
+        if delivered:
+            # Обновляем информацию о задаче
+            task = self.active_tasks.get(account_id, {})
+            self.active_tasks[account_id] = {
+                'last_sent': time.time(),
+                'account_name': account_name,
+                'owner': owner,
+                'success_count': task.get('success_count', 0) + 1 if task.get('owner') == owner else 1
+            }
+            
+            logger.info(f"AutoGuard code sent to {owner} for {account_name}", 
+                       extra_info=f"Code: {guard_code}")
+            logger.guard_code_sent(account_name, owner, guard_code)
+        else:
+            logger.warning(f"Failed to send AutoGuard code to {owner} for {account_name}")
+            logger.guard_code_error(account_name, owner, "Failed to send message")
+    
     def _get_guard_code_with_retry(self, mafile_path: str, account_name: str) -> Optional[str]:
         """Получить Steam Guard код с повторными попытками"""
         for attempt in range(self.max_attempts):
@@ -200,11 +282,11 @@ class AutoGuardManager:
     
     def _handle_guard_code_error(self, account_id: int, account_name: str, owner: str, error: str):
         """Обработать ошибку получения кода"""
-        task_key = f"{account_id}_{owner}"
+        task_key = account_id
         
         # Увеличиваем счетчик ошибок
         if task_key not in self.active_tasks:
-            self.active_tasks[task_key] = {'error_count': 0}
+            self.active_tasks[task_key] = {'error_count': 0, 'account_name': account_name, 'owner': owner}
         
         self.active_tasks[task_key]['error_count'] = self.active_tasks[task_key].get('error_count', 0) + 1
         
@@ -253,16 +335,17 @@ class AutoGuardManager:
                     logger.warning("Message sender not ready, skipping welcome guard code send")
                     return False
                 
-                success = send_message_by_owner(owner, message)
+                def on_delivered(delivered: bool):
+                    if delivered:
+                        logger.info(f"Welcome guard code sent to {owner} for {account_name}", 
+                                   extra_info=f"Code: {guard_code}")
+                        logger.guard_welcome_sent(account_name, owner, guard_code)
+                    else:
+                        logger.warning(f"Failed to send welcome guard code to {owner} for {account_name}")
                 
-                if success:
-                    logger.info(f"Welcome guard code sent to {owner} for {account_name}", 
-                               extra_info=f"Code: {guard_code}")
-                    logger.guard_welcome_sent(account_name, owner, guard_code)
-                    return True
-                else:
-                    logger.warning(f"Failed to send welcome guard code to {owner} for {account_name}")
-                    return False
+                # Код поставлен в очередь отправки; результат доставки логируется в on_delivered
+                send_message_by_owner(owner, message, callback=on_delivered)
+                return True
             else:
                 self._handle_guard_code_error(account_id, account_name, owner, "Failed to generate welcome code")
                 return False
@@ -283,6 +366,7 @@ class AutoGuardManager:
             'on_purchase': self.on_purchase,
             'interval': self.interval,
             'running': self.running,
+            'scheduled_rentals': len(self._due),
             'total_tasks': total_tasks,
             'successful_tasks': successful_tasks,
             'error_tasks': error_tasks,
@@ -327,7 +411,7 @@ def stop_auto_guard():
 
 
 def send_welcome_guard_code(account_id: int, account_name: str, owner: str, mafile_path: str) -> bool:
-    """Отправить приветственный Steam Guard код при покупке"""
+    """Поставить приветственный Steam Guard код в очередь отправки при покупке"""
     return auto_guard_manager.send_guard_code_on_purchase(account_id, account_name, owner, mafile_path)
 
 
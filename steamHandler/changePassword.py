@@ -10,6 +10,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from logger import logger
+from steamHandler.mafile_store import mafile_store
 from steampassword.chpassword import SteamPasswordChange
 from steampassword.steam import CustomSteam
 
@@ -34,35 +35,32 @@ def generate_password(length: int = 12) -> str:
     return password
 
 
-async def changeSteamPassword(path_to_maFile: str, password: str) -> str:
-    """Смена пароля Steam аккаунта с улучшенной обработкой ошибок"""
+async def changeSteamPassword(path_to_maFile: str, password: str, new_password: str = None) -> str:
+    """
+    Смена пароля Steam аккаунта с улучшенной обработкой ошибок.
+    new_password передается, если он заранее сохранен (очередь rotation_jobs), иначе генерируется
+    """
     logger.info("Started changing password")
 
     try:
-        with open(path_to_maFile, "r", encoding='utf-8') as f:
-            data = json.load(f)
-            logger.info(f"Started changing password for {data['account_name']}")
-            
-        # Проверяем наличие всех необходимых данных
-        required_fields = ["account_name", "shared_secret", "identity_secret", "device_id", "Session"]
-        for field in required_fields:
-            if field not in data:
-                raise ValueError(f"Missing required field in .maFile: {field}")
-                
-        if "SteamID" not in data["Session"]:
-            raise ValueError("Missing SteamID in Session data")
+        # Файл уже разобран и проверен хранилищем .maFile
+        record = mafile_store.get(path_to_maFile)
+        if not record.valid:
+            raise ValueError(f"Invalid .maFile: {record.error}")
+        logger.info(f"Started changing password for {record.account_name}")
             
         steam = CustomSteam(
-            login=data["account_name"],
+            login=record.account_name,
             password=password,
-            shared_secret=data["shared_secret"],
-            identity_secret=data["identity_secret"],
-            device_id=data["device_id"],
-            steamid=int(data["Session"]["SteamID"]),
+            shared_secret=record.shared_secret,
+            identity_secret=record.identity_secret,
+            device_id=record.device_id,
+            steamid=record.steamid,
         )
 
-        new_password = generate_password(12)
-        logger.info(f"Generated new password for {data['account_name']}")
+        if new_password is None:
+            new_password = generate_password(12)
+            logger.info(f"Generated new password for {record.account_name}")
 
         # Пытаемся сменить пароль с повторными попытками
         max_attempts = 3
@@ -70,7 +68,7 @@ async def changeSteamPassword(path_to_maFile: str, password: str) -> str:
             try:
                 logger.info(f"Password change attempt {attempt + 1}/{max_attempts}")
                 await SteamPasswordChange(steam).change(new_password)
-                logger.info(f"✅ {data['account_name']} password changed successfully -> {new_password}")
+                logger.info(f"✅ {record.account_name} password changed successfully -> {new_password}")
                 return new_password
                 
             except Exception as e:
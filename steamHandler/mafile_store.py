@@ -0,0 +1,135 @@
+"""
+Хранилище разобранных .maFile
+Каждый файл читается и проверяется один раз; запись обновляется,
+только если у файла изменились mtime, inode или размер
+"""
+
+import base64
+import binascii
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+try:
+    from logger import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+MAFILE_REQUIRED_FIELDS = ["account_name", "shared_secret", "identity_secret", "device_id", "Session"]
+
+
+@dataclass(frozen=True)
+class MaFileRecord:
+    """Компактная запись .maFile (error = None, если все обязательные поля на месте)"""
+    path: str
+    account_name: Optional[str]
+    shared_secret: Optional[str]
+    shared_secret_bytes: Optional[bytes]
+    identity_secret: Optional[str]
+    device_id: Optional[str]
+    steamid: Optional[int]
+    error: Optional[str] = None
+
+    @property
+    def valid(self) -> bool:
+        return self.error is None
+
+
+def parse_mafile(path: str, data: dict) -> MaFileRecord:
+    """Проверить содержимое .maFile и собрать из него запись"""
+    error = None
+    missing_fields = [field for field in MAFILE_REQUIRED_FIELDS if field not in data]
+    if missing_fields:
+        error = f"Missing fields: {', '.join(missing_fields)}"
+
+    session = data.get("Session") or {}
+    if error is None and "SteamID" not in session:
+        error = "Missing SteamID in Session"
+
+    shared_secret = data.get("shared_secret")
+    shared_secret_bytes = None
+    if shared_secret is not None:
+        try:
+            shared_secret_bytes = base64.b64decode(shared_secret)
+        except (binascii.Error, TypeError, ValueError):
+            error = error or "Invalid shared_secret format (not base64)"
+
+    steamid = session.get("SteamID")
+    try:
+        steamid = int(steamid) if steamid is not None else None
+    except (TypeError, ValueError):
+        error = error or "Invalid SteamID in Session"
+        steamid = None
+
+    return MaFileRecord(
+        path=path,
+        account_name=data.get("account_name"),
+        shared_secret=shared_secret,
+        shared_secret_bytes=shared_secret_bytes,
+        identity_secret=data.get("identity_secret"),
+        device_id=data.get("device_id"),
+        steamid=steamid,
+        error=error,
+    )
+
+
+class MaFileStore:
+    """Потокобезопасный кэш записей .maFile с проверкой изменения файла через stat"""
+
+    def __init__(self):
+        self._records: Dict[str, Tuple[Tuple[int, int, int], MaFileRecord]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "loads": 0}
+
+    def get(self, path: str) -> MaFileRecord:
+        """
+        Запись .maFile; файл перечитывается только после его изменения.
+        FileNotFoundError и json.JSONDecodeError пробрасываются вызывающему
+        """
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+        cached = self._records.get(path)
+        if cached and cached[0] == signature:
+            self.stats["hits"] += 1
+            return cached[1]
+
+        with open(path, "r", encoding='utf-8') as f:
+            data = json.load(f)
+        record = parse_mafile(path, data)
+
+        with self._lock:
+            self._records[path] = (signature, record)
+        self.stats["loads"] += 1
+        logger.debug(f"Loaded .maFile {path} ({record.account_name})")
+        return record
+
+    def validate(self, path: str) -> dict:
+        """Результат проверки в формате SQLiteDB.validate_mafile"""
+        try:
+            record = self.get(path)
+        except FileNotFoundError:
+            return {"valid": False, "error": "File not found"}
+        except json.JSONDecodeError:
+            return {"valid": False, "error": "Invalid JSON format"}
+        except Exception as e:
+            return {"valid": False, "error": str(e)}
+
+        if not record.valid:
+            return {"valid": False, "error": record.error}
+        return {"valid": True, "record": record}
+
+    def invalidate(self, path: str):
+        """Забыть запись (файл будет перечитан при следующем обращении)"""
+        with self._lock:
+            self._records.pop(path, None)
+
+    def __len__(self):
+        return len(self._records)
+
+
+# Глобальное хранилище .maFile
+mafile_store = MaFileStore()
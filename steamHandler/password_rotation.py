@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Сервис смены паролей Steam после окончания аренды
+Задачи хранятся в таблице rotation_jobs и переживают перезапуск бота.
+Один постоянный asyncio event loop забирает задачи из базы пачками,
+выполняет их с ограниченной параллельностью, общим лимитом скорости
+и лимитом на аккаунт, а результаты записывает в базу пакетами.
+Новый пароль сохраняется в rotation_jobs до обращения к Steam, успешная
+смена записывается в accounts сразу, без ожидания пакета.
+После ROTATION_MAX_ATTEMPTS неудачных попыток задача переходит в состояние
+failed, а администратор получает одно уведомление
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import ADMIN_ID
+from logger import logger
+from steamHandler.changePassword import changeSteamPassword, generate_password
+
+ROTATION_MAX_CONCURRENCY = 10  # Одновременных смен пароля
+ROTATION_RATE_PER_MINUTE = 120  # Общий лимит запусков смены пароля в минуту
+ROTATION_ACCOUNT_INTERVAL = 60  # Минимальный интервал между сменами пароля одного аккаунта (сек)
+ROTATION_BATCH_SIZE = 50  # Максимальный размер пакета записи результатов
+ROTATION_FLUSH_INTERVAL = 2.0  # Интервал записи пакета результатов (сек)
+ROTATION_POLL_INTERVAL = 30.0  # Интервал проверки отложенных задач в базе (сек)
+ROTATION_RETRY_DELAY = 60  # Задержка перед первой повторной попыткой (сек)
+ROTATION_MAX_RETRY_DELAY = 3600  # Максимальная задержка между попытками (сек)
+ROTATION_MAX_ATTEMPTS = 10  # После стольких неудачных попыток задача становится failed
+
+
+class PasswordRotationService:
+    """Исполнитель очереди rotation_jobs с отдельным потоком event loop"""
+
+    def __init__(self, max_concurrency: int = ROTATION_MAX_CONCURRENCY,
+                 rate_per_minute: int = ROTATION_RATE_PER_MINUTE,
+                 account_interval: float = ROTATION_ACCOUNT_INTERVAL,
+                 batch_size: int = ROTATION_BATCH_SIZE,
+                 flush_interval: float = ROTATION_FLUSH_INTERVAL,
+                 poll_interval: float = ROTATION_POLL_INTERVAL):
+        self.max_concurrency = max_concurrency
+        self.rate_per_minute = rate_per_minute
+        self.account_interval = account_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+
+        self.db = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._rate_lock: Optional[asyncio.Lock] = None
+        self._next_start = 0.0
+        self._last_rotation: Dict[int, float] = {}
+        self._in_flight = 0
+        self._results: List[Tuple[int, int, int, Optional[str], Optional[str]]] = []
+        self._flush_event: Optional[asyncio.Event] = None
+        self._wake_event: Optional[asyncio.Event] = None
+        self._ready = threading.Event()
+
+        self.stats = {"claimed": 0, "changed": 0, "failed": 0, "gave_up": 0, "flushed_batches": 0}
+
+    def start(self, db):
+        """Вернуть в очередь прерванные задачи и запустить поток event loop"""
+        if self._thread and self._thread.is_alive():
+            return
+        self.db = db
+        resumed = db.reset_running_rotation_jobs()
+        if resumed:
+            logger.info(f"Resuming {resumed} interrupted password rotations")
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout=5)
+        logger.info("Password rotation service started",
+                    extra_info=f"Concurrency: {self.max_concurrency}, Rate: {self.rate_per_minute}/min")
+
+    def stop(self):
+        """Дописать накопленные результаты и остановить event loop"""
+        if not self.loop:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._flush(), self.loop)
+        try:
+            future.result(timeout=10)
+        except Exception as e:
+            logger.error(f"Error flushing rotation results on stop: {str(e)}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+    def wake(self):
+        """Сообщить, что в rotation_jobs появились новые задачи"""
+        if self.loop and self._wake_event:
+            self.loop.call_soon_threadsafe(self._wake_event.set)
+
+    def queue_size(self) -> int:
+        """Количество задач, выполняемых этим процессом"""
+        return self._in_flight
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._queue = asyncio.Queue()
+        self._rate_lock = asyncio.Lock()
+        self._flush_event = asyncio.Event()
+        self._wake_event = asyncio.Event()
+        for _ in range(self.max_concurrency):
+            self.loop.create_task(self._worker())
+        self.loop.create_task(self._claimer())
+        self.loop.create_task(self._flusher())
+        self._ready.set()
+        self.loop.run_forever()
+
+    async def _claimer(self):
+        """Забирать из базы столько готовых задач, сколько есть свободных воркеров"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake_event.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake_event.clear()
+
+            capacity = self.max_concurrency - self._in_flight
+            if capacity <= 0:
+                continue
+            try:
+                jobs = await asyncio.to_thread(self.db.claim_rotation_jobs, capacity, generate_password)
+            except Exception as e:
+                logger.error(f"Error claiming rotation jobs: {str(e)}")
+                continue
+            self._in_flight += len(jobs)
+            self.stats["claimed"] += len(jobs)
+            for job in jobs:
+                self._queue.put_nowait(job)
+
+    async def _acquire_rate_slot(self, account_id: int):
+        """Подождать общий лимит скорости и лимит на аккаунт"""
+        last = self._last_rotation.get(account_id)
+        if last is not None:
+            wait = last + self.account_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        async with self._rate_lock:
+            wait = self._next_start - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_start = time.monotonic() + 60 / self.rate_per_minute
+        self._last_rotation[account_id] = time.monotonic()
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            account_id = job["account_id"]
+            new_password, error = None, None
+            try:
+                await self._acquire_rate_slot(account_id)
+                new_password = await self._change_password(job)
+                self.stats["changed"] += 1
+                logger.password_changed(account_id, new_password)
+            except Exception as e:
+                error = str(e)
+                self.stats["failed"] += 1
+                logger.error(f"Error changing password for account {account_id} "
+                             f"(attempt {job['attempts']}): {error}")
+            finally:
+                self._results.append((job["job_id"], account_id, job["attempts"], new_password, error))
+                # Успешную смену пароля записываем сразу, пакетом копятся только ошибки
+                if new_password or len(self._results) >= self.batch_size:
+                    self._flush_event.set()
+                self._queue.task_done()
+
+    async def _change_password(self, job: dict) -> str:
+        """Сменить пароль на сохраненный в задаче; при повторе учесть, что он мог уже примениться"""
+        try:
+            return await changeSteamPassword(job["path_to_maFile"], job["password"], job["new_password"])
+        except Exception:
+            if not job["password_saved"]:
+                raise
+            # Прошлая попытка могла сменить пароль, но процесс завершился до записи результата -
+            # тогда в Steam уже действует пароль из задачи
+            logger.warning(f"Retrying password change for account {job['account_id']} "
+                           f"with the password saved by the previous attempt")
+            try:
+                return await changeSteamPassword(job["path_to_maFile"], job["new_password"], job["new_password"])
+            except Exception as e:
+                logger.debug(f"Saved password did not work for account {job['account_id']}: {str(e)}")
+            raise
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error(f"Error flushing rotation results: {str(e)}")
+
+    async def _flush(self):
+        if not self._results:
+            return
+        batch, self._results = self._results, []
+        written = await asyncio.to_thread(
+            self.db.complete_rotation_jobs, batch, ROTATION_RETRY_DELAY, ROTATION_MAX_RETRY_DELAY,
+            ROTATION_MAX_ATTEMPTS
+        )
+        if not written:
+            # Новые пароли нельзя терять - повторим запись со следующим пакетом
+            self._results = batch + self._results
+            return
+        self.stats["flushed_batches"] += 1
+        self._in_flight -= len(batch)
+        # Освободились воркеры - можно забрать следующие задачи
+        self._wake_event.set()
+
+        # Задача становится failed только один раз - при записи этого пакета
+        gave_up = [result for result in batch if not result[3] and result[2] >= ROTATION_MAX_ATTEMPTS]
+        if gave_up:
+            self.stats["gave_up"] += len(gave_up)
+            await asyncio.to_thread(self._notify_admin, gave_up)
+
+    def _notify_admin(self, gave_up: list):
+        """Сообщить администратору о задачах, исчерпавших попытки"""
+        lines = "\n".join(f"• аккаунт ID {account_id} (задача #{job_id}): {error}"
+                          for job_id, account_id, _, _, error in gave_up)
+        admin_message = (
+            f"⚠️ Не удалось сменить пароль Steam\n\n"
+            f"Попыток: {ROTATION_MAX_ATTEMPTS}, аккаунты сняты с продажи:\n{lines}\n\n"
+            f"Если пароль в базе не подходит, проверьте пароль, сохраненный задачей (в /rotations).\n"
+            f"Список: /rotations, повтор: /rotation_retry <ID задачи | all>"
+        )
+        logger.error(f"Password rotation gave up for accounts {[result[1] for result in gave_up]}")
+        try:
+            from botHandler.bot import bot
+            # Без parse_mode: текст ошибки может содержать символы Markdown
+            bot.send_message(ADMIN_ID, admin_message)
+        except Exception as e:
+            logger.error(f"Failed to notify admin about failed password rotation: {str(e)}")
+
+
+# Глобальный экземпляр сервиса
+password_rotation = PasswordRotationService()
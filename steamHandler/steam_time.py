@@ -0,0 +1,119 @@
+"""
+Синхронизация времени с серверами Steam
+Смещение измеряется один раз и обновляется в фоне по расписанию со случайным разбросом,
+поэтому генерация Steam Guard кода не делает сетевых запросов
+"""
+
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+
+try:
+    from logger import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+STEAM_QUERY_TIME_URL = "https://api.steampowered.com/ITwoFactorService/QueryTime/v0001"
+STEAM_TIME_REFRESH_INTERVAL = 1800  # Интервал обновления смещения (сек)
+STEAM_TIME_JITTER = 0.2  # Случайный разброс интервала (доля от интервала)
+STEAM_TIME_RETRY_DELAY = 30  # Первая повторная попытка после ошибки (сек)
+STEAM_TIME_REQUEST_TIMEOUT = 10  # Таймаут запроса к Steam (сек)
+
+
+class SteamTimeSync:
+    """Процессный сервис смещения времени Steam с фоновым обновлением"""
+
+    def __init__(self, refresh_interval: float = STEAM_TIME_REFRESH_INTERVAL,
+                 jitter: float = STEAM_TIME_JITTER,
+                 retry_delay: float = STEAM_TIME_RETRY_DELAY,
+                 timeout: float = STEAM_TIME_REQUEST_TIMEOUT):
+        self.refresh_interval = refresh_interval
+        self.jitter = jitter
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+        self._offset = 0.0
+        self._synced_at: Optional[float] = None  # time.monotonic() последней успешной синхронизации
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.running = False
+
+    @property
+    def offset(self) -> float:
+        """Текущее смещение Steam относительно локальных часов (0, если синхронизации еще не было)"""
+        return self._offset
+
+    @property
+    def offset_age(self) -> Optional[float]:
+        """Сколько секунд прошло с последней успешной синхронизации (None - не было ни одной)"""
+        if self._synced_at is None:
+            return None
+        return time.monotonic() - self._synced_at
+
+    def now(self) -> float:
+        """Время Steam по локальным часам и последнему известному смещению"""
+        if not self.running:
+            self.start()
+        return time.time() + self._offset
+
+    def start(self):
+        """Запустить фоновое обновление смещения (первая синхронизация выполняется сразу)"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.running = False
+        self._wakeup.set()
+
+    def request_sync(self):
+        """Разбудить фоновый поток для внеочередной синхронизации"""
+        self._wakeup.set()
+
+    def sync(self) -> bool:
+        """Измерить смещение одним запросом QueryTime; при ошибке сохраняется прежнее значение"""
+        try:
+            started = time.time()
+            response = requests.post(STEAM_QUERY_TIME_URL, timeout=self.timeout)
+            finished = time.time()
+            server_time = int(response.json()["response"]["server_time"])
+            # Сервер отвечает целыми секундами - сравниваем с серединой запроса
+            self._offset = server_time - (started + finished) / 2
+            self._synced_at = time.monotonic()
+            self._failures = 0
+            logger.debug(f"Steam server time offset: {self._offset:.2f} seconds")
+            return True
+        except Exception as e:
+            self._failures += 1
+            age = self.offset_age
+            logger.warning(
+                f"Failed to get Steam server time: {str(e)}, using offset {self._offset:.2f}s "
+                f"({'never synced' if age is None else f'{age:.0f}s old'})"
+            )
+            return False
+
+    def _next_delay(self) -> float:
+        if self._failures:
+            delay = min(self.refresh_interval, self.retry_delay * 2 ** (self._failures - 1))
+        else:
+            delay = self.refresh_interval
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _run(self):
+        while self.running:
+            self.sync()
+            self._wakeup.wait(self._next_delay())
+            self._wakeup.clear()
+
+
+# Глобальный экземпляр сервиса
+steam_time = SteamTimeSync()
@@ -11,6 +11,7 @@ from dataclasses import dataclass
 from enum import Enum
 
 from databaseHandler.databaseSetup import SQLiteDB
+from databaseHandler.activity_journal import get_activity_journal
 from security.encryption import get_secure_data_manager
 from logger import logger
 
@@ -59,6 +60,7 @@ class UserManager:
     
     def __init__(self):
         self.db = SQLiteDB()
+        self.activity_journal = get_activity_journal(self.db.db_name)
         self.secure_manager = get_secure_data_manager()
         self._create_user_tables()
         logger.info("UserManager initialized")
@@ -168,6 +170,7 @@ class UserManager:
     
     def get_user_profile(self, user_id: int) -> Optional[UserProfile]:
         """Получает профиль пользователя"""
+        self.activity_journal.flush()
         try:
             cursor = self.db.conn.cursor()
             cursor.execute(
@@ -204,24 +207,19 @@ class UserManager:
                            ip_address: str = None, user_agent: str = None) -> bool:
         """Обновляет активность пользователя"""
         try:
-            cursor = self.db.conn.cursor()
-            
-            # Обновляем время последней активности
-            cursor.execute(
+            # Обновляем время последней активности (запись отложенная, см. activity_journal)
+            self.activity_journal.record(
                 "UPDATE user_profiles SET last_activity = ? WHERE user_id = ?",
                 (datetime.now(), user_id)
             )
             
             # Записываем действие в лог
-            cursor.execute(
+            self.activity_journal.record(
                 """INSERT INTO user_activity_log 
                    (user_id, action, details, ip_address, user_agent)
                    VALUES (?, ?, ?, ?, ?)""",
                 (user_id, action, details, ip_address, user_agent)
             )
-            
-            self.db.conn.commit()
-            cursor.close()
             return True
             
         except Exception as e:
@@ -403,6 +401,7 @@ class UserManager:
     
     def get_user_activity_log(self, user_id: int, limit: int = 50) -> List[Dict]:
         """Получает лог активности пользователя"""
+        self.activity_journal.flush()
         try:
             cursor = self.db.conn.cursor()
             cursor.execute(